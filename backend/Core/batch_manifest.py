@@ -0,0 +1,102 @@
+import threading
+from datetime import datetime, timezone
+from typing import List, Optional
+
+MANIFEST_FILENAME = "batch_manifest.json"
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+class BatchManifest:
+    """
+    Checkpoint of one job's LLM stage, kept at json/batch_manifest.json: every batch's pages,
+    model, status (pending / running / done / failed), attempt count, the sha256 of its CSV and the
+    pages flagged when the batch had to be bisected.
+    It is rewritten after every change, so a run that died or partly failed can be picked up
+    by Core.resume_llm_on_images without redoing the batches that finished.
+
+    `planned` turns true once every batch is known; the streaming pipeline adds batches
+    while pages are still being rendered.
+    """
+
+    def __init__(self, file_manager, user_id: str, job_id: str, prompt_sha256: str, model: str,
+                 batches: Optional[List[dict]] = None, planned: bool = False):
+        self.file_manager = file_manager
+        self.user_id = user_id
+        self.job_id = job_id
+        self.prompt_sha256 = prompt_sha256
+        self.model = model
+        self.batches = batches or []
+        self.planned = planned
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, file_manager, user_id: str, job_id: str) -> Optional["BatchManifest"]:
+        data = file_manager.get_job_json(user_id, job_id, MANIFEST_FILENAME)
+        if data is None:
+            return None
+        return cls(file_manager, user_id, job_id, data["prompt_sha256"], data["model"], data["batches"], data["planned"])
+
+    def add_batch(self, files: List[str], model: str | None = None) -> int:
+        """Record a new pending batch for `model` (None: the manifest's model); returns its 0-based batch number."""
+        with self.lock:
+            self.batches.append({"batch": len(self.batches) + 1, "pages": list(files), "model": model or self.model,
+                                 "status": PENDING,
+                                 "attempts": 0, "csv": None, "csv_sha256": None, "error": None, "flagged_pages": [],
+                                 "updated_at": _now()})
+            self._save()
+            return len(self.batches) - 1
+
+    def mark_planned(self):
+        with self.lock:
+            self.planned = True
+            self._save()
+
+    def start(self, batch_num: int):
+        self._update(batch_num, status=RUNNING, attempts=self.batches[batch_num]["attempts"] + 1, error=None)
+
+    def finish(self, batch_num: int, csv_filename: str, csv_sha256: str, flagged_pages: List[dict] = ()):
+        self._update(batch_num, status=DONE, csv=csv_filename, csv_sha256=csv_sha256, flagged_pages=list(flagged_pages))
+
+    def fail(self, batch_num: int, error: str | None = None, flagged_pages: List[dict] = ()):
+        self._update(batch_num, status=FAILED, csv=None, csv_sha256=None, error=error, flagged_pages=list(flagged_pages))
+
+    def unfinished(self, csv_sha256_of) -> List[int]:
+        """
+        Batches to run again: everything not done, plus done batches whose CSV is missing or changed.
+        csv_sha256_of(filename) returns the current hash of a batch CSV, or None if it's gone.
+        """
+        return [n for n, b in enumerate(self.batches)
+                if b["status"] != DONE or csv_sha256_of(b["csv"]) != b["csv_sha256"]]
+
+    def failed(self) -> List[dict]:
+        return [{"batch": b["batch"], "pages": b["pages"]} for b in self.batches if b["status"] == FAILED]
+
+    def flagged_pages(self) -> List[dict]:
+        return [page for b in self.batches for page in b.get("flagged_pages", [])]
+
+    def summary(self) -> dict:
+        counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        for b in self.batches:
+            counts[b["status"]] += 1
+        return {"batches": len(self.batches), "planned": self.planned, **counts}
+
+    def _update(self, batch_num: int, **fields):
+        with self.lock:
+            self.batches[batch_num].update(fields, updated_at=_now())
+            self._save()
+
+    def _save(self):
+        self.file_manager.save_json_as(self.user_id, self.job_id, {
+            "prompt_sha256": self.prompt_sha256,
+            "model": self.model,
+            "planned": self.planned,
+            "batches": self.batches,
+        }, MANIFEST_FILENAME)
@@ -0,0 +1,123 @@
+import math
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+from FileManager.FileManager import is_text_page
+from Core.llm_client import CHARS_PER_TOKEN
+
+
+def image_tokens(width: int, height: int) -> int:
+    """
+    Input tokens of a high-detail image: scaled to fit 2048x2048, then so the short side
+    is at most 768 px, and billed 170 tokens per 512 px tile plus 85.
+    """
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def text_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def estimate_page_tokens(path: Path, filename: str) -> int:
+    # page label blocks ("(This is page 12.)") are counted too
+    label = 12
+    if is_text_page(filename):
+        return text_tokens(path.read_text(encoding="utf-8")) + 2 * label
+    with Image.open(path) as img:  # only reads the header
+        return image_tokens(*img.size) + label
+
+
+@dataclass
+class PlannedBatch:
+    files: List[str] = field(default_factory=list)
+    tokens: int = 0
+    latency_s: float = 0.0
+    model: Optional[str] = None  # set when pages are routed to different models
+
+    def to_dict(self, batch_num: int) -> dict:
+        return {"batch": batch_num + 1, "files": self.files, "est_tokens": self.tokens,
+                "est_latency_s": round(self.latency_s, 2), "model": self.model}
+
+
+@dataclass(frozen=True)
+class BatchPlanner:
+    """
+    Packs pages, in page order, into batches that stay under a token budget and an estimated
+    latency, with at most max_pages pages each. A page that is over budget on its own gets a batch
+    to itself. Latency is modelled as base + input tokens / prefill rate + pages * output time per page.
+    """
+    token_budget: Optional[int] = 24000    # None: no token limit
+    max_latency_s: Optional[float] = 90.0  # None: no latency limit
+    max_pages: int = 10
+    output_tokens_per_page: int = 120
+    base_latency_s: float = 2.0
+    prefill_tokens_per_s: float = 4000.0
+    output_tokens_per_s: float = 60.0
+
+    def batch_tokens(self, prompt_tokens: int, page_tokens: int, pages: int) -> int:
+        return prompt_tokens + page_tokens + pages * self.output_tokens_per_page
+
+    def batch_latency(self, tokens: int, pages: int) -> float:
+        output = pages * self.output_tokens_per_page
+        return self.base_latency_s + (tokens - output) / self.prefill_tokens_per_s + output / self.output_tokens_per_s
+
+    def packer(self, prompt_tokens: int) -> "BatchPacker":
+        return BatchPacker(self, prompt_tokens)
+
+    def plan(self, prompt_tokens: int, pages: List[Tuple[str, int]]) -> List[PlannedBatch]:
+        packer = self.packer(prompt_tokens)
+        batches = [batch for filename, tokens in pages for batch in packer.add(filename, tokens)]
+        return batches + packer.flush()
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class BatchPacker:
+    """Incremental form of BatchPlanner.plan(); the streaming pipeline feeds pages as they are rendered."""
+
+    def __init__(self, planner: BatchPlanner, prompt_tokens: int):
+        self.planner = planner
+        self.prompt_tokens = prompt_tokens
+        self.current = PlannedBatch()
+        self.page_tokens = 0
+
+    def _fits(self, tokens: int) -> bool:
+        planner = self.planner
+        pages = len(self.current.files) + 1
+        total = planner.batch_tokens(self.prompt_tokens, self.page_tokens + tokens, pages)
+        if pages > planner.max_pages:
+            return False
+        if planner.token_budget is not None and total > planner.token_budget:
+            return False
+        return planner.max_latency_s is None or planner.batch_latency(total, pages) <= planner.max_latency_s
+
+    def add(self, filename: str, tokens: int) -> List[PlannedBatch]:
+        """Add a page; returns the batches it closed, if any."""
+        closed = []
+        if self.current.files and not self._fits(tokens):
+            closed = self.flush()
+        self.current.files.append(filename)
+        self.page_tokens += tokens
+        if len(self.current.files) >= self.planner.max_pages:
+            # nothing else can join, so don't wait for the next page to close it
+            closed += self.flush()
+        return closed
+
+    def flush(self) -> List[PlannedBatch]:
+        if not self.current.files:
+            return []
+        batch = self.current
+        pages = len(batch.files)
+        batch.tokens = self.planner.batch_tokens(self.prompt_tokens, self.page_tokens, pages)
+        batch.latency_s = self.planner.batch_latency(batch.tokens, pages)
+        self.current = PlannedBatch()
+        self.page_tokens = 0
+        return [batch]
@@ -12,25 +12,197 @@ import csv
 import json
 import hashlib
 from datetime import datetime
+from dataclasses import asdict, replace
 import uuid
-from typing import Dict, Any, List, Optional, Iterable, Tuple
+import time
+from typing import Dict, Any, List, Optional, Iterable, Tuple, Callable
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import queue
+import threading
 
-from collections import defaultdict
-from FileManager.FileManager import FileManager
+from collections import defaultdict, deque
+from FileManager.FileManager import (FileManager, page_number_from_filename, tile_from_filename, image_mime_type, is_text_page,
+                                     page_variant_subdir, batch_csv_filename)
 from Services.ContactService import ContactService
+from Core.triage import PageTriage, load_gray, ink_coverage
+from Core.llm_client import LLMClient, RateLimiter, RetryPolicy, Hedging, CircuitBreaker, is_retryable
+from Core.response_cache import LLMResponseCache, CacheStats, response_cache_key
+from Core.csv_stream import iter_csv_rows, is_csv_header, MalformedAnswerError, CSV_HEADER
+from Core.batch_manifest import BatchManifest, MANIFEST_FILENAME
+from Core.batch_planner import BatchPlanner, PlannedBatch, estimate_page_tokens, text_tokens
+from Core.model_router import ModelRouter, ModelUsage, RouteDecision, sheet_discipline
+from Core.payload import ImageData, image_block
+from Core.rendering import (ImageProfile, TilingConfig, get_image_profile, page_image_filename, page_text_filename,
+                            extract_page_text, count_text_chars, plan_page_tiles, render_page_parts, render_page_slice,
+                            render_page_image, split_into_slices, parse_page_selection, PdfDocumentCache,
+                            PAGE_VARIANTS, variant_profile, format_page_selection)
 from Utils.logger import get_logger
 log = get_logger(__name__)
 
 api_key = os.getenv("OPENAI_API_KEY")
+# OpenAI-compatible endpoint to use instead of api.openai.com, e.g. the local stand-in
+# (python -m Utils.fake_llm_server) for offline load tests
+llm_base_url = os.getenv("LLM_BASE_URL") or None
+llm_model = os.getenv("LLM_MODEL", "gpt-4o")
+# Number of processes used to rasterize pages. 1 keeps rendering on the calling thread.
+render_workers = int(os.getenv("RENDER_WORKERS", "1"))
+# Reuse rendered pages across jobs that upload the same PDF bytes (see FileManager render cache)
+use_render_cache = os.getenv("RENDER_CACHE", "1") != "0"
+# Resolution / colour / encoding used for LLM page images (see Core.rendering.IMAGE_PROFILES)
+image_profile = get_image_profile(os.getenv("IMAGE_PROFILE", "default"))
+# Drop blank and near-duplicate pages before they reach the LLM
+page_triage = os.getenv("PAGE_TRIAGE", "1") != "0"
+# Pages whose text layer has at least this many non-whitespace characters are sent to the LLM as text
+# instead of being rasterized. 0 turns the text fast path off.
+text_layer_min_chars = int(os.getenv("TEXT_LAYER_MIN_CHARS", "200"))
+# Sheets whose full pixmap would exceed RENDER_PAGE_MEMORY_MB are rendered as overlapping tiles.
+# RENDER_TILE_SIZE=0 (the default) renders every page whole.
+tile_size = int(os.getenv("RENDER_TILE_SIZE", "0"))
+tiling = TilingConfig(
+    tile_size=tile_size,
+    overlap=int(os.getenv("RENDER_TILE_OVERLAP", "128")),
+    page_memory_budget=int(os.getenv("RENDER_PAGE_MEMORY_MB", "64")) * 1024 * 1024,
+) if tile_size > 0 else None
+# Number of LLM batches in flight at once (thread pool). 1 sends batches one after another.
+llm_concurrency = int(os.getenv("LLM_CONCURRENCY", "4"))
+# Account quota for the LLM (set LLM_RPM / LLM_TPM to your organisation's limits).
+# One limiter per process, shared by every job, keeps concurrent jobs under it.
+llm_rate_limiter = RateLimiter(
+    requests_per_minute=int(os.getenv("LLM_RPM", "500")),
+    tokens_per_minute=int(os.getenv("LLM_TPM", "150000")),
+)
+# Retries for 429 / 5xx / connection errors (exponential backoff with jitter, or the server's Retry-After)
+llm_retry = RetryPolicy(max_retries=int(os.getenv("LLM_MAX_RETRIES", "5")))
+# Hedged LLM calls (LLM_HEDGE=1): a batch still waiting at the LLM_HEDGE_PERCENTILE latency of recent calls
+# gets a duplicate request and the first answer wins. LLM_HEDGE_BUDGET caps duplicates as a share of requests.
+llm_hedging = Hedging(
+    percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "95")),
+    budget_ratio=float(os.getenv("LLM_HEDGE_BUDGET", "0.05")),
+) if os.getenv("LLM_HEDGE", "0") != "0" else None
+# Circuit breaker in front of the provider: opens when LLM_BREAKER_ERROR_RATE of the calls in the last minute
+# (at least LLM_BREAKER_MIN_REQUESTS) failed, then probes again after LLM_BREAKER_OPEN_S. While open, batches
+# fail fast (and can be resumed) or, with LLM_BREAKER_MODE=park, wait up to LLM_BREAKER_MAX_PARK_S for it.
+# State: GET /llm/status. LLM_BREAKER=0 turns it off.
+llm_breaker = CircuitBreaker(
+    failure_rate=float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5")),
+    min_requests=int(os.getenv("LLM_BREAKER_MIN_REQUESTS", "10")),
+    open_s=float(os.getenv("LLM_BREAKER_OPEN_S", "30")),
+    park=os.getenv("LLM_BREAKER_MODE", "fail") == "park",
+    max_park_s=float(os.getenv("LLM_BREAKER_MAX_PARK_S", "300")),
+) if os.getenv("LLM_BREAKER", "1") != "0" else None
+# Reuse LLM answers for identical requests (model, prompt, page contents), across jobs and restarts
+use_llm_cache = os.getenv("LLM_CACHE", "1") != "0"
+llm_cache_path = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+llm_cache_max_bytes = int(os.getenv("LLM_CACHE_MAX_MB", "256")) * 1024 * 1024
+# Pack pages into LLM batches by estimated tokens / latency instead of a fixed page count.
+# BATCH_TOKEN_BUDGET=0 goes back to fixed batches of batch_size pages.
+batch_token_budget = int(os.getenv("BATCH_TOKEN_BUDGET", "24000"))
+batch_planner = BatchPlanner(
+    token_budget=batch_token_budget,
+    max_latency_s=float(os.getenv("BATCH_MAX_LATENCY_S", "90")),
+) if batch_token_budget > 0 else None
+# Send simple pages (notes, cover sheets, sparse drawings) to LLM_SMALL_MODEL and only dense drawings to LLM_MODEL,
+# by a per-page complexity score (ink, text length, sheet discipline; see Core.model_router) of at least
+# LLM_ROUTING_THRESHOLD. LLM_ROUTING=0 sends every page to LLM_MODEL.
+model_router = ModelRouter(
+    small_model=os.getenv("LLM_SMALL_MODEL", "gpt-4o-mini"),
+    large_model=llm_model,
+    threshold=float(os.getenv("LLM_ROUTING_THRESHOLD", "0.5")),
+) if os.getenv("LLM_ROUTING", "1") != "0" else None
+# Split a batch that gets a non-retryable error or malformed CSV in half and retry each half, down to
+# single pages; pages that still fail on their own are flagged in the job metadata ("flagged_pages")
+llm_bisect = os.getenv("LLM_BISECT", "1") != "0"
+# Stream LLM answers and parse CSV rows as they arrive; each batch CSV is written row by row
+llm_stream = os.getenv("LLM_STREAM", "0") != "0"
+# Build each request's JSON body once, base64-encoding page images straight from memory-mapped files into it,
+# instead of inlining every image as a str and letting the OpenAI client serialize the messages again
+llm_prebuilt_body = os.getenv("LLM_PREBUILT_BODY", "1") != "0"
+# Also write thumbnail / preview renditions (Core.rendering.PAGE_VARIANTS) while rasterizing
+page_previews = os.getenv("PAGE_PREVIEWS", "1") != "0"
 
 class Core:
-    def __init__(self, file_manager, contact_service: ContactService):
+    def __init__(self, file_manager, contact_service: ContactService, render_workers: int = render_workers,
+                 use_render_cache: bool = use_render_cache, image_profile: ImageProfile = image_profile,
+                 page_triage: bool = page_triage, text_layer_min_chars: int = text_layer_min_chars,
+                 tiling: TilingConfig | None = tiling, page_previews: bool = page_previews,
+                 llm_concurrency: int = llm_concurrency, use_llm_cache: bool = use_llm_cache,
+                 batch_planner: BatchPlanner | None = batch_planner, client=None, base_url: str | None = llm_base_url,
+                 stream_llm: bool = llm_stream, bisect_failed_batches: bool = llm_bisect,
+                 model_router: ModelRouter | None = model_router, prebuilt_body: bool = llm_prebuilt_body,
+                 on_progress: Callable[..., None] | None = None):
         self.file_manager = file_manager
-        self.client = openai.OpenAI(api_key=api_key)
+        # `client` overrides the OpenAI client outright (any object with chat.completions.create);
+        # otherwise one is built for base_url. Retries are done by LLMClient, so the client's own are off.
+        if client is None:
+            # a local endpoint doesn't need a real key
+            client = openai.OpenAI(api_key=api_key or ("local" if base_url else None), base_url=base_url, max_retries=0)
+        self.llm = LLMClient(client, llm_rate_limiter, llm_retry, hedging=llm_hedging, breaker=llm_breaker,
+                             prebuilt_body=prebuilt_body)
         self.contact_service = contact_service
+        self.render_workers = max(1, render_workers)
+        self.use_render_cache = use_render_cache
+        self.image_profile = image_profile
+        self.page_triage = page_triage
+        self.text_layer_min_chars = text_layer_min_chars
+        self.tiling = tiling
+        self.page_variants = tuple(PAGE_VARIANTS) if page_previews else ()
+        self.llm_model = llm_model
+        self.llm_concurrency = max(1, llm_concurrency)
+        self.response_cache = LLMResponseCache(llm_cache_path, llm_cache_max_bytes) if use_llm_cache else None
+        self.batch_planner = batch_planner
+        self.stream_llm = stream_llm
+        self.bisect_failed_batches = bisect_failed_batches
+        self.model_router = model_router
+        # on_progress(job_id, event, **data) is told about every page rendered and LLM batch finished
+        # (see Services.ProgressBroker); it is called from the render / LLM worker threads
+        self.on_progress = on_progress
+        # open PDFs kept around for on-demand page renders (render_page)
+        self.pdf_docs = PdfDocumentCache(capacity=4)
 
-    def extract_images(self, user_id, job_id, pdf_ref, start_page: int | None = None, end_page: int | None = None) -> StorageRef:
+    def llm_status(self) -> dict:
+        # provider health as this process sees it (circuit breaker, hedging)
+        llm = self.llm
+        return {
+            "model": self.llm_model,
+            "routing": self.model_router.to_dict() if self.model_router is not None else None,
+            "circuit": llm.breaker.snapshot() if llm.breaker is not None else None,
+            "hedging": llm.hedging.stats() if llm.hedging is not None else None,
+        }
+
+    @property
+    def client(self):
+        # the OpenAI-compatible client behind the rate limiter / retries
+        return self.llm.client
+
+    @client.setter
+    def client(self, client):
+        self.llm.client = client
+
+    def extract_images(self, user_id, job_id, pdf_ref, start_page: int | None = None, end_page: int | None = None,
+                       workers: int | None = None, profile: ImageProfile | None = None, pages=None) -> StorageRef:
         log.info("Extracting images from PDF", extra={"user_id": user_id, "job_id": job_id})
+        # 1. Get the path or location of the folder where you're storing the images (user_id, job_id)
+        images_ref = self.file_manager.get_images_dir(user_id, job_id)
+        # 2. Go through all the images and then tell the file manager to save them (user_id, job_id)
+        image_counter = 0
+        for _ in self.iter_extract_images(user_id, job_id, pdf_ref, start_page, end_page, workers, profile, pages):
+            image_counter += 1
+        # 3. After you do all that, return that path that you generated based on (user_id, job_id) in a StorageRef that has the mode. 
+        log.debug("Extracted %s images", image_counter)
+        return images_ref
+
+    def iter_extract_images(self, user_id, job_id, pdf_ref, start_page: int | None = None, end_page: int | None = None,
+                            workers: int | None = None, profile: ImageProfile | None = None, pages=None):
+        """
+        Render the page range and yield each page filename as soon as it is saved.
+        `pages` (a selection like "all", "1-5,8" or [1, 3], see parse_page_selection) takes
+        precedence over start_page/end_page.
+        Pages with a usable text layer are saved as page_<n>.txt instead of being rasterized;
+        the per-page routing is recorded under "page_routing" in the job metadata.
+        Thumbnail / preview renditions of each rasterized page are saved under previews/<variant>/
+        from the same render pass; only the LLM images are yielded.
+        extract_images() drains this; the streaming pipeline consumes it page by page.
+        """
         pdf_path = self.file_manager.load_file(pdf_ref)
         pdf_path = Path(pdf_path)
 
@@ -42,131 +214,773 @@ class Core:
         num_pages = len(doc)
         #print(f"PDF loaded with {num_pages} page")
 
-        # Handle defaults
-        if start_page is None:
-            start_page = 1
-        if end_page is None:
-            end_page = num_pages
+        if pages is not None:
+            try:
+                page_numbers = parse_page_selection(pages, num_pages)
+            except ValueError:
+                doc.close()
+                raise
+        else:
+            # Handle defaults
+            if start_page is None:
+                start_page = 1
+            if end_page is None:
+                end_page = num_pages
 
-        # Validate range
-        if start_page < 1 or end_page > num_pages or start_page > end_page:
-            raise ValueError(
-                f"Invalid page range: {start_page}–{end_page} for {num_pages} pages."
-            )
+            # Validate range
+            if start_page < 1 or end_page > num_pages or start_page > end_page:
+                doc.close()
+                raise ValueError(
+                    f"Invalid page range: {start_page}–{end_page} for {num_pages} pages."
+                )
 
-        # 1. Get the path or location of the folder where you're storing the images (user_id, job_id)
-        images_ref = self.file_manager.get_images_dir(user_id, job_id)
-        # 2. Go through all the images and then tell the file manager to save them (user_id, job_id)
-        image_counter = 0
-        for page_num in range(start_page - 1, end_page):
-            page = doc.load_page(page_num)
-            pix = page.get_pixmap(dpi=200)
-            filename = f"page_{page_num + 1}.png"
-
-            img_bytes = pix.tobytes("png")
-            self.file_manager.save_image(user_id, job_id, filename, img_bytes)
-            #print(f"Saved image: {filename}")
-            image_counter += 1
+            page_numbers = list(range(start_page, end_page + 1))
+        workers = self.render_workers if workers is None else max(1, workers)
+        profile = profile or self.image_profile
 
-        doc.close()
-        # 3. After you do all that, return that path that you generated based on (user_id, job_id) in a StorageRef that has the mode. 
-        log.debug("Extracted %s images", image_counter)
-        return images_ref
+        # Route each page: text layer when there is enough of it, otherwise rasterize
+        page_texts = {}
+        part_tags = {}
+        routing = []
+        for page_number in page_numbers:
+            text = extract_page_text(doc, page_number) if self.text_layer_min_chars > 0 else ""
+            text_chars = count_text_chars(text)
+            route = "text" if self.text_layer_min_chars > 0 and text_chars >= self.text_layer_min_chars else "image"
+            if route == "text":
+                page_texts[page_number] = text
+                files = [page_text_filename(page_number)]
+            else:
+                part_tags[page_number] = self._page_part_tags(doc, page_number, profile)
+                files = [page_image_filename(page_number, profile, tag) for tag in part_tags[page_number]]
+            routing.append({"page": page_number, "route": route, "text_chars": text_chars,
+                            "discipline": sheet_discipline(text), "files": files})
+        image_pages = [n for n in page_numbers if n not in page_texts]
+        # an earlier render of another selection / profile leaves files this one must not pick up
+        self._clear_stale_pages(user_id, job_id, routing, image_pages, profile)
+        self.file_manager.update_job_metadata(user_id, job_id, {"page_routing": {
+            "min_text_chars": self.text_layer_min_chars,
+            "text_pages": len(page_texts),
+            "image_pages": len(image_pages),
+            "pages": routing,
+        }})
+
+        # Look up already rendered pages for these exact PDF bytes / dpi / format (and tiling)
+        pdf_hash = self.file_manager.hash_file(pdf_ref) if self.use_render_cache else None
+        cached = {}
+        if pdf_hash:
+            for page_number in image_pages:
+                parts = {}
+                for tag in part_tags[page_number]:
+                    parts[tag] = self.file_manager.get_cached_render(pdf_hash, page_number, profile.dpi, self._part_cache_format(profile, tag))
+                variants = {}
+                for variant in self.page_variants:
+                    vp = variant_profile(variant, profile)
+                    variants[variant] = self.file_manager.get_cached_render(pdf_hash, page_number, vp.dpi, self._variant_cache_format(variant, vp))
+                if all(parts.values()) and all(variants.values()):
+                    cached[page_number] = (parts, variants)
+            log.debug("Render cache lookup", extra={"job_id": job_id, "hits": len(cached), "pages": len(image_pages)})
+
+        misses = [n for n in image_pages if n not in cached]
+        rendered = self._render_pages(doc, str(pdf_path), misses, workers, profile)
+        try:
+            for done_pages, page_number in enumerate(page_numbers, start=1):
+                if page_number in page_texts:
+                    filename = page_text_filename(page_number)
+                    self.file_manager.save_page_text(user_id, job_id, filename, page_texts[page_number])
+                    self._emit_progress(job_id, "page", page=page_number, rendered=done_pages, total=len(page_numbers))
+                    yield filename
+                    continue
+
+                saved = []
+                if page_number in cached:
+                    parts, variants = cached[page_number]
+                    for variant, cached_path in variants.items():
+                        filename = page_image_filename(page_number, variant_profile(variant, profile))
+                        self.file_manager.link_cached_image(user_id, job_id, filename, cached_path, page_variant_subdir(variant))
+                    for tag, cached_path in parts.items():
+                        filename = page_image_filename(page_number, profile, tag)
+                        self.file_manager.link_cached_image(user_id, job_id, filename, cached_path)
+                        saved.append(filename)
+                else:
+                    # whole page, or one file per tile for oversized sheets
+                    _, (parts, variants) = next(rendered)
+                    for variant, img_bytes in variants.items():
+                        self._save_page_variant(user_id, job_id, pdf_hash, page_number, variant_profile(variant, profile), variant, img_bytes)
+                    for tag, img_bytes in parts:
+                        filename = page_image_filename(page_number, profile, tag)
+                        if pdf_hash:
+                            cached_path = self.file_manager.save_cached_render(pdf_hash, page_number, profile.dpi,
+                                                                               self._part_cache_format(profile, tag), img_bytes)
+                            self.file_manager.link_cached_image(user_id, job_id, filename, cached_path)
+                        else:
+                            self.file_manager.save_image(user_id, job_id, filename, img_bytes)
+                        #print(f"Saved image: {filename}")
+                        saved.append(filename)
+                self._emit_progress(job_id, "page", page=page_number, rendered=done_pages, total=len(page_numbers))
+                yield from saved
+        finally:
+            rendered.close()
+            doc.close()
+
+    def _clear_stale_pages(self, user_id, job_id, routing: List[dict], image_pages: List[int], profile: ImageProfile):
+        # keep only the page files (and previews) the current selection / routing produces
+        keep = {f for page in routing for f in page["files"]}
+        self.file_manager.clear_job_files(user_id, job_id, "images", keep=lambda path: str(path) in keep)
+        for variant in PAGE_VARIANTS:
+            previews = ({page_image_filename(n, variant_profile(variant, profile)) for n in image_pages}
+                        if variant in self.page_variants else set())
+            self.file_manager.clear_job_files(user_id, job_id, page_variant_subdir(variant),
+                                              keep=lambda path: str(path) in previews)
+
+    def get_page_files(self, user_id, job_id, images_ref) -> List[str]:
+        """
+        The page files of the job's current selection, in page order, as recorded in "page_routing" by
+        iter_extract_images. Jobs rendered before the files were recorded fall back to the images dir.
+        """
+        pages = (self.file_manager.get_job_metadata(user_id, job_id).get("page_routing") or {}).get("pages")
+        if not pages or any("files" not in page for page in pages):
+            return self.file_manager.get_page_files(images_ref)
+        return [f for page in pages for f in page["files"]]
+
+    def resolve_page_selection(self, pdf_ref, pages) -> str:
+        """Validate a page selection against the PDF and return its canonical form ("1-3,5")."""
+        pdf_path = self.file_manager.load_file(pdf_ref)
+        with self.pdf_docs.open(pdf_path, lambda: self.file_manager.hash_file(pdf_ref)) as (doc, _):
+            num_pages = len(doc)
+        return format_page_selection(parse_page_selection(pages, num_pages))
+
+    def pipeline_fingerprint(self, batch_size: int) -> str:
+        """Hash of every setting that changes what the LLM stage sees; artifacts are only reused when it matches."""
+        settings = {
+            "model": self.llm_model,
+            "batch_size": batch_size,
+            "image_profile": asdict(self.image_profile),
+            "text_layer_min_chars": self.text_layer_min_chars,
+            "page_triage": self.page_triage,
+            "tiling": asdict(self.tiling) if self.tiling else None,
+            "batch_planner": self._planner(batch_size).to_dict(),
+            "model_router": self.model_router.to_dict() if self.model_router is not None else None,
+        }
+        return self._settings_sha256(settings)
+
+    def render_fingerprint(self) -> str:
+        """Hash of the settings that change which page files rendering and triage produce (a pipeline DAG input)."""
+        return self._settings_sha256({
+            "image_profile": asdict(self.image_profile),
+            "text_layer_min_chars": self.text_layer_min_chars,
+            "page_triage": self.page_triage,
+            "tiling": asdict(self.tiling) if self.tiling else None,
+            "page_variants": list(self.page_variants),
+        })
+
+    def llm_fingerprint(self, batch_size: int) -> str:
+        """Hash of the settings that change what the LLM is asked for the same pages (a pipeline DAG input)."""
+        return self._settings_sha256({
+            "model": self.llm_model,
+            "batch_size": batch_size,
+            "batch_planner": self._planner(batch_size).to_dict(),
+            "model_router": self.model_router.to_dict() if self.model_router is not None else None,
+        })
+
+    def _settings_sha256(self, settings: dict) -> str:
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def render_page(self, user_id, job_id, pdf_ref, page_number: int, profile: ImageProfile | None = None,
+                    size: str = "llm") -> Path:
+        """
+        Lazily render one page for viewing. Serves the job's extracted image when there is one,
+        otherwise renders the whole page (never tiled) on first access and keeps it in the render cache.
+        size is "llm" (the LLM image profile) or one of PAGE_VARIANTS ("thumbnail", "preview").
+        """
+        profile = profile or self.image_profile
+        if size == "llm":
+            pages_ref = self.file_manager.get_images_dir(user_id, job_id)
+            cache_format = profile.cache_format
+        else:
+            vp = variant_profile(size, profile)
+            pages_ref = self.file_manager.get_page_variant_dir(user_id, job_id, size)
+            cache_format = self._variant_cache_format(size, vp)
+            profile = vp
+        extracted = self.file_manager.get_image_path(pages_ref, page_image_filename(page_number, profile))
+        if extracted.exists():
+            return extracted
+
+        pdf_path = self.file_manager.load_file(pdf_ref)
+        # only this PDF's document is held while rendering; other jobs' pages render alongside
+        with self.pdf_docs.open(pdf_path, lambda: self.file_manager.hash_file(pdf_ref)) as (doc, pdf_hash):
+            if page_number < 1 or page_number > len(doc):
+                raise ValueError(f"Invalid page: {page_number} for {len(doc)} pages.")
+
+            cached_path = self.file_manager.get_cached_render(pdf_hash, page_number, profile.dpi, cache_format)
+            if cached_path is not None:
+                return cached_path
+            img_bytes = render_page_image(doc, page_number, profile)
+        log.debug("Rendered page on demand", extra={"job_id": job_id, "page": page_number, "size": size})
+        return self.file_manager.save_cached_render(pdf_hash, page_number, profile.dpi, cache_format, img_bytes)
+
+    def _save_page_variant(self, user_id, job_id, pdf_hash: str | None, page_number: int, vp: ImageProfile,
+                           variant: str, img_bytes: bytes):
+        filename = page_image_filename(page_number, vp)
+        if pdf_hash:
+            cached_path = self.file_manager.save_cached_render(pdf_hash, page_number, vp.dpi,
+                                                               self._variant_cache_format(variant, vp), img_bytes)
+            self.file_manager.link_cached_image(user_id, job_id, filename, cached_path, page_variant_subdir(variant))
+        else:
+            self.file_manager.save_image(user_id, job_id, filename, img_bytes, page_variant_subdir(variant))
+
+    def _variant_cache_format(self, variant: str, vp: ImageProfile) -> str:
+        # variants are downscaled from the LLM pixmap, so they never share an entry with an LLM render
+        return f"{variant}.{vp.cache_format}"
+
+    def _page_part_tags(self, doc, page_number: int, profile: ImageProfile) -> List[Optional[str]]:
+        tiles = plan_page_tiles(doc.load_page(page_number - 1), profile, self.tiling)
+        return [None] if tiles is None else [tile.tag for tile in tiles]
+
+    def _part_cache_format(self, profile: ImageProfile, tile_tag: Optional[str]) -> str:
+        if tile_tag is None:
+            return profile.cache_format
+        return f"{tile_tag}.{self.tiling.cache_tag}.{profile.cache_format}"
+
+    def _render_pages(self, doc, pdf_path: str, page_numbers: List[int], workers: int, profile: ImageProfile):
+        # yields (page_number, ([(tile_tag | None, image_bytes), ...], {variant: image_bytes})) in page order
+        if workers > 1 and len(page_numbers) > 1:
+            # Each worker process opens the PDF itself
+            yield from self._render_pages_in_pool(pdf_path, page_numbers, workers, profile)
+        else:
+            for page_number in page_numbers:
+                yield page_number, render_page_parts(doc, page_number, profile, self.tiling, self.page_variants)
+
+    def _render_pages_in_pool(self, pdf_path: str, page_numbers: List[int], workers: int, profile: ImageProfile):
+        # executor.map yields slice results in submission order, so pages come back in page order
+        slices = split_into_slices(page_numbers, workers)
+        n = len(slices)
+        with ProcessPoolExecutor(max_workers=min(workers, n)) as pool:
+            for rendered in pool.map(render_page_slice, [pdf_path] * n, slices, [profile] * n, [self.tiling] * n,
+                                     [self.page_variants] * n):
+                yield from rendered
     
 
-    def run_llm_on_images(self, user_id, job_id, images_ref, prompt, batch_size):
-        log.info("Running LLM on images", extra={"user_id": user_id, "job_id": job_id, "batch_size": batch_size})
+    def triage_images(self, user_id, job_id, images_ref) -> List[str]:
+        """
+        Skip blank and near-duplicate pages. Returns the image files worth sending to the LLM
+        (original page numbers unchanged) and saves triage_report.json listing what was skipped and why.
+        """
+        page_files = self.get_page_files(user_id, job_id, images_ref)
+        if not self.page_triage:
+            return page_files
+        log.info("Triaging pages", extra={"user_id": user_id, "job_id": job_id})
+
+        triage = PageTriage()
+        kept = [f for f in page_files if self._passes_triage(triage, images_ref, f)]
+        self.file_manager.save_json_as(user_id, job_id, triage.report(), "triage_report.json")
+        log.debug("Triage complete", extra={"pages": len(page_files), "kept": len(kept)})
+        return kept
+
+    def _passes_triage(self, triage: PageTriage | None, images_ref, filename: str) -> bool:
+        # text-layer pages carry enough text by construction, only images get triaged
+        if triage is None or is_text_page(filename):
+            return True
+        return triage.check(filename, self.file_manager.get_image_path(images_ref, filename)).keep
+
+    def run_llm_on_images(self, user_id, job_id, images_ref, prompt, batch_size, image_files: List[str] | None = None,
+                          concurrency: int | None = None):
+        """
+        Send the pages to the LLM in batches of at most `batch_size` pages, packed by the batch planner,
+        with up to `concurrency` batches in flight (defaults to LLM_CONCURRENCY).
+        Batch CSVs are written in batch order as the results come back.
+        """
+        concurrency = self.llm_concurrency if concurrency is None else max(1, concurrency)
+        log.info("Running LLM on images", extra={"user_id": user_id, "job_id": job_id, "batch_size": batch_size,
+                                                 "concurrency": concurrency})
         # 0. Get the location 
 
-        # 1. User File manager to get the images
-        image_files = self.file_manager.get_image_files(images_ref)
+        # 1. User File manager to get the page images / page texts (unless triage already picked them)
+        if image_files is None:
+            image_files = self.get_page_files(user_id, job_id, images_ref)
 
-        # 2. Make ref for the CSV files folder
+        # 2. Make ref for the CSV files folder, emptied of an earlier run's batches
         csvs_ref = self.file_manager.get_csvs_dir(user_id, job_id)
+        self._clear_llm_run(user_id, job_id)
 
 
         #print("\n\n" + str(image_files) + "\n\n")
-        # 3. Go through things in batches
-        batch_counter = 0
-        num_batches = math.ceil(len(image_files) / batch_size)
-        for batch_num in range(num_batches):
-            start_idx = batch_num * batch_size
-            end_idx = start_idx + batch_size
-            batch_files = image_files[start_idx:end_idx]
-            
-            content_blocks = [{"type": "text", "text": prompt}]
-            for filename in batch_files:
-                image_path = self.file_manager.get_image_path(images_ref, filename)
-                #print("\n\n" + str(image_path) + "\n\n")
-                with open(image_path, "rb") as img_f:
-                    image_data = base64.b64encode(img_f.read()).decode()
-                page_number = filename.replace("page_", "").replace(".png", "")
-                content_blocks.append({
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/png;base64,{image_data}"}
-                })
-                content_blocks.append({"type": "text", "text": f"(This is page {page_number}.)"})
+        # 3. Pick a model for every page, then pack each model's pages into batches (token budget / latency cap)
+        #    and keep the plan with the job. Batches are numbered by their first page.
+        planner = self._planner(batch_size)
+        page_info = self._page_routing_info(user_id, job_id)
+        routes = [self._route_page(images_ref, f, page_info) for f in image_files]
+        by_model = defaultdict(list)
+        for f, route in zip(image_files, routes):
+            by_model[route.model if route else self.llm_model].append(
+                (f, estimate_page_tokens(self.file_manager.get_image_path(images_ref, f), f)))
+        order = {f: n for n, f in enumerate(image_files)}
+        plan = []
+        for model, pages in by_model.items():
+            plan += [replace(batch, model=model) for batch in planner.plan(text_tokens(prompt), pages)]
+        plan.sort(key=lambda batch: order[batch.files[0]])
+        self._save_batch_plan(user_id, job_id, planner, plan)
+        self._save_model_routing(user_id, job_id, [route for route in routes if route])
+        num_batches = len(plan)
 
-            #print("\n\nPreview of content blocks:\n", self.preview_content_blocks(content_blocks), "\n\n")
+        # 4. Checkpoint every batch in json/batch_manifest.json (see resume_llm_on_images)
+        manifest = BatchManifest(self.file_manager, user_id, job_id, self._prompt_sha256(prompt), self.llm_model)
+        for batch in plan:
+            manifest.add_batch(batch.files, batch.model)
+        manifest.mark_planned()
 
-            # 4. Sumbit to the LLM
-            try:
-                response = self.client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[{"role": "user", "content": content_blocks}]
-                )
-            except Exception as e:
-                continue
+        # 5. Sumbit to the LLM (the pool size caps the requests in flight); each batch saves its own CSV
+        cache_stats, usage = CacheStats(), ModelUsage()
+        batch_counter = self._run_manifest_batches(user_id, job_id, images_ref, prompt, manifest, range(num_batches),
+                                                   concurrency, cache_stats, usage)
+        self._record_llm_run(user_id, job_id, manifest, cache_stats, usage)
 
-            #print(response)
-            
-            # 4.2 Get the csv_content
-            csv_content = response.choices[0].message.content
-
-            # 4.3 Clean the csv_content
-            if csv_content.startswith("```"):
-                csv_content = csv_content.strip().lstrip("`").replace("```csv", "").replace("```", "").strip()
-            lines = [line.strip() for line in csv_content.splitlines() if line.strip()]
-
-            # 4.4 Write the CSV files using magic
-            # Save CSV with FileManager
-            batch_filename = f"batch_{batch_num + 1}.csv"
-            csv_bytes = io.StringIO()
-            writer = csv.writer(csv_bytes)
-
-            for line in lines:
-                try:
-                    reader = csv.reader(io.StringIO(line))
-                    for row in reader:
-                        if len(row) >= 3:
-                            writer.writerow([cell.strip() for cell in row])
-                        else:
-                            log.error("\n\nERROR in core.py len of row is < 3\n" + row)
-                            #print("\n\nERROR in core.py len of row is < 3")
-                            #print(row)
-                            # emit(Fore.YELLOW + "WARNING" + Fore.RESET,
-                            #      f" Skipping malformed row in batch {batch_num + 1}: {line}")
-                except Exception as e:
-                    #print("ERROR in core.py exception")
-                    log.error("ERROR in core.py exception")
-                    # emit(Fore.RED + "ERROR" + Fore.RESET,
-                    #      f" CSV parse error: {str(e)} on line: {line}")
-
-            csv_path = self.file_manager.save_csv(user_id, job_id, batch_filename,
-                                                  csv_bytes.getvalue().encode("utf-8"))
-            #csv_paths.append(csv_path)
-
-            # emit(Fore.BLUE + "INFO" + Fore.RESET,
-            #      f"  Saved batch {batch_num + 1} to {csv_path}")
-            batch_counter += 1
-
-        # 5. User File manager to save those Csv files to the right place
         # 6. ReturnRef with the CSV files location and other meta data
 
         log.debug("Generated CSV batches", extra={"batch_count": batch_counter})
     
 
         return csvs_ref
+
+    def resume_llm_on_images(self, user_id, job_id, images_ref, prompt, concurrency: int | None = None):
+        """
+        Re-run only the batches of an earlier run_llm_on_images / run_streaming_pipeline that never
+        finished: failed, still pending (the process died) or whose CSV is missing or changed.
+        Batches keep their pages and numbers. Raises FileNotFoundError without a manifest and
+        ValueError if the prompt changed or the streamed run stopped before every batch was planned.
+        Returns the csvs_ref.
+        """
+        manifest = self.load_resumable_manifest(user_id, job_id, prompt)
+        csvs_ref = self.file_manager.get_csvs_dir(user_id, job_id)
+        todo = manifest.unfinished(lambda name: self._csv_sha256(csvs_ref, name))
+        log.info("Resuming LLM batches", extra={"user_id": user_id, "job_id": job_id,
+                                                "batches": [n + 1 for n in todo], "of": len(manifest.batches)})
+        concurrency = self.llm_concurrency if concurrency is None else max(1, concurrency)
+        cache_stats, usage = CacheStats(), ModelUsage()
+        self._run_manifest_batches(user_id, job_id, images_ref, prompt, manifest, todo, concurrency, cache_stats, usage)
+        self._record_llm_run(user_id, job_id, manifest, cache_stats, usage)
+        self.file_manager.update_job_metadata(user_id, job_id, {"llm_resume": {
+            "rerun_batches": [n + 1 for n in todo], "at": datetime.now().isoformat(timespec="seconds"),
+        }})
+        return csvs_ref
+
+    def load_resumable_manifest(self, user_id, job_id, prompt) -> BatchManifest:
+        """The job's batch manifest, if resume_llm_on_images can pick it up with this prompt (same errors)."""
+        manifest = BatchManifest.load(self.file_manager, user_id, job_id)
+        if manifest is None:
+            raise FileNotFoundError(f"No batch manifest for job {job_id}")
+        if manifest.prompt_sha256 != self._prompt_sha256(prompt):
+            raise ValueError("The prompt changed since this job ran; submit the PDF again")
+        if not manifest.planned:
+            raise ValueError("Page rendering did not finish for this job; submit the PDF again")
+        return manifest
+
+    def _clear_llm_run(self, user_id, job_id):
+        # a new LLM run starts without the last run's batch CSVs and manifest: combine_to_json merges
+        # every CSV in csvs/, so a rerun with fewer batches would otherwise keep the old ones
+        self.file_manager.clear_job_files(user_id, job_id, "csvs")
+        self.file_manager.clear_job_files(user_id, job_id, "json", keep=lambda path: path.name != MANIFEST_FILENAME)
+
+    def _run_manifest_batches(self, user_id, job_id, images_ref, prompt, manifest: BatchManifest,
+                              batch_nums: Iterable[int], concurrency: int, cache_stats: CacheStats,
+                              usage: ModelUsage | None = None) -> int:
+        # run the given batches, up to `concurrency` at a time; returns how many produced a CSV
+        batch_nums = list(batch_nums)
+        with ThreadPoolExecutor(max_workers=min(concurrency, max(1, len(batch_nums)))) as pool:
+            futures = [pool.submit(self._run_batch, user_id, job_id, images_ref, prompt, manifest, n, cache_stats, usage)
+                       for n in batch_nums]
+            return sum(1 for future in futures if future.result() is not None)
+
+    def _run_batch(self, user_id, job_id, images_ref, prompt, manifest: BatchManifest, batch_num: int,
+                   cache_stats: CacheStats | None = None, usage: ModelUsage | None = None) -> Optional[List[List[str]]]:
+        """
+        One manifest batch: ask the batch's model, save batch_<n>.csv and checkpoint the outcome.
+        A batch that gets a non-retryable error or malformed CSV is bisected (see _bisect_batch).
+        Returns the rows, or None if the batch failed. Runs on the LLM worker threads.
+        """
+        batch = manifest.batches[batch_num]
+        batch_files = batch["pages"]
+        # batches from before model routing have no model of their own
+        model = batch.get("model") or manifest.model
+        manifest.start(batch_num)
+        flagged = []
+        try:
+            rows = self._request_batch(user_id, job_id, images_ref, prompt, batch_num, batch_files, cache_stats,
+                                       model, usage)
+        except Exception as e:
+            log.error("LLM batch failed", extra={"batch": batch_num + 1, "pages": batch_files, "error": str(e)})
+            # retryable errors already had their retries; splitting the batch would only multiply them
+            if not self.bisect_failed_batches or is_retryable(e):
+                manifest.fail(batch_num, str(e))
+                self._emit_batch_progress(job_id, manifest, batch_num, error=str(e))
+                return None
+            rows = self._bisect_batch(images_ref, prompt, batch_num, batch_files, cache_stats, flagged, model, usage)
+            if rows is None:
+                manifest.fail(batch_num, str(e), flagged)
+                self._emit_batch_progress(job_id, manifest, batch_num, error=str(e))
+                return None
+            self._save_batch_csv(user_id, job_id, batch_num, rows)
+        csv_filename = batch_csv_filename(batch_num)
+        manifest.finish(batch_num, csv_filename,
+                        self._csv_sha256(self.file_manager.get_csvs_dir(user_id, job_id), csv_filename), flagged)
+        self._emit_batch_progress(job_id, manifest, batch_num)
+        return rows
+
+    def _emit_batch_progress(self, job_id, manifest: BatchManifest, batch_num: int, error: str | None = None):
+        batch = manifest.batches[batch_num]
+        self._emit_progress(job_id, "batch", batch=batch_num + 1, status=batch["status"], pages=len(batch["pages"]),
+                            model=batch.get("model"), error=error, flagged_pages=len(batch.get("flagged_pages", [])),
+                            **manifest.summary())
+
+    def _emit_progress(self, job_id, event: str, **data):
+        # progress is best effort: a failing listener must not fail the pipeline
+        if self.on_progress is None:
+            return
+        try:
+            self.on_progress(job_id, event, **data)
+        except Exception:
+            log.warning("Progress listener failed", exc_info=True, extra={"job_id": job_id, "event": event})
+
+    def _bisect_batch(self, images_ref, prompt, batch_num: int, batch_files: List[str],
+                      cache_stats: CacheStats | None, flagged: List[dict], model: str | None = None,
+                      usage: ModelUsage | None = None) -> Optional[List[List[str]]]:
+        """
+        Retry a failed batch as two halves, splitting again whatever fails, down to single pages.
+        A single page that still fails is appended to `flagged` (its usable rows, if any, are kept).
+        Returns the rows of every part that answered, under one header, or None if none did.
+        """
+        log.info("Bisecting LLM batch", extra={"batch": batch_num + 1, "pages": len(batch_files)})
+        half = len(batch_files) // 2
+        rows, answered = [], False
+        for part in (batch_files[:half], batch_files[half:]):
+            try:
+                part_rows = self._fetch_batch_rows(images_ref, prompt, batch_num, part, cache_stats,
+                                                   model=model, usage=usage)
+            except Exception as e:
+                if len(part) > 1 and not is_retryable(e):
+                    part_rows = self._bisect_batch(images_ref, prompt, batch_num, part, cache_stats, flagged,
+                                                   model, usage)
+                else:
+                    flagged += [{"batch": batch_num + 1, "page": page_number_from_filename(f), "file": f, "error": str(e)}
+                                for f in part]
+                    part_rows = getattr(e, "rows", None) or None
+                if part_rows is None:
+                    continue
+            answered = True
+            rows += [row for row in part_rows if not is_csv_header(row)]
+        return [list(CSV_HEADER)] + rows if answered else None
+
+    def _csv_sha256(self, csvs_ref, filename: str | None) -> str | None:
+        if filename is None:
+            return None
+        try:
+            path = self.file_manager.get_csv_path_by_file_name(csvs_ref, filename)
+        except FileNotFoundError:
+            return None
+        with open(path, "rb") as f:
+            return hashlib.file_digest(f, "sha256").hexdigest()
+
+    def _prompt_sha256(self, prompt: str) -> str:
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    def _planner(self, batch_size: int) -> BatchPlanner:
+        # without a planner: fixed batches of batch_size pages (estimates are still recorded)
+        if self.batch_planner is None:
+            return BatchPlanner(token_budget=None, max_latency_s=None, max_pages=batch_size)
+        return replace(self.batch_planner, max_pages=batch_size)
+
+    def _save_batch_plan(self, user_id, job_id, planner: BatchPlanner, plan: List[PlannedBatch]):
+        # json/batch_plan.json has every batch; the job metadata gets the summary
+        self.file_manager.save_json_as(user_id, job_id, {
+            "settings": planner.to_dict(),
+            "batches": [batch.to_dict(n) for n, batch in enumerate(plan)],
+        }, "batch_plan.json")
+        self.file_manager.update_job_metadata(user_id, job_id, {"batch_plan": {
+            "batches": len(plan),
+            "est_tokens": sum(b.tokens for b in plan),
+            "max_batch_tokens": max((b.tokens for b in plan), default=0),
+            "max_batch_latency_s": round(max((b.latency_s for b in plan), default=0.0), 2),
+        }})
+
+    def _request_batch(self, user_id, job_id, images_ref, prompt, batch_num: int, batch_files: List[str],
+                       cache_stats: CacheStats | None = None, model: str | None = None,
+                       usage: ModelUsage | None = None) -> List[List[str]]:
+        # saves batch_<n>.csv; streamed answers are written to it row by row. Raises like _fetch_batch_rows,
+        # in which case no CSV (not even a partial one) is left behind.
+        if not self.stream_llm:
+            rows = self._fetch_batch_rows(images_ref, prompt, batch_num, batch_files, cache_stats,
+                                          model=model, usage=usage)
+            self._save_batch_csv(user_id, job_id, batch_num, rows)
+            return rows
+        with self.file_manager.open_csv_stream(user_id, job_id, batch_csv_filename(batch_num)) as f:
+            return self._fetch_batch_rows(images_ref, prompt, batch_num, batch_files, cache_stats,
+                                          on_row=csv.writer(f).writerow, model=model, usage=usage)
+
+    def _fetch_batch_rows(self, images_ref, prompt, batch_num: int, batch_files: List[str],
+                          cache_stats: CacheStats | None = None, on_row=None, model: str | None = None,
+                          usage: ModelUsage | None = None) -> List[List[str]]:
+        """
+        Send one batch of pages to `model` (default LLM_MODEL), or answer it from the response cache.
+        Calls that reach the LLM are added to `usage` (latency, tokens).
+        Returns the parsed rows (header included). Raises when the LLM call fails (after LLMClient's
+        retries) and MalformedAnswerError when the answer has no rows or malformed ones; those
+        answers are not cached. Safe to call from several threads at once.
+        """
+        # on_row(row) sees every row as soon as it is parsed; with LLM_STREAM that's while the answer is still arriving
+        on_row = on_row or (lambda row: None)
+        model = model or self.llm_model
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = self._response_cache_key(images_ref, prompt, batch_files, model)
+            cached = self.response_cache.get(cache_key)
+            if cache_stats is not None:
+                cache_stats.record(hit=cached is not None)
+            if cached is not None:
+                rows = self._parse_csv_rows(cached, batch_num)
+                for row in rows:
+                    on_row(row)
+                return rows
+
+        content_blocks = self._build_content_blocks(images_ref, prompt, batch_files)
+        #print("\n\nPreview of content blocks:\n", self.preview_content_blocks(content_blocks), "\n\n")
+        messages = [{"role": "user", "content": content_blocks}]
+
+        dropped = 0
+
+        def keep(row) -> bool:
+            nonlocal dropped
+            if self._keep_row(row, batch_num):
+                return True
+            dropped += 1
+            return False
+
+        started = time.perf_counter()
+        answer_usage = []
+        if self.stream_llm:
+            rows = []
+            for row in iter_csv_rows(self.llm.stream(model=model, messages=messages, on_usage=answer_usage.append)):
+                if not keep(row):
+                    continue
+                if not rows:
+                    log.debug("First LLM row", extra={"batch": batch_num + 1, "after_s": round(time.perf_counter() - started, 3)})
+                rows.append(row)
+                on_row(row)
+            # the full answer is never assembled; the cache gets the rows back as CSV
+            content = self._rows_to_csv(rows)
+        else:
+            response = self.llm.create(model=model, messages=messages)
+            #print(response)
+            content = response.choices[0].message.content
+            answer_usage.append(getattr(response, "usage", None))
+            rows = [row for row in iter_csv_rows([content or ""]) if keep(row)]
+            for row in rows:
+                on_row(row)
+        if usage is not None:
+            usage.record(model, len(batch_files), time.perf_counter() - started, answer_usage[0] if answer_usage else None)
+        if dropped or not rows:
+            raise MalformedAnswerError(f"{dropped} malformed CSV rows" if dropped else "No CSV rows in the answer", rows)
+        if cache_key:
+            self.response_cache.put(cache_key, model, content)
+        return rows
+
+    def _response_cache_key(self, images_ref, prompt, batch_files: List[str], model: str | None = None) -> str:
+        pages = []
+        for filename in batch_files:
+            with open(self.file_manager.get_image_path(images_ref, filename), "rb") as f:
+                pages.append((filename, hashlib.file_digest(f, "sha256").hexdigest()))
+        return response_cache_key(model or self.llm_model, prompt, pages)
+
+    def _page_routing_info(self, user_id, job_id) -> Dict[int, dict]:
+        # text length / discipline per page, as recorded by iter_extract_images ("page_routing")
+        if self.model_router is None:
+            return {}
+        metadata = self.file_manager.get_job_metadata(user_id, job_id) or {}
+        return {p["page"]: p for p in (metadata.get("page_routing") or {}).get("pages", [])}
+
+    def _route_page(self, images_ref, filename: str, page_info: Dict[int, dict]) -> Optional[RouteDecision]:
+        # None when routing is off (every page goes to LLM_MODEL)
+        if self.model_router is None:
+            return None
+        page = page_number_from_filename(filename)
+        info = page_info.get(page, {})
+        path = self.file_manager.get_image_path(images_ref, filename)
+        if is_text_page(filename):
+            text = path.read_text(encoding="utf-8")
+            return self.model_router.route(filename, page, 0.0, count_text_chars(text),
+                                           info.get("discipline") or sheet_discipline(text))
+        return self.model_router.route(filename, page, ink_coverage(load_gray(path)), info.get("text_chars", 0),
+                                       info.get("discipline"))
+
+    def _save_model_routing(self, user_id, job_id, routes: List[RouteDecision]):
+        # per-page decisions under "model_routing" in the job metadata
+        if self.model_router is None:
+            return
+        pages_per_model = defaultdict(int)
+        for route in routes:
+            pages_per_model[route.model] += 1
+        self.file_manager.update_job_metadata(user_id, job_id, {"model_routing": {
+            "router": self.model_router.to_dict(),
+            "pages_per_model": dict(pages_per_model),
+            "pages": [route.to_dict() for route in routes],
+        }})
+
+    def _record_llm_run(self, user_id, job_id, manifest: BatchManifest, cache_stats: CacheStats,
+                        usage: ModelUsage | None = None):
+        # batches the LLM never answered, under "llm_failed_batches" in the job metadata, pages that failed
+        # on their own after bisection under "flagged_pages" (for review), response cache hits / misses
+        # under "llm_cache", batch counts by status under "batch_manifest" and calls / latency / tokens /
+        # estimated cost per model under "llm_models"
+        failed = manifest.failed()
+        if failed:
+            log.error("LLM batches failed", extra={"job_id": job_id, "batches": [f["batch"] for f in failed]})
+        self.file_manager.update_job_metadata(user_id, job_id, {"llm_failed_batches": failed,
+                                                                "flagged_pages": manifest.flagged_pages(),
+                                                                "llm_cache": cache_stats.to_dict(),
+                                                                "batch_manifest": manifest.summary(),
+                                                                "llm_models": usage.to_dict() if usage else {}})
+
+    def _save_batch_csv(self, user_id, job_id, batch_num: int, rows: List[List[str]]):
+        # Save CSV with FileManager
+        self.file_manager.save_csv(user_id, job_id, batch_csv_filename(batch_num), self._rows_to_csv(rows).encode("utf-8"))
+
+    def _rows_to_csv(self, rows: List[List[str]]) -> str:
+        csv_text = io.StringIO()
+        csv.writer(csv_text).writerows(rows)
+        return csv_text.getvalue()
+
+    def _build_content_blocks(self, images_ref, prompt, batch_files: List[str]) -> List[dict]:
+        content_blocks = [{"type": "text", "text": prompt}]
+        for filename in batch_files:
+            image_path = self.file_manager.get_image_path(images_ref, filename)
+            #print("\n\n" + str(image_path) + "\n\n")
+            if is_text_page(filename):
+                # text-layer fast path: the page's own text instead of a picture of it
+                page_text = image_path.read_text(encoding="utf-8")
+                content_blocks.append({"type": "text", "text": f"(Text layer of page {page_number_from_filename(filename)}:)\n{page_text}"})
+                content_blocks.append({"type": "text", "text": f"(This is page {page_number_from_filename(filename)}.)"})
+                continue
+            # encoded only when the request body is built (see Core.payload)
+            page_number = page_number_from_filename(filename)
+            content_blocks.append(image_block(ImageData(image_mime_type(filename), path=image_path)))
+            tile = tile_from_filename(filename)
+            if tile is None:
+                content_blocks.append({"type": "text", "text": f"(This is page {page_number}.)"})
+            else:
+                # tiles overlap a little, so the same note may show up on two neighbouring tiles
+                content_blocks.append({"type": "text", "text": f"(This is page {page_number}, tile row {tile[0] + 1}, column {tile[1] + 1}.)"})
+        return content_blocks
+
+    def _parse_csv_rows(self, csv_content: str, batch_num: int) -> List[List[str]]:
+        # code fences and blank lines are dropped by the parser
+        return [row for row in iter_csv_rows([csv_content]) if self._keep_row(row, batch_num)]
+
+    def _keep_row(self, row: List[str], batch_num: int) -> bool:
+        if len(row) >= 3:
+            return True
+        log.error("ERROR in core.py len of row is < 3 (batch %s): %s", batch_num + 1, row)
+        return False
+
+    def run_streaming_pipeline(self, user_id, job_id, pdf_ref, prompt, batch_size,
+                               start_page: int | None = None, end_page: int | None = None,
+                               llm_workers: int | None = None, pages=None):
+        """
+        Rasterize -> LLM -> combine without waiting for each stage to finish.
+        Up to `llm_workers` batches (default LLM_CONCURRENCY) are in flight at once.
+
+        The rasterizer runs on its own thread and hands page filenames over a queue.
+        A batch is sent to the LLM as soon as `batch_size` pages are ready, and each
+        batch's rows are merged into the combined JSON in batch order as they arrive.
+        Batch CSVs and combined.json end up identical to the staged pipeline, except that
+        when pages are routed to more than one model batches are numbered in the order they close.
+        Returns (images_ref, csvs_ref, combined_json_ref).
+        """
+        log.info("Running streaming pipeline", extra={"user_id": user_id, "job_id": job_id, "batch_size": batch_size})
+        images_ref = self.file_manager.get_images_dir(user_id, job_id)
+        csvs_ref = self.file_manager.get_csvs_dir(user_id, job_id)
+        json_ref = self.file_manager.get_json_dir(user_id, job_id)
+        self._clear_llm_run(user_id, job_id)
+
+        pages_q: "queue.Queue" = queue.Queue()
+        done = object()
+        render_error: List[BaseException] = []
+
+        def rasterize():
+            try:
+                for filename in self.iter_extract_images(user_id, job_id, pdf_ref, start_page, end_page, pages=pages):
+                    pages_q.put(filename)
+            except BaseException as e:
+                render_error.append(e)
+            finally:
+                pages_q.put(done)
+
+        rasterizer = threading.Thread(target=rasterize, name=f"rasterize-{job_id}", daemon=True)
+        rasterizer.start()
+
+        triage = PageTriage() if self.page_triage else None
+        combined_data = defaultdict(list)
+        pending = deque()  # futures in batch order
+        cache_stats, usage = CacheStats(), ModelUsage()
+        # batches are checkpointed as they are packed; the plan is complete once rendering is
+        manifest = BatchManifest(self.file_manager, user_id, job_id, self._prompt_sha256(prompt), self.llm_model)
+        saved_batches = 0
+
+        def drain(block: bool):
+            # merge finished batches into the combiner, never out of batch order
+            nonlocal saved_batches
+            while pending and (block or pending[0].done()):
+                rows = pending.popleft().result()
+                if rows is not None:
+                    self._merge_rows(combined_data, rows[1:])  # first row is the CSV header
+                    saved_batches += 1
+
+        llm_workers = self.llm_concurrency if llm_workers is None else max(1, llm_workers)
+        planner = self._planner(batch_size)
+        # one packer per model the pages are routed to (in order of first use)
+        packers = {}
+        page_info = None
+        routes: List[RouteDecision] = []
+        plan: List[PlannedBatch] = []
+        with ThreadPoolExecutor(max_workers=llm_workers) as pool:
+            while True:
+                item = pages_q.get()
+                closed = []
+                if item is not done and self._passes_triage(triage, images_ref, item):
+                    if page_info is None:
+                        page_info = self._page_routing_info(user_id, job_id)  # recorded before the first page
+                    route = self._route_page(images_ref, item, page_info)
+                    model = route.model if route else self.llm_model
+                    if route:
+                        routes.append(route)
+                    if model not in packers:
+                        packers[model] = planner.packer(text_tokens(prompt))
+                    closed = [replace(batch, model=model) for batch in
+                              packers[model].add(item, estimate_page_tokens(self.file_manager.get_image_path(images_ref, item), item))]
+                if item is done:
+                    closed += [replace(batch, model=model) for model, packer in packers.items() for batch in packer.flush()]
+                for batch in closed:
+                    batch_num = manifest.add_batch(batch.files, batch.model)
+                    pending.append(pool.submit(self._run_batch, user_id, job_id, images_ref, prompt, manifest, batch_num,
+                                               cache_stats, usage))
+                    plan.append(batch)
+                drain(block=False)
+                if item is done:
+                    break
+            drain(block=True)
+        self._save_batch_plan(user_id, job_id, planner, plan)
+        self._save_model_routing(user_id, job_id, routes)
+
+        rasterizer.join()
+        if render_error:
+            raise render_error[0]
+        manifest.mark_planned()
+        if triage is not None:
+            self.file_manager.save_json_as(user_id, job_id, triage.report(), "triage_report.json")
+        self._record_llm_run(user_id, job_id, manifest, cache_stats, usage)
+        log.debug("Generated CSV batches", extra={"batch_count": saved_batches})
+
+        if not saved_batches:
+            raise FileNotFoundError(f"No CSV files found for job {job_id} at {csvs_ref.location}")
+        self.file_manager.save_json(json_ref, combined_data)
+        return images_ref, csvs_ref, json_ref
     
     def combine_to_json(self, user_id, job_id, csvs_ref):
         # TODO
@@ -186,26 +1000,29 @@ class Core:
             with open(file_path, "r", encoding="utf-8", newline="") as f:
                 reader = csv.reader(f)
                 next(reader, None)  # skip header
-                for row in reader:
-                    if len(row) < 3:
-                        #emit(Fore.YELLOW + "WARNING" + Fore.RESET, f"Skipping malformed row in {file_name}: {row}")
-                        # TODO - some kind of error here
-                        continue
-
-                    trade = row[0].strip()
-                    pages_str = row[1].strip()
-                    note = ",".join(row[2:]).strip()
-
-                    page_list = [p.strip() for p in pages_str.split(",") if p.strip()]
-                    combined_data[trade].append({
-                        "note": note,
-                        "pages": page_list
-                    })
+                self._merge_rows(combined_data, reader)
         # Save this as a json using the file manager
         self.file_manager.save_json(json_ref, combined_data) # TODO - implement me CHECK
         # return the reference generated by the file manager
         return json_ref
 
+    def _merge_rows(self, combined_data: Dict[str, list], rows: Iterable[List[str]]):
+        for row in rows:
+            if len(row) < 3:
+                #emit(Fore.YELLOW + "WARNING" + Fore.RESET, f"Skipping malformed row in {file_name}: {row}")
+                # TODO - some kind of error here
+                continue
+
+            trade = row[0].strip()
+            pages_str = row[1].strip()
+            note = ",".join(row[2:]).strip()
+
+            page_list = [p.strip() for p in pages_str.split(",") if p.strip()]
+            combined_data[trade].append({
+                "note": note,
+                "pages": page_list
+            })
+
     def normalize_json(self, user_id, job_id, jsons_ref, schema_text):
         log.info("Normalizing JSON", extra={"user_id": user_id, "job_id": job_id})
         # 3. Use FileManager to get combined.json from file from jsons_ref
@@ -272,11 +1089,13 @@ class Core:
         normalized_json_ref = self.file_manager.save_normalized_json(jsons_ref, normalized_json)
         return normalized_json_ref
 
-    def map_contacts(self, jsons_ref: str, limit_per_section: int | None = None):
+    def map_contacts(self, jsons_ref: str, limit_per_section: int | None = None, contact_service: ContactService | None = None):
+        # contact_service: the caller's own (e.g. on a pipeline worker's connection); defaults to the shared one
+        contact_service = contact_service or self.contact_service
         data = json.loads(self.file_manager.get_normalized_json(jsons_ref))
         for trade, items in data.items():
             if trade == "metadata": continue
-            ids = self.contact_service.get_contact_ids_for_trade(trade, limit_per_section)
+            ids = contact_service.get_contact_ids_for_trade(trade, limit_per_section)
             for item in items: item["contacts"] = ids
         meta = data.setdefault("metadata", {})
         meta.setdefault("processing_steps", []).append("contacts_mapped")
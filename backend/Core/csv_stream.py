@@ -0,0 +1,102 @@
+from typing import Iterable, Iterator, List
+
+# the header the prompt asks for; batches stitched together from several answers get it once
+CSV_HEADER = ("Trade Name", "Pages Referenced", "Details / Notes")
+
+
+def is_csv_header(row: List[str]) -> bool:
+    return [cell.lower() for cell in row[:1]] == [CSV_HEADER[0].lower()]
+
+
+class MalformedAnswerError(ValueError):
+    """An LLM answer without usable CSV rows, or with malformed ones; `rows` has the usable ones."""
+
+    def __init__(self, message: str, rows: List[List[str]]):
+        super().__init__(message)
+        self.rows = rows
+
+
+class CsvRowParser:
+    """
+    Incremental CSV parser for LLM output that arrives in arbitrary chunks.
+
+    feed() takes the next piece of text and returns the rows it completed; close() returns the
+    last row if the text didn't end with a newline. Quoted fields may contain commas, doubled
+    quotes and newlines, and may be split across chunks. Markdown code fence lines (```csv / ```)
+    and blank lines are skipped. Cells are stripped. Only the current unfinished line is buffered.
+    """
+
+    def __init__(self):
+        self.pending = ""         # text after the last newline seen
+        self.row: List[str] = []  # fields of the row being parsed
+        self.field: List[str] = []
+        self.in_quotes = False
+        self.quote_pending = False  # saw a quote inside a quoted field: closing quote or the first of ""
+        self.quoted = False         # current field started with a quote
+
+    def feed(self, text: str) -> List[List[str]]:
+        *lines, self.pending = (self.pending + text).split("\n")
+        return [row for line in lines for row in self._line(line)]
+
+    def close(self) -> List[List[str]]:
+        rows = []
+        if self.pending or self.row or self.field or self.in_quotes:
+            rows = self._line(self.pending)
+        self.pending = ""
+        if self.in_quotes:
+            # unterminated quote: keep what we have rather than lose the row
+            self.in_quotes = self.quote_pending = False
+            rows += self._end_row()
+        return rows
+
+    def _line(self, line: str) -> List[List[str]]:
+        line = line.rstrip("\r")
+        if not self.in_quotes and not self.row and not self.field and line.lstrip().startswith("```"):
+            return []
+        for ch in line:
+            if self.in_quotes:
+                if self.quote_pending:
+                    self.quote_pending = False
+                    if ch == '"':
+                        self.field.append('"')
+                        continue
+                    self.in_quotes = False  # that was the closing quote; handle ch below
+                elif ch == '"':
+                    self.quote_pending = True
+                    continue
+                else:
+                    self.field.append(ch)
+                    continue
+            if ch == ",":
+                self._end_field()
+            elif ch == '"' and not self.quoted and not "".join(self.field).strip():
+                self.field = []
+                self.in_quotes = self.quoted = True
+            else:
+                self.field.append(ch)
+
+        if self.in_quotes and not self.quote_pending:
+            self.field.append("\n")  # newline inside a quoted field
+            return []
+        self.in_quotes = self.quote_pending = False
+        return self._end_row()
+
+    def _end_field(self):
+        self.row.append("".join(self.field).strip())
+        self.field = []
+        self.quoted = False
+
+    def _end_row(self) -> List[List[str]]:
+        self._end_field()
+        row, self.row = self.row, []
+        if row == [""]:
+            return []  # blank line
+        return [row]
+
+
+def iter_csv_rows(chunks: Iterable[str]) -> Iterator[List[str]]:
+    """Rows of a chunked CSV text, each yielded as soon as it is complete."""
+    parser = CsvRowParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
@@ -0,0 +1,536 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Iterator, List, Optional, TypeVar
+
+import openai
+
+from Core.payload import build_chat_body, can_post_body, materialize_messages, post_chat_body
+from Utils.logger import get_logger
+log = get_logger(__name__)
+
+# Rough token cost of one page image: a high-detail image is scaled to fit 2048 px with a
+# 768 px short side, i.e. 2x3 tiles of 170 tokens + 85 base for a letter or ARCH sheet.
+IMAGE_TOKEN_ESTIMATE = 6 * 170 + 85
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(content_blocks: List[dict], max_output_tokens: int = 1024) -> int:
+    """Upper-ish estimate of what a request costs against a tokens-per-minute quota."""
+    tokens = max_output_tokens
+    for block in content_blocks:
+        if block["type"] == "text":
+            tokens += len(block["text"]) // CHARS_PER_TOKEN + 1
+        elif block["type"] == "image_url":
+            tokens += IMAGE_TOKEN_ESTIMATE
+    return tokens
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `capacity` tokens, refilled continuously at `per_minute` / 60 per second.
+    acquire() blocks until the amount is available; amounts above capacity are clamped so they can't wait forever.
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.rate = per_minute / 60.0
+        self.capacity = float(capacity if capacity is not None else per_minute)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """Take `amount` tokens, waiting as needed. Returns the seconds spent waiting."""
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                wait = (amount - self.tokens) / self.rate
+            self.sleep(wait)
+            waited += wait
+
+    def try_acquire(self, amount: float = 1.0) -> bool:
+        """Take `amount` tokens only if they are there right now."""
+        amount = min(amount, self.capacity)
+        with self.lock:
+            self._refill()
+            if self.tokens < amount:
+                return False
+            self.tokens -= amount
+            return True
+
+    def adjust(self, amount: float):
+        # give back (amount > 0) or take extra (amount < 0) once the real cost is known; may go negative
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets shared by every LLM call in the process."""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.requests = TokenBucket(requests_per_minute, clock=clock, sleep=sleep)
+        self.tokens = TokenBucket(tokens_per_minute, clock=clock, sleep=sleep)
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.paused_until = 0.0
+
+    def acquire(self, estimated_tokens: int) -> float:
+        waited = 0.0
+        # a 429 anywhere pauses everyone, so concurrent jobs don't keep hitting the limit
+        while True:
+            with self.lock:
+                pause = self.paused_until - self.clock()
+            if pause <= 0:
+                break
+            self.sleep(pause)
+            waited += pause
+        waited += self.requests.acquire(1)
+        waited += self.tokens.acquire(estimated_tokens)
+        return waited
+
+    def try_acquire(self, estimated_tokens: int) -> bool:
+        # admit a call without waiting (hedges), or take nothing
+        with self.lock:
+            if self.paused_until > self.clock():
+                return False
+        if not self.requests.try_acquire(1):
+            return False
+        if not self.tokens.try_acquire(estimated_tokens):
+            self.requests.adjust(1)
+            return False
+        return True
+
+    def settle(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        if actual_tokens is not None:
+            self.tokens.adjust(estimated_tokens - actual_tokens)
+
+    def pause(self, seconds: float):
+        with self.lock:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_retries: int = 5
+    base_delay: float = 1.0    # seconds; attempt n waits up to base_delay * 2**n (full jitter)
+    max_delay: float = 60.0
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Seconds the server asked us to wait (retry-after-ms / retry-after headers), if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                when = parsedate_to_datetime(value)
+                return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+class CircuitOpenError(Exception):
+    """The LLM provider's circuit is open; retry_in is the seconds until it lets a probe through."""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"LLM circuit open, next probe in {retry_in:.1f}s")
+        self.retry_in = retry_in
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Stops calling a degraded provider. Counts outcomes over the last `window_s` seconds and opens once
+    at least `min_requests` calls saw a `failure_rate` share of provider failures (connection errors,
+    timeouts, 5xx; 429s are the rate limiter's business). While open, calls fail fast with
+    CircuitOpenError, or with park=True wait (up to max_park_s) for the circuit to let them through.
+    After `open_s` it goes half-open and lets `probes` calls through: a probe's success closes it, its
+    failure opens it again. Only the probes decide; calls admitted before, and client errors (4xx,
+    bad requests), don't.
+    """
+
+    def __init__(self, failure_rate: float = 0.5, min_requests: int = 10, window_s: float = 60.0,
+                 open_s: float = 30.0, probes: int = 1, park: bool = False, max_park_s: float = 300.0,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.window_s = window_s
+        self.open_s = open_s
+        self.probes = probes
+        self.park = park
+        self.max_park_s = max_park_s
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.outcomes = deque()  # (time, failed)
+        self.opened_at: Optional[float] = None
+        self.probes_in_flight = 0
+        self.half_open_round = 0  # tells this round's probes from stale ones
+        self.times_opened = 0
+        self.rejected = 0
+
+    def before_call(self) -> Optional[int]:
+        """
+        Wait for (park) or refuse (CircuitOpenError) a call the circuit doesn't allow right now.
+        Returns the probe token to pass to record() when the call was let through as a half-open probe.
+        """
+        parked = 0.0
+        while True:
+            try:
+                return self._admit()
+            except CircuitOpenError as e:
+                if not self.park or parked + e.retry_in > self.max_park_s:
+                    raise
+                log.info("LLM circuit open, parking call", extra={"wait_s": round(e.retry_in, 2)})
+                self.sleep(e.retry_in)
+                parked += e.retry_in
+
+    def _admit(self):
+        with self.lock:
+            now = self.clock()
+            if self.state == OPEN and now - self.opened_at >= self.open_s:
+                self.state = HALF_OPEN
+                self.probes_in_flight = 0
+                self.half_open_round += 1
+            if self.state == CLOSED:
+                return None
+            if self.state == HALF_OPEN and self.probes_in_flight < self.probes:
+                self.probes_in_flight += 1
+                return self.half_open_round
+            self.rejected += 1
+            # half-open with its probes out: check back shortly
+            retry_in = self.opened_at + self.open_s - now if self.state == OPEN else min(1.0, self.open_s)
+            raise CircuitOpenError(max(retry_in, 0.0))
+
+    def record(self, failed: Optional[bool], probe: Optional[int] = None):
+        """
+        The outcome of a call: failed=True for a provider failure, False for a success, None for an error
+        that says nothing about the provider. `probe` is what before_call() returned for it.
+        """
+        with self.lock:
+            now = self.clock()
+            if probe is not None:
+                if self.state != HALF_OPEN or probe != self.half_open_round:
+                    return  # a probe of an earlier round
+                self.probes_in_flight = max(0, self.probes_in_flight - 1)
+                if failed:
+                    self._open(now)
+                elif failed is not None:
+                    self.state = CLOSED
+                    self.outcomes.clear()
+                    log.info("LLM circuit closed")
+                return
+            if self.state != CLOSED or failed is None:
+                return
+            self.outcomes.append((now, failed))
+            while self.outcomes and self.outcomes[0][0] < now - self.window_s:
+                self.outcomes.popleft()
+            failures = sum(1 for _, f in self.outcomes if f)
+            if (self.state == CLOSED and len(self.outcomes) >= self.min_requests
+                    and failures / len(self.outcomes) >= self.failure_rate):
+                self._open(now)
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        self.times_opened += 1
+        self.outcomes.clear()
+        log.warning("LLM circuit opened", extra={"open_s": self.open_s})
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            now = self.clock()
+            failures = sum(1 for _, f in self.outcomes if f)
+            return {
+                "state": self.state,
+                "requests_in_window": len(self.outcomes),
+                "failures_in_window": failures,
+                "failure_rate_threshold": self.failure_rate,
+                "next_probe_in_s": round(max(0.0, self.opened_at + self.open_s - now), 1) if self.state == OPEN else None,
+                "times_opened": self.times_opened,
+                "rejected_calls": self.rejected,
+                "mode": "park" if self.park else "fail_fast",
+            }
+
+
+def is_provider_failure(error: Exception) -> bool:
+    # what the circuit breaker counts against the provider
+    if isinstance(error, (openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def breaker_outcome(error: Exception) -> Optional[bool]:
+    # CircuitBreaker.record's `failed` for a call that raised: client errors and 429s don't count either way
+    return True if is_provider_failure(error) else None
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, CircuitOpenError):
+        return True  # not the batch's fault: no bisecting, and resume can pick it up later
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True  # APIConnectionError includes timeouts
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409) or error.status_code >= 500
+    return False
+
+
+class LatencyTracker:
+    """Latencies of the last `window` calls; percentile() is read from that sliding window."""
+
+    def __init__(self, window: int = 500):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def count(self) -> int:
+        return len(self.samples)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self.lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+class HedgeBudget:
+    """Every request earns `ratio` of a hedge (up to `burst` saved up); sending a hedge spends one."""
+
+    def __init__(self, ratio: float, burst: float = 5.0):
+        self.ratio = ratio
+        self.burst = burst
+        self.credits = 0.0
+        self.lock = threading.Lock()
+
+    def earn(self):
+        with self.lock:
+            self.credits = min(self.burst, self.credits + self.ratio)
+
+    def spend(self) -> bool:
+        with self.lock:
+            if self.credits < 1:
+                return False
+            self.credits -= 1
+            return True
+
+    def refund(self):
+        with self.lock:
+            self.credits += 1
+
+
+T = TypeVar("T")
+
+
+class Hedging:
+    """
+    Hedged requests: when a call hasn't returned by the `percentile` latency of recent calls to the
+    same model, a duplicate is sent and whichever succeeds first wins (the other's answer is dropped).
+    One budget for the whole process keeps duplicates to about `budget_ratio` of requests. Nothing is
+    hedged until `min_samples` latencies have been seen. `call` should be the provider call alone, so
+    local waits (rate limiter, backoff) are neither timed nor hedged; `admit` decides whether the
+    duplicate may be sent at all.
+    """
+
+    def __init__(self, percentile: float = 95.0, budget_ratio: float = 0.05, burst: float = 5.0,
+                 min_samples: int = 20, window: int = 500, max_workers: int = 64):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self.budget = HedgeBudget(budget_ratio, burst)
+        self.trackers: Dict[str, LatencyTracker] = {}
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-hedge")
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.won = 0
+
+    def tracker(self, key: str) -> LatencyTracker:
+        with self.lock:
+            return self.trackers.setdefault(key, LatencyTracker(self.window))
+
+    def hedge_after(self, key: str) -> Optional[float]:
+        tracker = self.tracker(key)
+        return tracker.percentile(self.percentile) if tracker.count() >= self.min_samples else None
+
+    def run(self, key: str, call: Callable[[], T], admit: Callable[[], bool] = lambda: True) -> T:
+        self.budget.earn()
+        delay = self.hedge_after(key)
+        primary = self._submit(key, call)
+        if delay is None or wait([primary], timeout=delay).done or not self.budget.spend():
+            return primary.result()
+        if not admit():
+            self.budget.refund()
+            return primary.result()
+
+        with self.lock:
+            self.sent += 1
+        log.debug("Hedging LLM call", extra={"model": key, "after_s": round(delay, 3)})
+        hedge = self._submit(key, call)
+        # first success wins; an error only surfaces once both calls have failed
+        pending, error = {primary, hedge}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self.lock:
+                            self.won += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _submit(self, key: str, call: Callable[[], T]) -> Future:
+        tracker = self.tracker(key)
+        started = time.monotonic()
+        future = self.pool.submit(call)
+        # losers are timed too, or the tracker would only ever see the fast calls
+        future.add_done_callback(lambda f: f.exception() is None and tracker.record(time.monotonic() - started))
+        return future
+
+    def stats(self) -> dict:
+        return {"hedges_sent": self.sent, "hedges_won": self.won}
+
+
+class LLMClient:
+    """
+    Chat completions with a shared rate limiter in front and retries (exponential backoff with full
+    jitter, or the server's Retry-After) behind, optionally hedged. Wraps an OpenAI-compatible client;
+    the underlying client should have its own retries turned off.
+
+    Image blocks may carry a Core.payload.ImageData instead of a data URL string. With an
+    openai.OpenAI client and prebuilt_body on, the JSON body is then built once (see
+    build_chat_body) and the same buffer is posted by every retry and hedge; other clients get
+    plain messages.
+    """
+
+    def __init__(self, client, limiter: RateLimiter, retry: RetryPolicy = RetryPolicy(),
+                 sleep: Callable[[float], None] = time.sleep, rng: random.Random | None = None,
+                 hedging: Hedging | None = None, breaker: CircuitBreaker | None = None,
+                 prebuilt_body: bool = True):
+        self.client = client
+        self.limiter = limiter
+        self.retry = retry
+        self.hedging = hedging
+        self.breaker = breaker
+        self.prebuilt_body = prebuilt_body
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        server_wait = retry_after_seconds(error)
+        if server_wait is not None:
+            return min(server_wait, self.retry.max_delay)
+        return self.rng.uniform(0, min(self.retry.max_delay, self.retry.base_delay * 2 ** attempt))
+
+    def create(self, model: str, messages: List[dict], **kwargs):
+        # the request is prepared once; with hedging, only its provider calls are duplicated (see _send)
+        estimated = self._estimate(messages)
+        request = self._prepare(model=model, messages=messages, **kwargs)
+        response = self._send(estimated, hedge_key=model, **request)
+        usage = getattr(response, "usage", None)
+        self.limiter.settle(estimated, getattr(usage, "total_tokens", None))
+        return response
+
+    def stream(self, model: str, messages: List[dict], on_usage=None, **kwargs) -> Iterator[str]:
+        """
+        Streamed completion: yields the answer text piece by piece as it arrives.
+        Opening the stream is retried like create(); an error once text has started flowing is raised
+        to the caller, which has already consumed part of the answer. Streams are not hedged.
+        on_usage(usage) gets the usage the provider reported (or None) once the stream is exhausted.
+        """
+        estimated = self._estimate(messages)
+        chunks = self._send(estimated, **self._prepare(model=model, messages=messages, stream=True,
+                                                       stream_options={"include_usage": True}, **kwargs))
+        usage = None
+        for chunk in chunks:
+            # the last chunk carries usage and no choices
+            usage = getattr(chunk, "usage", None) or usage
+            for choice in chunk.choices or []:
+                text = getattr(choice.delta, "content", None)
+                if text:
+                    yield text
+        self.limiter.settle(estimated, getattr(usage, "total_tokens", None))
+        if on_usage is not None:
+            on_usage(usage)
+
+    def _estimate(self, messages: List[dict]) -> int:
+        return sum(estimate_tokens(m["content"]) if isinstance(m["content"], list)
+                   else len(m["content"]) // CHARS_PER_TOKEN + 1 for m in messages)
+
+    def _prepare(self, **request) -> dict:
+        # keyword arguments for _send: a prebuilt JSON body when the client can post one, else plain messages
+        if self.prebuilt_body and can_post_body(self.client):
+            return {"body": build_chat_body(**request), "stream": bool(request.get("stream"))}
+        return dict(request, messages=materialize_messages(request["messages"]))
+
+    def _call(self, body: bytearray | None = None, **kwargs):
+        if body is not None:
+            return post_chat_body(self.client, body, stream=kwargs.get("stream", False))
+        return self.client.chat.completions.create(**kwargs)
+
+    def _send(self, estimated: int, hedge_key: str | None = None, **kwargs):
+        # hedge_key: hedge the provider call under this model's latencies (streams pass none)
+        attempt = 0
+        while True:
+            probe = self.breaker.before_call() if self.breaker is not None else None  # CircuitOpenError is not retried here
+            self.limiter.acquire(estimated)
+            try:
+                if self.hedging is not None and hedge_key is not None:
+                    # a duplicate is sent only once the limiter admits it without waiting
+                    response = self.hedging.run(hedge_key, lambda: self._call(**kwargs),
+                                                admit=lambda: self.limiter.try_acquire(estimated))
+                else:
+                    response = self._call(**kwargs)
+            except Exception as e:
+                if self.breaker is not None:
+                    self.breaker.record(failed=breaker_outcome(e), probe=probe)
+                if not is_retryable(e) or attempt >= self.retry.max_retries:
+                    raise
+                delay = self.backoff(attempt, e)
+                if isinstance(e, openai.RateLimitError):
+                    self.limiter.pause(delay)
+                log.warning("LLM call failed, retrying", extra={"attempt": attempt + 1, "delay_s": round(delay, 2),
+                                                                "error": type(e).__name__})
+                self.sleep(delay)
+                attempt += 1
+                continue
+            if self.breaker is not None:
+                self.breaker.record(failed=False, probe=probe)
+            return response
@@ -0,0 +1,132 @@
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass, asdict
+from typing import Dict, Optional
+
+# Sheet numbers in a title block: "E-101", "M2.01", "FP-1". The prefix is the discipline.
+SHEET_NUMBER = re.compile(r"\b(FP|FA|[GTCLASMPE])[-.]?\d{1,3}(?:\.\d{1,2})?\b")
+# Sheets without a sheet number that are still obviously front matter
+FRONT_MATTER = ("GENERAL NOTES", "COVER SHEET", "SHEET INDEX", "DRAWING INDEX", "ABBREVIATIONS", "SYMBOL LEGEND")
+
+# How much a discipline pushes a sheet towards the large model: general / title sheets are mostly
+# notes and schedules, MEP and structural plans are dense drawings. Unknown sheets sit in the middle.
+DISCIPLINE_COMPLEXITY = {
+    "G": 0.0, "T": 0.2, "L": 0.4, "C": 0.6, "A": 0.6, "S": 0.8,
+    "M": 1.0, "P": 1.0, "E": 1.0, "FP": 1.0, "FA": 1.0,
+}
+UNKNOWN_DISCIPLINE_COMPLEXITY = 0.5
+
+# USD per 1M (input, output) tokens, for the per-job cost estimate; other models get no cost
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+}
+
+
+def sheet_discipline(text: str) -> Optional[str]:
+    """Discipline prefix of the sheet number quoted most often on the page, "G" for front matter, else None."""
+    counts = Counter(m.group(1) for m in SHEET_NUMBER.finditer(text or ""))
+    if counts:
+        return counts.most_common(1)[0][0]
+    upper = (text or "").upper()
+    return "G" if any(title in upper for title in FRONT_MATTER) else None
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    price = MODEL_PRICES.get(model)
+    if price is None:
+        return None
+    return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+
+
+@dataclass
+class RouteDecision:
+    filename: str
+    page: int
+    model: str
+    score: float
+    ink_coverage: float
+    text_chars: int
+    discipline: Optional[str]
+
+    def to_dict(self) -> dict:
+        d = asdict(self)
+        d["score"] = round(self.score, 3)
+        d["ink_coverage"] = round(self.ink_coverage, 4)
+        return d
+
+
+@dataclass(frozen=True)
+class ModelRouter:
+    """
+    Scores each page's complexity from 0 to 1 and picks the model for it: pages scoring at least
+    `threshold` go to large_model, the rest to small_model. The score is a weighted sum of ink
+    coverage (saturating at dense_ink), text length (saturating at dense_text_chars) and the
+    sheet's discipline (DISCIPLINE_COMPLEXITY).
+    """
+    small_model: str = "gpt-4o-mini"
+    large_model: str = "gpt-4o"
+    threshold: float = 0.5
+    dense_ink: float = 0.10
+    dense_text_chars: int = 4000
+    ink_weight: float = 0.5
+    text_weight: float = 0.2
+    discipline_weight: float = 0.3
+
+    def score(self, ink_coverage: float, text_chars: int, discipline: Optional[str]) -> float:
+        ink = min(1.0, ink_coverage / self.dense_ink)
+        text = min(1.0, text_chars / self.dense_text_chars)
+        kind = DISCIPLINE_COMPLEXITY.get(discipline, UNKNOWN_DISCIPLINE_COMPLEXITY)
+        return self.ink_weight * ink + self.text_weight * text + self.discipline_weight * kind
+
+    def route(self, filename: str, page: int, ink_coverage: float, text_chars: int,
+              discipline: Optional[str]) -> RouteDecision:
+        score = self.score(ink_coverage, text_chars, discipline)
+        model = self.large_model if score >= self.threshold else self.small_model
+        return RouteDecision(filename, page, model, score, ink_coverage, text_chars, discipline)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class ModelUsage:
+    """Per-model LLM calls, pages, latency, tokens and estimated cost for one job; batches run on several threads."""
+
+    def __init__(self):
+        self.models: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def record(self, model: str, pages: int, latency_s: float, usage=None):
+        # usage is the response's usage object (prompt_tokens / completion_tokens), if the provider sent one
+        prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+        completion_tokens = getattr(usage, "completion_tokens", None) or 0
+        with self.lock:
+            m = self.models.setdefault(model, {"calls": 0, "pages": 0, "latency_s_total": 0.0, "latency_s_max": 0.0,
+                                               "prompt_tokens": 0, "completion_tokens": 0})
+            m["calls"] += 1
+            m["pages"] += pages
+            m["latency_s_total"] += latency_s
+            m["latency_s_max"] = max(m["latency_s_max"], latency_s)
+            m["prompt_tokens"] += prompt_tokens
+            m["completion_tokens"] += completion_tokens
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            out = {}
+            for model, m in self.models.items():
+                cost = estimate_cost(model, m["prompt_tokens"], m["completion_tokens"])
+                out[model] = {
+                    "calls": m["calls"],
+                    "pages": m["pages"],
+                    "latency_s_total": round(m["latency_s_total"], 3),
+                    "latency_s_mean": round(m["latency_s_total"] / m["calls"], 3),
+                    "latency_s_max": round(m["latency_s_max"], 3),
+                    "prompt_tokens": m["prompt_tokens"],
+                    "completion_tokens": m["completion_tokens"],
+                    "cost_usd": round(cost, 6) if cost is not None else None,
+                }
+            return out
@@ -0,0 +1,187 @@
+import binascii
+import json
+import mmap
+import re
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+import httpx
+import openai
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+# raw bytes base64-encoded per step (a multiple of 3, so chunks concatenate without padding)
+ENCODE_CHUNK = 3 * 64 * 1024
+# bytes handed to the HTTP client per write
+SEND_CHUNK = 256 * 1024
+
+
+def b64_len(n: int) -> int:
+    return 4 * ((n + 2) // 3)
+
+
+class ImageData:
+    """
+    A page image to inline in a request as a base64 data URL, from a file (memory-mapped when
+    the body is built) or from a buffer the rasterizer already holds. Nothing is read or encoded
+    until the request body is built.
+    """
+
+    def __init__(self, mime: str, path: Path | str | None = None, buffer=None):
+        if (path is None) == (buffer is None):
+            raise ValueError("ImageData needs exactly one of path / buffer")
+        self.mime = mime
+        self.path = Path(path) if path is not None else None
+        self.buffer = buffer
+
+    @property
+    def size(self) -> int:
+        return self.path.stat().st_size if self.path is not None else memoryview(self.buffer).nbytes
+
+    @property
+    def prefix(self) -> str:
+        return f"data:{self.mime};base64,"
+
+    @contextmanager
+    def view(self) -> Iterator[memoryview]:
+        if self.buffer is not None:
+            with memoryview(self.buffer) as view:
+                yield view.cast("B")
+            return
+        with open(self.path, "rb") as f:
+            if self.size == 0:  # empty files can't be mapped
+                yield memoryview(b"")
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                yield view
+
+    def data_url(self) -> str:
+        # the whole data URL as one str, for clients that take plain messages
+        with self.view() as view:
+            return self.prefix + binascii.b2a_base64(view, newline=False).decode("ascii")
+
+
+def image_block(image: ImageData) -> dict:
+    return {"type": "image_url", "image_url": {"url": image}}
+
+
+def materialize_messages(messages: List[dict]) -> List[dict]:
+    """The messages with every ImageData replaced by its data URL string."""
+    def walk(value):
+        if isinstance(value, ImageData):
+            return value.data_url()
+        if isinstance(value, dict):
+            return {k: walk(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [walk(v) for v in value]
+        return value
+    return walk(messages)
+
+
+def build_chat_body(**request) -> bytearray:
+    """
+    JSON body of a chat completions request (model=..., messages=..., ...) in one buffer sized
+    up front. The request is serialized once with a placeholder per ImageData; each image is then
+    base64-encoded straight into its slot, a chunk at a time, from its memory map or buffer.
+    Peak memory is the body plus one encoded chunk.
+    """
+    token = uuid.uuid4().hex
+    images: List[ImageData] = []
+
+    def placeholder(value):
+        if not isinstance(value, ImageData):
+            raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+        images.append(value)
+        return f"{token}:{len(images) - 1}"
+
+    text = json.dumps(request, default=placeholder)
+    pieces = re.split(rf'"{token}:(\d+)"', text)  # literal JSON, image index, literal JSON, ...
+    literals = [piece.encode("utf-8") for piece in pieces[::2]]
+    slots = [images[int(n)] for n in pieces[1::2]]
+    image_sizes = [image.size for image in slots]
+
+    total = sum(len(lit) for lit in literals) + sum(len(image.prefix) + 2 + b64_len(size)
+                                                   for image, size in zip(slots, image_sizes))
+    body = bytearray(total)
+    out = memoryview(body)
+    pos = 0
+
+    def put(data):
+        nonlocal pos
+        out[pos:pos + len(data)] = data
+        pos += len(data)
+
+    for n, literal in enumerate(literals):
+        put(literal)
+        if n == len(slots):
+            break
+        image = slots[n]
+        put(b'"' + image.prefix.encode("ascii"))
+        with image.view() as view:
+            if view.nbytes != image_sizes[n]:
+                raise ValueError(f"{image.path or 'buffer'} changed size while the request was being built")
+            for start in range(0, view.nbytes, ENCODE_CHUNK):
+                put(binascii.b2a_base64(view[start:start + ENCODE_CHUNK], newline=False))
+        put(b'"')
+    out.release()
+    if pos != total:
+        raise ValueError(f"Request body is {pos} bytes, expected {total}")
+    return body
+
+
+# openai.OpenAI internals post_chat_body relies on (present in the pinned openai==1.95.0). A client
+# without them gets plain messages through chat.completions.create instead.
+_CLIENT_INTERNALS = ("_client", "_make_status_error_from_response", "default_headers", "base_url", "timeout")
+
+
+def can_post_body(client) -> bool:
+    if not isinstance(client, openai.OpenAI) or not hasattr(openai, "Stream"):
+        return False
+    if not all(hasattr(client, name) for name in _CLIENT_INTERNALS):
+        return False
+    http = client._client
+    return hasattr(http, "build_request") and hasattr(http, "send")
+
+
+def _construct_completion(data: dict) -> ChatCompletion:
+    # pydantic v2 name first; construct() is its deprecated v1 spelling
+    construct = getattr(ChatCompletion, "model_construct", None) or ChatCompletion.construct
+    return construct(**data)
+
+
+def post_chat_body(client: openai.OpenAI, body: bytearray, stream: bool = False):
+    """
+    POST a prebuilt body to the client's /chat/completions, through the client's own HTTP
+    connection pool and headers. Returns a ChatCompletion, or an openai.Stream of chunks, and
+    raises the same openai errors client.chat.completions.create would (so retries apply).
+    Only for clients can_post_body() accepts.
+    """
+    headers = {k: v for k, v in client.default_headers.items() if isinstance(v, str)}
+    headers["Content-Length"] = str(len(body))  # the body is sent in slices; stops httpx from chunking it
+
+    def slices():
+        with memoryview(body) as view:
+            for start in range(0, len(view), SEND_CHUNK):
+                yield bytes(view[start:start + SEND_CHUNK])
+
+    http = client._client  # the OpenAI client's httpx.Client
+    request = http.build_request("POST", client.base_url.join("chat/completions"), headers=headers,
+                                 content=slices(), timeout=client.timeout)
+    try:
+        response = http.send(request, stream=True)
+    except httpx.TimeoutException as e:
+        raise openai.APITimeoutError(request=request) from e
+    except httpx.HTTPError as e:
+        raise openai.APIConnectionError(request=request) from e
+
+    if response.status_code >= 400:
+        response.read()
+        response.close()
+        raise client._make_status_error_from_response(response)
+    if stream:
+        return openai.Stream(cast_to=ChatCompletionChunk, response=response, client=client)
+    try:
+        return _construct_completion(json.loads(response.read()))
+    finally:
+        response.close()
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from Utils.logger import get_logger
+log = get_logger(__name__)
+
+STATE_FILENAME = "pipeline_state.json"
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    One node of the pipeline DAG.
+
+    inputs: names of the run inputs the stage reads (pdf_sha256, pages, prompt_sha256, ...)
+    after:  the stages whose outputs it reads
+    run:    run(outputs) -> {stage name: outputs}, given the outputs of every stage so far. Normally
+            returns just its own outputs; it may also return those of later stages it completed in the
+            same pass (the streaming pipeline renders, prompts and combines at once).
+    check:  check(outputs) -> bool, whether recorded outputs are still usable (their files exist)
+    report: report(outputs) -> dict of counts for the progress entry
+    """
+    name: str
+    run: Callable[[Dict[str, dict]], Dict[str, dict]]
+    inputs: Tuple[str, ...] = ()
+    after: Tuple[str, ...] = ()
+    check: Callable[[dict], bool] = lambda outputs: True
+    report: Callable[[dict], dict] = lambda outputs: {}
+
+
+class PipelineState:
+    """
+    What each stage of a job last produced, kept at json/pipeline_state.json: the stage's input
+    fingerprint, the input values behind it, its outputs (storage refs, counts), when it finished and
+    how long it took. Rewritten after every change, like the batch manifest.
+    """
+
+    def __init__(self, file_manager, user_id: str, job_id: str, stages: Dict[str, dict] | None = None):
+        self.file_manager = file_manager
+        self.user_id = user_id
+        self.job_id = job_id
+        self.stages: Dict[str, dict] = stages or {}
+
+    @classmethod
+    def load(cls, file_manager, user_id: str, job_id: str) -> "PipelineState":
+        data = file_manager.get_job_json(user_id, job_id, STATE_FILENAME) or {}
+        return cls(file_manager, user_id, job_id, data.get("stages"))
+
+    def get(self, name: str) -> Optional[dict]:
+        return self.stages.get(name)
+
+    def record(self, name: str, fingerprint: str, inputs: dict, outputs: dict, duration_s: float | None = None,
+               reason: str | None = None):
+        # reason: why a later run may skip it without having run it here (e.g. reused from another job)
+        self.stages[name] = {"fingerprint": fingerprint, "inputs": inputs, "outputs": outputs,
+                             "finished_at": _now(), "duration_s": duration_s, "reason": reason}
+        self._save()
+
+    def discard(self, names: Iterable[str]):
+        for name in names:
+            self.stages.pop(name, None)
+        self._save()
+
+    def _save(self):
+        self.file_manager.save_json_as(self.user_id, self.job_id, {"stages": self.stages}, STATE_FILENAME)
+
+
+@dataclass
+class DagRun:
+    outputs: Dict[str, dict] = field(default_factory=dict)
+    ran: List[str] = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)
+
+
+class PipelineDag:
+    """
+    Runs stages in dependency order, skipping every stage whose input fingerprint matches the one it
+    last ran with and whose outputs are still there. A stage's fingerprint covers its own inputs and
+    the fingerprints of the stages it runs after, so a change anywhere upstream reaches everything
+    downstream, and a stage that actually ran makes all stages after it run too.
+    A new schema, say, re-runs normalize and map_contacts only.
+    """
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = {stage.name: stage for stage in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError("Stage names must be unique")
+        self.order = self._sort(stages)
+
+    def fingerprints(self, inputs: dict) -> Dict[str, str]:
+        prints = {}
+        for stage in self.order:
+            missing = [name for name in stage.inputs if name not in inputs]
+            if missing:
+                raise ValueError(f"Stage {stage.name} is missing inputs: {', '.join(missing)}")
+            key = {
+                "stage": stage.name,
+                "inputs": {name: inputs[name] for name in stage.inputs},
+                "after": {name: prints[name] for name in stage.after},
+            }
+            prints[stage.name] = hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        return prints
+
+    def stale(self, inputs: dict, state: PipelineState, force: Iterable[str] = ()) -> Dict[str, str]:
+        """The stages a run would recompute, with the reason; without running anything."""
+        prints = self.fingerprints(inputs)
+        force = set(force)
+        reasons = {}
+        for stage in self.order:
+            reason = self._stale_reason(stage, inputs, prints[stage.name], state.get(stage.name), force)
+            if reason is None and any(name in reasons for name in stage.after):
+                reason = "upstream changed"
+            if reason is not None:
+                reasons[stage.name] = reason
+        return reasons
+
+    def run(self, inputs: dict, state: PipelineState, progress=None, force: Iterable[str] = ()) -> DagRun:
+        """
+        Bring every stage up to date for `inputs`. `progress` (Services.PipelineQueue.PipelineProgress)
+        is told about every stage run or skipped; `force` names stages to re-run regardless.
+        A stage that raises leaves itself and every later stage unrecorded, so the next run redoes them.
+        """
+        prints = self.fingerprints(inputs)
+        force = set(force)
+        result = DagRun()
+        for stage in self.order:
+            if stage.name in result.outputs:
+                continue  # completed by an earlier stage in this pass
+            record = state.get(stage.name)
+            reason = self._stale_reason(stage, inputs, prints[stage.name], record, force)
+            if reason is None and not any(name in result.ran for name in stage.after):
+                result.outputs[stage.name] = record["outputs"]
+                result.skipped.append(stage.name)
+                if progress is not None:
+                    progress.skip(stage.name, record.get("reason") or "unchanged")
+                continue
+
+            log.info("Running pipeline stage", extra={"job_id": state.job_id, "stage": stage.name,
+                                                      "reason": reason or "upstream changed"})
+            state.discard(self._downstream(stage.name))
+            if progress is not None:
+                progress.start(stage.name)
+            started = time.perf_counter()
+            produced = stage.run(result.outputs)
+            elapsed = round(time.perf_counter() - started, 3)
+            if stage.name not in produced:
+                raise ValueError(f"Stage {stage.name} did not return its outputs")
+            for name in (s.name for s in self.order if s.name in produced):
+                outputs = produced[name]
+                state.record(name, prints[name], {k: inputs[k] for k in self.stages[name].inputs}, outputs, elapsed)
+                result.outputs[name] = outputs
+                result.ran.append(name)
+                if progress is not None:
+                    progress.finish(name, **self.stages[name].report(outputs))
+        return result
+
+    def adopt(self, name: str, inputs: dict, state: PipelineState, outputs: dict, reason: str):
+        """Record outputs made elsewhere (linked from another job) as if the stage had run with these inputs."""
+        state.record(name, self.fingerprints(inputs)[name], {k: inputs[k] for k in self.stages[name].inputs}, outputs,
+                     reason=reason)
+
+    def _stale_reason(self, stage: Stage, inputs: dict, fingerprint: str, record: dict | None, force: set) -> Optional[str]:
+        if stage.name in force:
+            return "forced"
+        if record is None:
+            return "never ran"
+        if record["fingerprint"] != fingerprint:
+            own = {name: inputs[name] for name in stage.inputs}
+            return "inputs changed" if record.get("inputs") != own else "upstream changed"
+        try:
+            usable = stage.check(record["outputs"])
+        except Exception:
+            usable = False
+        return None if usable else "outputs missing"
+
+    def _downstream(self, name: str) -> List[str]:
+        # the stage itself and everything that (transitively) runs after it, in order
+        affected = {name}
+        for stage in self.order:
+            if any(dep in affected for dep in stage.after):
+                affected.add(stage.name)
+        return [stage.name for stage in self.order if stage.name in affected]
+
+    def _sort(self, stages: List[Stage]) -> List[Stage]:
+        # topological order, keeping the given order among independent stages
+        for stage in stages:
+            unknown = [name for name in stage.after if name not in self.stages]
+            if unknown:
+                raise ValueError(f"Stage {stage.name} runs after unknown stages: {', '.join(unknown)}")
+        order, done = [], set()
+        while len(order) < len(stages):
+            ready = [s for s in stages if s.name not in done and all(dep in done for dep in s.after)]
+            if not ready:
+                cycle = sorted(s.name for s in stages if s.name not in done)
+                raise ValueError(f"Pipeline stages form a cycle: {', '.join(cycle)}")
+            order.append(ready[0])
+            done.add(ready[0].name)
+        return order
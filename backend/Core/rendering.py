@@ -0,0 +1,390 @@
+import io
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import fitz
+
+
+@dataclass(frozen=True)
+class ImageProfile:
+    """
+    How a page is rasterized for the LLM.
+    dpi is the target resolution; max_long_edge (pixels) caps it for oversized sheets.
+    fmt is "png", "jpeg" or "webp"; quality only applies to the lossy formats.
+    """
+    dpi: int = 200
+    max_long_edge: Optional[int] = None
+    grayscale: bool = False
+    fmt: str = "png"
+    quality: int = 80
+
+    @property
+    def extension(self) -> str:
+        return {"png": "png", "jpeg": "jpg", "webp": "webp"}[self.fmt]
+
+    @property
+    def mime_type(self) -> str:
+        return {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}[self.fmt]
+
+    @property
+    def cache_format(self) -> str:
+        # Everything besides dpi that changes the bytes; the default profile stays plain "png"
+        parts = []
+        if self.grayscale:
+            parts.append("gray")
+        if self.max_long_edge:
+            parts.append(f"max{self.max_long_edge}")
+        if self.fmt != "png":
+            parts.append(f"q{self.quality}")
+        parts.append(self.extension)
+        return ".".join(parts)
+
+
+IMAGE_PROFILES = {
+    "default": ImageProfile(),
+    "balanced": ImageProfile(dpi=200, max_long_edge=3072, fmt="jpeg", quality=85),
+    "compact": ImageProfile(dpi=150, max_long_edge=2048, grayscale=True, fmt="jpeg", quality=70),
+    "webp": ImageProfile(dpi=150, max_long_edge=2048, grayscale=True, fmt="webp", quality=70),
+}
+
+
+@dataclass(frozen=True)
+class TilingConfig:
+    """
+    Oversized sheets are rendered as overlapping tiles (fitz clip rectangles) so no single
+    pixmap grows past page_memory_budget bytes. tile_size and overlap are output pixels.
+    """
+    tile_size: int = 2048
+    overlap: int = 128
+    page_memory_budget: int = 64 * 1024 * 1024
+
+    @property
+    def cache_tag(self) -> str:
+        return f"t{self.tile_size}o{self.overlap}"
+
+
+@dataclass(frozen=True)
+class PageTile:
+    row: int
+    col: int
+    clip: Tuple[float, float, float, float]  # page coordinates (points)
+
+    @property
+    def tag(self) -> str:
+        return f"tile_{self.row}_{self.col}"
+
+
+# Smaller renditions for the frontend, produced from the same render pass as the LLM image
+PAGE_VARIANTS = {
+    "thumbnail": ImageProfile(dpi=72, max_long_edge=256, fmt="jpeg", quality=70),
+    "preview": ImageProfile(dpi=100, max_long_edge=1024, fmt="jpeg", quality=80),
+}
+
+
+def variant_profile(variant: str, profile: ImageProfile) -> ImageProfile:
+    # previews are downscaled from the LLM pixmap, so they share its colour mode
+    if variant not in PAGE_VARIANTS:
+        raise ValueError(f"Unknown page size '{variant}'. Options: llm, {', '.join(PAGE_VARIANTS)}")
+    return replace(PAGE_VARIANTS[variant], grayscale=profile.grayscale)
+
+
+def get_image_profile(name: str) -> ImageProfile:
+    if name not in IMAGE_PROFILES:
+        raise ValueError(f"Unknown image profile '{name}'. Options: {', '.join(IMAGE_PROFILES)}")
+    return IMAGE_PROFILES[name]
+
+
+def parse_page_selection(selection, num_pages: int) -> List[int]:
+    """
+    Turn a page selection into sorted, de-duplicated 1-based page numbers.
+    Accepts "all", a range string like "1-5,8,10-12", a JSON list "[1, 3]", or a list of ints.
+    Raises ValueError for anything outside 1..num_pages.
+    """
+    if selection is None:
+        return list(range(1, num_pages + 1))
+    if isinstance(selection, str):
+        spec = selection.strip()
+        if spec.lower() in ("", "all"):
+            return list(range(1, num_pages + 1))
+        if spec.startswith("["):
+            selection = json.loads(spec)
+        else:
+            selection = _parse_ranges(spec)
+
+    pages = sorted(set(int(p) for p in selection))
+    if not pages:
+        raise ValueError("Page selection is empty.")
+    if pages[0] < 1 or pages[-1] > num_pages:
+        raise ValueError(f"Invalid page selection: pages must be within 1–{num_pages}.")
+    return pages
+
+
+def format_page_selection(pages: List[int]) -> str:
+    # canonical form of a parsed selection: [1, 2, 3, 5, 8, 9] -> "1-3,5,8-9"
+    ranges = []
+    for n in pages:
+        if ranges and n == ranges[-1][1] + 1:
+            ranges[-1][1] = n
+        else:
+            ranges.append([n, n])
+    return ",".join(f"{a}-{b}" if a != b else str(a) for a, b in ranges)
+
+
+def _parse_ranges(spec: str) -> Iterable[int]:
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, sep, end = part.partition("-")
+        try:
+            start = int(start)
+            end = int(end) if sep else start
+        except ValueError:
+            raise ValueError(f"Invalid page selection: '{part}'")
+        if start > end:
+            raise ValueError(f"Invalid page range: {start}–{end}")
+        yield from range(start, end + 1)
+
+
+class _OpenPdf:
+    # one cached document: renders from it take its own lock, the cache lock only guards the LRU
+    def __init__(self, identity: tuple, doc: "fitz.Document", pdf_hash: str):
+        self.identity = identity
+        self.doc = doc
+        self.pdf_hash = pdf_hash
+        self.lock = threading.Lock()
+        self.users = 0
+        self.evicted = False
+
+
+class PdfDocumentCache:
+    """
+    Small LRU of open fitz documents (plus their content hash) so on-demand page renders
+    don't reopen and re-hash the PDF every time. A fitz document isn't thread safe, so open()
+    holds that document's lock while the caller uses it; renders from different PDFs run side by side.
+    Entries are checked against the file's inode, mtime and size, so a PDF replaced at the
+    same path (a new upload to the same job and filename) is reopened. An evicted document is
+    closed once its last user is done with it.
+    """
+
+    def __init__(self, capacity: int = 4):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self._docs: "OrderedDict[str, _OpenPdf]" = OrderedDict()
+
+    @contextmanager
+    def open(self, pdf_path: str, hash_fn: Callable[[], str]) -> Iterator[Tuple["fitz.Document", str]]:
+        """with cache.open(path, hash_fn) as (doc, pdf_hash): use doc; no other thread uses it meanwhile."""
+        entry = self._acquire(pdf_path, hash_fn)
+        try:
+            with entry.lock:
+                yield entry.doc, entry.pdf_hash
+        finally:
+            with self.lock:
+                entry.users -= 1
+                self._close_if_unused(entry)
+
+    def _acquire(self, pdf_path: str, hash_fn: Callable[[], str]) -> _OpenPdf:
+        st = os.stat(pdf_path)
+        identity = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self.lock:
+            entry = self._lookup(pdf_path, identity)
+        if entry is None:
+            # open and hash outside the cache lock; another thread may have got there first
+            opened = _OpenPdf(identity, fitz.open(pdf_path), hash_fn())
+            with self.lock:
+                entry = self._lookup(pdf_path, identity)
+                if entry is None:
+                    entry = opened
+                    entry.users += 1
+                    self._evict(self._docs.pop(pdf_path, None))
+                    self._docs[pdf_path] = entry
+                    while len(self._docs) > self.capacity:
+                        self._evict(self._docs.popitem(last=False)[1])
+                else:
+                    opened.doc.close()
+        return entry
+
+    def _lookup(self, pdf_path: str, identity: tuple) -> Optional[_OpenPdf]:
+        # under self.lock: the current entry for pdf_path, marked in use; None if missing or stale
+        entry = self._docs.get(pdf_path)
+        if entry is None or entry.identity != identity:
+            return None
+        self._docs.move_to_end(pdf_path)
+        entry.users += 1
+        return entry
+
+    def _evict(self, entry: Optional[_OpenPdf]):
+        if entry is not None:
+            entry.evicted = True
+            self._close_if_unused(entry)
+
+    def _close_if_unused(self, entry: _OpenPdf):
+        if entry.evicted and entry.users == 0:
+            entry.doc.close()
+
+    def clear(self):
+        with self.lock:
+            for entry in list(self._docs.values()):
+                self._evict(entry)
+            self._docs.clear()
+
+
+def page_image_filename(page_number: int, profile: ImageProfile = ImageProfile(), tile_tag: Optional[str] = None) -> str:
+    # 1-based page number -> the name FileManager.get_image_files() sorts on; tiles sort after their page
+    if tile_tag:
+        return f"page_{page_number}_{tile_tag}.{profile.extension}"
+    return f"page_{page_number}.{profile.extension}"
+
+
+def page_text_filename(page_number: int) -> str:
+    return f"page_{page_number}.txt"
+
+
+def extract_page_text(doc, page_number: int) -> str:
+    return doc.load_page(page_number - 1).get_text("text")
+
+
+def count_text_chars(text: str) -> int:
+    # whitespace doesn't tell the LLM anything, so it doesn't count toward "enough text"
+    return sum(1 for c in text if not c.isspace())
+
+
+def page_zoom(page, profile: ImageProfile) -> float:
+    zoom = profile.dpi / 72
+    if profile.max_long_edge:
+        long_edge = max(page.rect.width, page.rect.height)
+        zoom = min(zoom, profile.max_long_edge / long_edge)
+    return zoom
+
+
+def render_page_image(doc, page_number: int, profile: ImageProfile = ImageProfile()) -> bytes:
+    page = doc.load_page(page_number - 1)
+    return encode_pixmap(_page_pixmap(page, profile, page_zoom(page, profile)), profile)
+
+
+def _page_pixmap(page, profile: ImageProfile, zoom: float, clip=None):
+    colorspace = fitz.csGRAY if profile.grayscale else fitz.csRGB
+    return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=colorspace, alpha=False, clip=clip)
+
+
+def plan_page_tiles(page, profile: ImageProfile, tiling: Optional[TilingConfig]) -> Optional[List[PageTile]]:
+    """
+    Returns the tiles to render for this page, or None when the whole page fits the memory budget.
+    The tile edge is shrunk if needed so that one tile's pixmap always fits the budget.
+    """
+    if tiling is None:
+        return None
+    zoom = page_zoom(page, profile)
+    channels = 1 if profile.grayscale else 3
+    width_px = math.ceil(page.rect.width * zoom)
+    height_px = math.ceil(page.rect.height * zoom)
+    if width_px * height_px * channels <= tiling.page_memory_budget:
+        return None
+
+    tile_px = min(tiling.tile_size, math.isqrt(tiling.page_memory_budget // channels))
+    overlap_px = min(tiling.overlap, tile_px // 4)
+    step_px = tile_px - overlap_px
+
+    def starts(total_px):
+        count = max(1, math.ceil((total_px - overlap_px) / step_px))
+        return [i * step_px for i in range(count)]
+
+    x0, y0 = page.rect.x0, page.rect.y0
+    tiles = []
+    for row, top in enumerate(starts(height_px)):
+        for col, left in enumerate(starts(width_px)):
+            right = min(left + tile_px, width_px)
+            bottom = min(top + tile_px, height_px)
+            clip = (x0 + left / zoom, y0 + top / zoom, x0 + right / zoom, y0 + bottom / zoom)
+            tiles.append(PageTile(row, col, clip))
+    return tiles
+
+
+RenderedParts = List[Tuple[Optional[str], bytes]]
+
+
+def render_page_parts(doc, page_number: int, profile: ImageProfile = ImageProfile(),
+                      tiling: Optional[TilingConfig] = None,
+                      variants: Iterable[str] = ()) -> Tuple[RenderedParts, Dict[str, bytes]]:
+    """
+    Render one page as [(None, bytes)], or as [(tile_tag, bytes), ...] when it has to be tiled,
+    plus the requested PAGE_VARIANTS as {variant: bytes}.
+    Each tile pixmap is encoded and dropped before the next one is rendered.
+    """
+    page = doc.load_page(page_number - 1)
+    zoom = page_zoom(page, profile)
+    tiles = plan_page_tiles(page, profile, tiling)
+    variant_bytes = {}
+
+    if tiles is None:
+        pix = _page_pixmap(page, profile, zoom)
+        parts = [(None, encode_pixmap(pix, profile))]
+        for variant in variants:
+            vp = variant_profile(variant, profile)
+            vzoom = page_zoom(page, vp)
+            if vzoom < zoom:
+                # downscale the pixmap we already have instead of rasterizing again
+                width = max(1, round(page.rect.width * vzoom))
+                height = max(1, round(page.rect.height * vzoom))
+                variant_bytes[variant] = encode_pixmap(fitz.Pixmap(pix, width, height, None), vp)
+            else:
+                variant_bytes[variant] = encode_pixmap(_page_pixmap(page, vp, vzoom), vp)
+        return parts, variant_bytes
+
+    parts = [(tile.tag, encode_pixmap(_page_pixmap(page, profile, zoom, fitz.Rect(tile.clip)), profile)) for tile in tiles]
+    # the full sheet never exists at LLM resolution, so previews get their own (small) render
+    for variant in variants:
+        vp = variant_profile(variant, profile)
+        variant_bytes[variant] = encode_pixmap(_page_pixmap(page, vp, page_zoom(page, vp)), vp)
+    return parts, variant_bytes
+
+
+def encode_pixmap(pix, profile: ImageProfile) -> bytes:
+    if profile.fmt == "png":
+        return pix.tobytes("png")
+    if profile.fmt == "jpeg":
+        return pix.tobytes("jpeg", jpg_quality=profile.quality)
+    if profile.fmt == "webp":
+        # fitz has no WebP writer, so hand the raw samples to Pillow
+        from PIL import Image
+        mode = "L" if pix.n == 1 else "RGB"
+        img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+        buf = io.BytesIO()
+        img.save(buf, format="WEBP", quality=profile.quality)
+        return buf.getvalue()
+    raise ValueError(f"Unsupported image format: {profile.fmt}")
+
+
+def render_page_slice(pdf_path: str, page_numbers: List[int], profile: ImageProfile = ImageProfile(),
+                      tiling: Optional[TilingConfig] = None,
+                      variants: Iterable[str] = ()) -> List[Tuple[int, Tuple[RenderedParts, Dict[str, bytes]]]]:
+    """
+    Worker entry point for the process pool.
+    Opens the PDF in this process and renders the given (1-based) pages,
+    returning (page_number, (parts, variants)) in the order they were asked for (see render_page_parts).
+    """
+    doc = fitz.open(pdf_path)
+    try:
+        return [(n, render_page_parts(doc, n, profile, tiling, variants)) for n in page_numbers]
+    finally:
+        doc.close()
+
+
+def split_into_slices(page_numbers: List[int], workers: int, max_slice_pages: int = 8) -> List[List[int]]:
+    """
+    Split the page list into contiguous slices. We make at least one slice per
+    worker, but cap the slice length so a single result never carries more
+    than `max_slice_pages` rendered pages back to the parent at once.
+    """
+    if not page_numbers:
+        return []
+    workers = max(1, workers)
+    slice_len = max(1, min(max_slice_pages, math.ceil(len(page_numbers) / workers)))
+    return [page_numbers[i:i + slice_len] for i in range(0, len(page_numbers), slice_len)]
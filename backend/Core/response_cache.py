@@ -0,0 +1,117 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+from Utils.logger import get_logger
+log = get_logger(__name__)
+
+
+def response_cache_key(model: str, prompt: str, pages: Iterable[Tuple[str, str]]) -> str:
+    """
+    Key for one LLM request: model, prompt hash and the ordered (page label, page content hash) pairs.
+    The label is part of the key because the answer quotes page numbers.
+    """
+    payload = {
+        "model": model,
+        "prompt": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+        "pages": [list(p) for p in pages],
+    }
+    return hashlib.sha256(json.dumps(payload).encode("utf-8")).hexdigest()
+
+
+class CacheStats:
+    """Hit / miss counter for one job; batches run on several threads."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def record(self, hit: bool):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def to_dict(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class LLMResponseCache:
+    """
+    SQLite cache of raw LLM answers with size-based LRU eviction: once the stored answers
+    exceed max_bytes the least recently used ones are deleted. The database is opened on
+    first use and shared by all threads behind one lock.
+    """
+
+    def __init__(self, db_path: str = "llm_cache.db", max_bytes: int = 256 * 1024 * 1024):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            if self.db_path != ":memory:":
+                Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.executescript('''
+                CREATE TABLE IF NOT EXISTS llm_responses (
+                    cache_key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS idx_llm_responses_last_used ON llm_responses(last_used_at);
+            ''')
+            self.conn.commit()
+        return self.conn
+
+    def get(self, cache_key: str) -> Optional[str]:
+        with self.lock:
+            conn = self._connect()
+            row = conn.execute("SELECT content FROM llm_responses WHERE cache_key = ?", (cache_key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE llm_responses SET last_used_at = ?, hits = hits + 1 WHERE cache_key = ?",
+                         (time.time(), cache_key))
+            conn.commit()
+            return row[0]
+
+    def put(self, cache_key: str, model: str, content: str):
+        size = len(content.encode("utf-8"))
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            conn.execute('''
+                INSERT OR REPLACE INTO llm_responses (cache_key, model, content, size_bytes, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (cache_key, model, content, size, now, now))
+            self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection):
+        total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM llm_responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in conn.execute("SELECT cache_key, size_bytes FROM llm_responses ORDER BY last_used_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM llm_responses WHERE cache_key = ?", (key,))
+            total -= size
+            evicted += 1
+        log.debug("Evicted LLM responses", extra={"evicted": evicted, "size_bytes": total})
+
+    def total_bytes(self) -> int:
+        with self.lock:
+            return self._connect().execute("SELECT COALESCE(SUM(size_bytes), 0) FROM llm_responses").fetchone()[0]
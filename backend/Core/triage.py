@@ -0,0 +1,135 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from FileManager.FileManager import page_number_from_filename
+
+# Pages are analysed on a reduced copy; fine lines survive as grey, which the ink threshold still counts
+ANALYSIS_LONG_EDGE = 2000
+# Near-duplicates are confirmed on an ink mask this size; a line of notes still changes its pixels
+CONFIRM_LONG_EDGE = 800
+
+
+def load_gray(path: Path) -> np.ndarray:
+    with Image.open(path) as img:
+        img = img.convert("L")
+        factor = max(1, max(img.size) // ANALYSIS_LONG_EDGE)
+        if factor > 1:
+            img = img.reduce(factor)
+        return np.asarray(img)
+
+
+def ink_coverage(gray: np.ndarray, ink_threshold: int = 230) -> float:
+    # fraction of pixels darker than paper
+    return float(np.count_nonzero(gray < ink_threshold)) / gray.size
+
+
+def ink_mask(gray: np.ndarray, long_edge: int = CONFIRM_LONG_EDGE, ink_threshold: int = 230) -> np.ndarray:
+    img = Image.fromarray(gray)
+    scale = min(1.0, long_edge / max(img.size))
+    if scale < 1.0:
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.Resampling.BOX)
+    return np.asarray(img) < ink_threshold
+
+
+def pixel_diff(a: np.ndarray, b: np.ndarray) -> float:
+    """Share of the inked pixels of either mask that differ (1.0 for masks of different sizes)."""
+    if a.shape != b.shape:
+        return 1.0
+    inked = np.count_nonzero(a | b)
+    return float(np.count_nonzero(a ^ b)) / inked if inked else 0.0
+
+
+def dhash_bits(gray: np.ndarray, hash_size: int = 32) -> np.ndarray:
+    """Difference hash: compare neighbouring columns of a (hash_size+1) x hash_size thumbnail."""
+    thumb = np.asarray(Image.fromarray(gray).resize((hash_size + 1, hash_size), Image.Resampling.BOX), dtype=np.int16)
+    return (thumb[:, 1:] > thumb[:, :-1]).ravel()
+
+
+@dataclass
+class TriageDecision:
+    filename: str
+    page: int
+    keep: bool
+    reason: Optional[str] = None
+    ink_coverage: float = 0.0
+    duplicate_of: Optional[int] = None
+    distance: Optional[int] = None
+    pixel_diff: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        d = {"filename": self.filename, "page": self.page, "reason": self.reason, "ink_coverage": round(self.ink_coverage, 5)}
+        if self.duplicate_of is not None:
+            d["duplicate_of"] = self.duplicate_of
+            d["distance"] = self.distance
+            d["pixel_diff"] = round(self.pixel_diff, 5)
+        return d
+
+
+@dataclass
+class PageTriage:
+    """
+    Incremental blank / duplicate filter. Feed pages in page order with check();
+    each page is compared against every page kept so far in one vectorised step.
+    Only (near-)exact repeats are dropped: sheets of one set share their border and title block,
+    so a matching hash is confirmed on the ink masks before a page counts as a duplicate.
+    """
+    blank_coverage: float = 0.002     # below this fraction of inked pixels a page counts as blank
+    max_hash_distance: int = 1         # dHash bits (out of 1024) that may differ for a duplicate
+    max_coverage_delta: float = 0.001  # duplicates must also carry the same amount of ink
+    max_pixel_diff: float = 0.01       # share of inked pixels that may differ between duplicates
+    decisions: List[TriageDecision] = field(default_factory=list)
+    _hashes: List[np.ndarray] = field(default_factory=list, init=False, repr=False)
+    _coverages: List[float] = field(default_factory=list, init=False, repr=False)
+    _masks: List[Tuple[tuple, np.ndarray]] = field(default_factory=list, init=False, repr=False)
+    _pages: List[int] = field(default_factory=list, init=False, repr=False)
+
+    def check(self, filename: str, path: Path) -> TriageDecision:
+        page = page_number_from_filename(filename)
+        gray = load_gray(path)
+        coverage = ink_coverage(gray)
+
+        if coverage < self.blank_coverage:
+            decision = TriageDecision(filename, page, keep=False, reason="blank", ink_coverage=coverage)
+        else:
+            bits = dhash_bits(gray)
+            mask = ink_mask(gray)
+            decision = TriageDecision(filename, page, keep=True, ink_coverage=coverage)
+            if self._hashes:
+                distances = np.count_nonzero(np.stack(self._hashes) != bits, axis=1)
+                similar_ink = np.abs(np.asarray(self._coverages) - coverage) <= self.max_coverage_delta
+                candidates = np.flatnonzero((distances <= self.max_hash_distance) & similar_ink)
+                for best in candidates[np.argsort(distances[candidates], kind="stable")]:
+                    diff = pixel_diff(mask, self._mask(best))
+                    if diff <= self.max_pixel_diff:
+                        decision = TriageDecision(filename, page, keep=False, reason="near_duplicate", ink_coverage=coverage,
+                                                  duplicate_of=self._pages[best], distance=int(distances[best]), pixel_diff=diff)
+                        break
+            if decision.keep:
+                self._hashes.append(bits)
+                self._coverages.append(coverage)
+                self._masks.append((mask.shape, np.packbits(mask)))  # 1 bit per pixel while kept
+                self._pages.append(page)
+
+        self.decisions.append(decision)
+        return decision
+
+    def _mask(self, i: int) -> np.ndarray:
+        shape, packed = self._masks[i]
+        return np.unpackbits(packed, count=shape[0] * shape[1]).reshape(shape).astype(bool)
+
+    def report(self) -> dict:
+        return {
+            "pages_total": len(self.decisions),
+            "pages_kept": [d.page for d in self.decisions if d.keep],
+            "skipped": [d.to_dict() for d in self.decisions if not d.keep],
+            "settings": {
+                "blank_coverage": self.blank_coverage,
+                "max_hash_distance": self.max_hash_distance,
+                "max_coverage_delta": self.max_coverage_delta,
+                "max_pixel_diff": self.max_pixel_diff,
+            },
+        }
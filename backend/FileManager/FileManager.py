@@ -3,7 +3,57 @@ from shared.StorageRef import StorageRef, StorageMode
 import os
 import json
 import uuid
-from typing import Any
+import shutil
+import hashlib
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Iterator, TextIO
+
+IMAGE_MIME_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp"}
+# pages routed through the text-layer fast path are stored next to the images as page_<n>.txt
+PAGE_TEXT_EXTENSION = ".txt"
+
+
+def page_number_from_filename(filename: str) -> int:
+    # "page_12.png" / "page_12.jpg" / "page_12_tile_0_1.png" -> 12
+    return int(Path(filename).stem.split("_")[1])
+
+
+def tile_from_filename(filename: str) -> tuple[int, int] | None:
+    # "page_12_tile_0_1.png" -> (0, 1); whole pages -> None
+    parts = Path(filename).stem.split("_")
+    if len(parts) == 5 and parts[2] == "tile":
+        return int(parts[3]), int(parts[4])
+    return None
+
+
+def page_sort_key(filename: str) -> tuple:
+    # page order first, then tiles of that page row by row
+    return (page_number_from_filename(filename), tile_from_filename(filename) or (-1, -1))
+
+
+def batch_csv_filename(batch_num: int) -> str:
+    # 0-based batch index -> "batch_1.csv"
+    return f"batch_{batch_num + 1}.csv"
+
+
+def batch_sort_key(filename: str) -> tuple:
+    # "batch_10.csv" sorts after "batch_9.csv"
+    stem = Path(filename).stem
+    prefix, _, number = stem.rpartition("_")
+    return (prefix, int(number)) if number.isdigit() else (stem, -1)
+
+
+def image_mime_type(filename: str) -> str:
+    return IMAGE_MIME_TYPES[Path(filename).suffix.lower()]
+
+
+def is_text_page(filename: str) -> bool:
+    return Path(filename).suffix.lower() == PAGE_TEXT_EXTENSION
+
+
+def page_variant_subdir(variant: str) -> str:
+    return f"previews/{variant}"
+
 
 class FileManager:
 
@@ -21,6 +71,8 @@ class FileManager:
         if self.mode == StorageMode.LOCAL:
             path = self._make_path(user_id, job_id, "pdfs", filename)
             path.parent.mkdir(parents=True, exist_ok=True)
+            # the old file may be a hard link into pdf_blobs; never write through it
+            path.unlink(missing_ok=True)
             path.write_bytes(pdf_bytes)
             location = str(path.relative_to(self.base_dir))
         
@@ -34,18 +86,196 @@ class FileManager:
 
 
 
-    def save_image(self, user_id: str, job_id: str, filename: str, image_bytes: bytes) -> str:
-        path = self._make_path(user_id, job_id, "images", filename)
+    # ---------------------------- PDF BLOBS ----------------------------
+    # Uploads are stored once under pdf_blobs/<sha256>.pdf and hard linked into each job's pdfs dir.
+
+    def save_pdf_stream(self, user_id: str, job_id: str, pdf_stream: BinaryIO, filename: str = "input.pdf",
+                        chunk_size: int = 1024 * 1024) -> tuple[StorageRef, StorageRef, str, int]:
+        """
+        Write an upload to the blob store, hashing it chunk by chunk as it is written, and link it into the job.
+        Returns (job pdf ref, blob ref, sha256, size in bytes). Bytes already in the store are not written twice.
+        """
+        if self.mode == StorageMode.LOCAL:
+            blob_dir = self.base_dir / "pdf_blobs"
+            blob_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = blob_dir / f"upload_{uuid.uuid4().hex}.tmp"
+            h = hashlib.sha256()
+            size = 0
+            try:
+                with open(tmp_path, "wb") as f:
+                    for chunk in iter(lambda: pdf_stream.read(chunk_size), b""):
+                        h.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+                sha256 = h.hexdigest()
+                blob_path = blob_dir / f"{sha256}.pdf"
+                if blob_path.exists():
+                    tmp_path.unlink()
+                else:
+                    os.replace(tmp_path, blob_path)
+            finally:
+                tmp_path.unlink(missing_ok=True)
+
+            path = self._make_path(user_id, job_id, "pdfs", filename)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.unlink(missing_ok=True)
+            self._link_or_copy(blob_path, path)
+            job_ref = StorageRef(location=str(path.relative_to(self.base_dir)), mode=self.mode)
+            blob_ref = StorageRef(location=str(blob_path.relative_to(self.base_dir)), mode=self.mode)
+            return job_ref, blob_ref, sha256, size
+        elif self.mode == StorageMode.S3:
+            raise NotImplementedError("S3 storage mode is not implemented yet. save_pdf_stream()")
+        else:
+            raise ValueError(f"Unsupported storage mode: {self.mode}")
+
+    def link_job_files(self, src_ref: StorageRef, user_id: str, job_id: str, subdir: str,
+                       filenames: list[str] | None = None) -> StorageRef:
+        """
+        Hard link files from another job's directory into this job's `subdir` (recursively when
+        filenames is None) and return the new directory ref. Used to reuse artifacts of identical uploads.
+        """
+        if self.mode == StorageMode.LOCAL:
+            src_dir = self.base_dir / src_ref.location
+            dst_dir = self.base_dir / f"user_{user_id}" / f"job_{job_id}" / subdir
+            dst_dir.mkdir(parents=True, exist_ok=True)
+            if filenames is None:
+                sources = [p for p in src_dir.rglob("*") if p.is_file()]
+            else:
+                sources = [src_dir / name for name in filenames if (src_dir / name).is_file()]
+            for src in sources:
+                dst = dst_dir / src.relative_to(src_dir)
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                dst.unlink(missing_ok=True)
+                self._link_or_copy(src, dst)
+            return StorageRef(location=str(dst_dir.relative_to(self.base_dir)), mode=self.mode)
+        elif self.mode == StorageMode.S3:
+            raise NotImplementedError("S3 storage mode is not implemented yet. link_job_files()")
+        else:
+            raise ValueError(f"Unsupported storage mode: {self.mode}")
+
+    def clear_job_files(self, user_id: str, job_id: str, subdir: str, keep=None) -> int:
+        """
+        Delete the files under this job's `subdir` (recursively), except those keep(path) accepts; paths
+        are relative to `subdir`. Only this job's links go: a file shared with another job or the render
+        cache stays there. Returns the number of files deleted.
+        """
+        if self.mode == StorageMode.LOCAL:
+            dir_path = self.base_dir / f"user_{user_id}" / f"job_{job_id}" / subdir
+            if not dir_path.is_dir():
+                return 0
+            removed = 0
+            for path in [p for p in dir_path.rglob("*") if p.is_file()]:
+                if keep is None or not keep(path.relative_to(dir_path)):
+                    path.unlink(missing_ok=True)
+                    removed += 1
+            return removed
+        elif self.mode == StorageMode.S3:
+            raise NotImplementedError("S3 storage mode is not implemented yet. clear_job_files()")
+        else:
+            raise ValueError(f"Unsupported storage mode: {self.mode}")
+
+    def _replace_file(self, path: Path, data: bytes | str):
+        # write then rename: a path linked from (or into) another job gets a new file instead of
+        # rewriting the one both jobs share
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            if isinstance(data, str):
+                tmp_path.write_text(data, encoding="utf-8")
+            else:
+                tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def _link_or_copy(self, src: Path, dst: Path):
+        try:
+            os.link(src, dst)
+        except OSError:
+            # e.g. filesystem without hard links
+            shutil.copyfile(src, dst)
+
+    def save_image(self, user_id: str, job_id: str, filename: str, image_bytes: bytes, subdir: str = "images") -> str:
+        path = self._make_path(user_id, job_id, subdir, filename)
         path.parent.mkdir(parents=True, exist_ok=True)
+        # the old file may be a hard link into the render cache; never write through it
+        path.unlink(missing_ok=True)
         path.write_bytes(image_bytes)
         return str(path.relative_to(self.base_dir))
 
+    # ---------------------------- RENDER CACHE ----------------------------
+    # Rendered pages are stored once under render_cache/<pdf sha256>/ and hard linked
+    # into each job's images dir, so re-submitting the same plan set skips rasterization.
+
+    def hash_file(self, ref: StorageRef) -> str:
+        if ref.mode == StorageMode.LOCAL:
+            h = hashlib.sha256()
+            with open(self.base_dir / ref.location, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(chunk)
+            return h.hexdigest()
+        elif ref.mode == StorageMode.S3:
+            raise NotImplementedError("S3 storage mode is not implemented yet. hash_file()")
+        else:
+            raise ValueError(f"Unsupported mode {ref.mode}")
+
+    def _render_cache_path(self, pdf_hash: str, page_number: int, dpi: int, fmt: str) -> Path:
+        return self.base_dir / "render_cache" / pdf_hash / f"page_{page_number}_{dpi}dpi.{fmt}"
+
+    def get_cached_render(self, pdf_hash: str, page_number: int, dpi: int, fmt: str) -> Path | None:
+        if self.mode != StorageMode.LOCAL:
+            return None
+        path = self._render_cache_path(pdf_hash, page_number, dpi, fmt)
+        return path if path.exists() else None
+
+    def save_cached_render(self, pdf_hash: str, page_number: int, dpi: int, fmt: str, image_bytes: bytes) -> Path:
+        if self.mode == StorageMode.LOCAL:
+            path = self._render_cache_path(pdf_hash, page_number, dpi, fmt)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # write-then-rename so a concurrent job never links a half written file
+            tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+            tmp_path.write_bytes(image_bytes)
+            os.replace(tmp_path, path)
+            return path
+        elif self.mode == StorageMode.S3:
+            raise NotImplementedError("S3 storage mode is not implemented yet. save_cached_render()")
+        else:
+            raise ValueError(f"Unsupported storage mode: {self.mode}")
+
+    def link_cached_image(self, user_id: str, job_id: str, filename: str, cached_path: Path, subdir: str = "images") -> str:
+        path = self._make_path(user_id, job_id, subdir, filename)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.unlink(missing_ok=True)
+        self._link_or_copy(cached_path, path)
+        return str(path.relative_to(self.base_dir))
+
+    def save_page_text(self, user_id: str, job_id: str, filename: str, text: str) -> str:
+        path = self._make_path(user_id, job_id, "images", filename)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._replace_file(path, text)
+        return str(path.relative_to(self.base_dir))
+
     def save_csv(self, user_id: str, job_id: str, filename: str, csv_bytes: bytes) -> str:
         path = self._make_path(user_id, job_id, "csvs", filename)
         path.parent.mkdir(parents=True, exist_ok=True)
-        path.write_bytes(csv_bytes)
+        self._replace_file(path, csv_bytes)
         return str(path.relative_to(self.base_dir))
 
+    @contextmanager
+    def open_csv_stream(self, user_id: str, job_id: str, filename: str) -> Iterator[TextIO]:
+        """
+        Text handle for writing a batch CSV as its rows arrive. Rows go to <filename>.part, which only
+        becomes <filename> if the block finishes; on an exception the partial file is removed.
+        """
+        path = self._make_path(user_id, job_id, "csvs", filename)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        part = path.with_name(path.name + ".part")
+        try:
+            with open(part, "w", encoding="utf-8", newline="") as f:
+                yield f
+            os.replace(part, path)
+        finally:
+            part.unlink(missing_ok=True)
+
     def load_file(self, ref: StorageRef) -> bytes:
         if ref.mode == StorageMode.LOCAL:
             path = self.base_dir / ref.location
@@ -78,6 +308,19 @@ class FileManager:
         return StorageRef(location=location, mode=self.mode)
     
     
+    def get_page_variant_dir(self, user_id: str, job_id: str, variant: str) -> StorageRef:
+        # thumbnail / preview renditions of the page images, previews/<variant>/page_<n>.<ext>
+        if self.mode == StorageMode.LOCAL:
+            dir_path = self.base_dir / f"user_{user_id}" / f"job_{job_id}" / page_variant_subdir(variant)
+            dir_path.mkdir(parents=True, exist_ok=True)
+            location = str(dir_path.relative_to(self.base_dir))
+        elif self.mode == StorageMode.S3:
+            raise NotImplementedError(f"S3 storage mode is not implemented yet. get_page_variant_dir()")
+        else:
+            raise ValueError(f"Unsupported storage mode: {self.mode}")
+
+        return StorageRef(location=location, mode=self.mode)
+
     def get_csvs_dir(self, user_id: str, job_id: str) -> StorageRef:
         if self.mode == StorageMode.LOCAL:
             dir_path = self.base_dir / f"user_{user_id}" / f"job_{job_id}" / "csvs"
@@ -120,23 +363,39 @@ class FileManager:
             print("\n\n" + str(path) + "\n\n")
             image_files = sorted([
                 f for f in os.listdir(path)
-                if f.lower().endswith(".png")
-            ], key=lambda x: int(x.replace("page_", "").replace(".png", "")))
+                if Path(f).suffix.lower() in IMAGE_MIME_TYPES
+            ], key=page_sort_key)
             if not image_files:
-                raise FileNotFoundError(f"No .png files found in {path}")
+                raise FileNotFoundError(f"No page images found in {path}")
             return image_files
         elif self.mode == StorageMode.S3:
             raise NotImplementedError(f"S3 storage mode is not implemented yet. get_image_files()")
         else:
             raise ValueError(f"Unsupported storage mode: {self.mode}")
         
+    def get_page_files(self, images_ref: StorageRef):
+        # page images plus text-layer pages, in page order
+        if self.mode == StorageMode.LOCAL:
+            path = self.base_dir / images_ref.location
+            page_files = sorted([
+                f for f in os.listdir(path)
+                if Path(f).suffix.lower() in IMAGE_MIME_TYPES or is_text_page(f)
+            ], key=page_sort_key)
+            if not page_files:
+                raise FileNotFoundError(f"No pages found in {path}")
+            return page_files
+        elif self.mode == StorageMode.S3:
+            raise NotImplementedError(f"S3 storage mode is not implemented yet. get_page_files()")
+        else:
+            raise ValueError(f"Unsupported storage mode: {self.mode}")
+
     def get_csv_files(self, csvs_ref: StorageRef):
         if self.mode == StorageMode.LOCAL:
             path = self.base_dir / csvs_ref.location
             csv_files = sorted([
                 f for f in os.listdir(path)
                 if f.lower().endswith(".csv")
-            ])
+            ], key=batch_sort_key)
             if not csv_files:
                 raise FileNotFoundError(f"No .csv files found in {path}")
             return csv_files
@@ -195,8 +454,7 @@ class FileManager:
             dir_path = self.base_dir / json_ref.location
             dir_path.mkdir(parents=True, exist_ok=True)
             file_path = dir_path / "combined.json"
-            with open(file_path, "w", encoding="utf-8") as f:
-                json.dump(combined_data, f, indent=2)
+            self._replace_file(file_path, json.dumps(combined_data, indent=2))
             #return StorageRef(location=str(file_path), mode=self.mode)
             relative_path = file_path.relative_to(self.base_dir)
             return StorageRef(location=str(relative_path), mode=self.mode)
@@ -215,8 +473,11 @@ class FileManager:
             dir_path = self.base_dir / f"user_{user_id}" / f"job_{job_id}" / "json"
             dir_path.mkdir(parents=True, exist_ok=True)
             file_path = dir_path / fname
-            with open(file_path, "w", encoding="utf-8") as f:
+            # write then rename, so a crash mid-write never leaves a truncated file (manifests are rewritten often)
+            tmp_path = dir_path / f".{fname}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
                 json.dump(cmap, f, indent=2)
+            os.replace(tmp_path, file_path)
             #return StorageRef(location=str(file_path), mode=self.mode)
             relative_path = file_path.relative_to(self.base_dir)
             return StorageRef(location=str(relative_path), mode=self.mode)
@@ -279,6 +540,31 @@ class FileManager:
 
 
         
+    # ---------------------------- JOB METADATA ----------------------------
+    # Pipeline decisions (page routing, etc.) for a job, kept in json/job_metadata.json
+
+    def get_job_metadata(self, user_id: str, job_id: str) -> dict:
+        return self.get_job_json(user_id, job_id, "job_metadata.json") or {}
+
+    def get_job_json(self, user_id: str, job_id: str, fname: str) -> dict | None:
+        # a file saved with save_json_as, or None if the job doesn't have it
+        if self.mode == StorageMode.LOCAL:
+            path = self._make_path(user_id, job_id, "json", fname)
+            if not path.exists():
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        elif self.mode == StorageMode.S3:
+            raise NotImplementedError("S3 storage mode is not implemented yet. get_job_json()")
+        else:
+            raise ValueError(f"Unsupported storage mode: {self.mode}")
+
+    def update_job_metadata(self, user_id: str, job_id: str, updates: dict) -> StorageRef:
+        # top level keys in `updates` replace the ones already stored
+        metadata = self.get_job_metadata(user_id, job_id)
+        metadata.update(updates)
+        return self.save_json_as(user_id, job_id, metadata, "job_metadata.json")
+
     def get_image_path(self, images_ref: StorageRef, image_name):
         return self.base_dir / images_ref.location / image_name
         # I should stub out the S3 version here, but I don't want to right now TODO
@@ -35,8 +35,29 @@ class ContactRepository:
               trade TEXT
             )
         """)
+        # bumped by triggers on every write to either table, whoever makes it; contact maps
+        # built at an older version are out of date (see get_version)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS contacts_version (
+              id INTEGER PRIMARY KEY CHECK (id = 1),
+              version INTEGER NOT NULL
+            )
+        """)
+        self.conn.execute("INSERT OR IGNORE INTO contacts_version (id, version) VALUES (1, 0)")
+        for table in ("contacts", "contact_trades"):
+            for op in ("INSERT", "UPDATE", "DELETE"):
+                self.conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS {table}_version_{op.lower()} AFTER {op} ON {table}
+                    BEGIN
+                      UPDATE contacts_version SET version = version + 1 WHERE id = 1;
+                    END
+                """)
         self.conn.commit()
 
+    def get_version(self) -> int:
+        row = self.conn.execute("SELECT version FROM contacts_version WHERE id = 1").fetchone()
+        return row[0] if row else 0
+
     def find_contact_ids_by_trade(self, trade_canonical: str, limit: int | None = None) -> List[str]:
         sql = """
           SELECT DISTINCT contact_id
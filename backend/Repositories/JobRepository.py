@@ -68,6 +68,12 @@ class JobRepository:
         row = cur.fetchone()
         return row["user_id"] if row else None
 
+    def update_status(self, job_id: str, status: str):
+        # stage-less transitions of a queued pipeline run: queued / running / failed
+        cur = self.conn.cursor()
+        cur.execute("UPDATE jobs SET status = ? WHERE job_id = ?", (status, job_id))
+        self.conn.commit()
+
     def update_status_pdf_saved(self, job_id: str, pdf_ref: StorageRef):
         cur = self.conn.cursor()
        # print("Hi from the Job Repository in update_status_pdf_saved " + pdf_ref.location + " : " + job_id)
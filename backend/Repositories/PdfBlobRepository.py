@@ -0,0 +1,94 @@
+import sqlite3
+from typing import Optional, Dict
+from shared.StorageRef import StorageRef
+from Utils.logger import get_logger
+log = get_logger(__name__)
+
+class PdfBlobRepository:
+    """
+    Index of uploaded PDFs by sha256, plus the pipeline artifacts produced for them.
+      pdf_blobs(sha256)         -> the stored blob and how often it was uploaded
+      pdf_artifacts(sha256, prompt_hash, config_hash, page_selection)
+                                -> the job whose images / CSVs / combined.json can be reused
+    """
+
+    def __init__(self, db_path="pdf_blobs.db", conn: sqlite3.Connection = None):
+        if conn:
+            self.conn = conn
+        else:
+            self.conn = sqlite3.connect(db_path, check_same_thread=False)
+
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS pdf_blobs (
+                sha256 TEXT PRIMARY KEY,
+                size_bytes INTEGER NOT NULL,
+                blob_ref TEXT NOT NULL,
+                blob_mode TEXT NOT NULL,
+                upload_count INTEGER NOT NULL DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+
+            CREATE TABLE IF NOT EXISTS pdf_artifacts (
+                sha256 TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                config_hash TEXT NOT NULL,
+                page_selection TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                job_id TEXT NOT NULL,
+                images_ref TEXT NOT NULL,
+                csvs_ref TEXT NOT NULL,
+                jsons_ref TEXT NOT NULL,
+                storage_mode TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (sha256, prompt_hash, config_hash, page_selection)
+            );
+        ''')
+        self.conn.commit()
+
+    def record_upload(self, sha256: str, size_bytes: int, blob_ref: StorageRef) -> Dict:
+        cur = self.conn.cursor()
+        cur.execute('''
+            INSERT INTO pdf_blobs (sha256, size_bytes, blob_ref, blob_mode) VALUES (?, ?, ?, ?)
+            ON CONFLICT(sha256) DO UPDATE SET upload_count = upload_count + 1, last_seen_at = CURRENT_TIMESTAMP
+        ''', (sha256, size_bytes, blob_ref.location, blob_ref.mode.value))
+        self.conn.commit()
+        return self.get_blob(sha256)
+
+    def get_blob(self, sha256: str) -> Optional[Dict]:
+        cur = self.conn.cursor()
+        cur.execute("SELECT * FROM pdf_blobs WHERE sha256 = ?", (sha256,))
+        row = cur.fetchone()
+        return dict(row) if row else None
+
+    def record_artifacts(self, sha256: str, prompt_hash: str, config_hash: str, page_selection: str,
+                         user_id: str, job_id: str, images_ref: StorageRef, csvs_ref: StorageRef, jsons_ref: StorageRef):
+        # the newest job for a key wins
+        cur = self.conn.cursor()
+        cur.execute('''
+            INSERT OR REPLACE INTO pdf_artifacts
+                (sha256, prompt_hash, config_hash, page_selection, user_id, job_id, images_ref, csvs_ref, jsons_ref, storage_mode)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (sha256, prompt_hash, config_hash, page_selection, user_id, job_id,
+              images_ref.location, csvs_ref.location, jsons_ref.location, images_ref.mode.value))
+        self.conn.commit()
+        log.debug("Recorded reusable artifacts", extra={"job_id": job_id, "sha256": sha256})
+
+    def find_artifacts(self, sha256: str, prompt_hash: str, config_hash: str, page_selection: str) -> Optional[Dict]:
+        cur = self.conn.cursor()
+        cur.execute('''
+            SELECT * FROM pdf_artifacts
+            WHERE sha256 = ? AND prompt_hash = ? AND config_hash = ? AND page_selection = ?
+        ''', (sha256, prompt_hash, config_hash, page_selection))
+        row = cur.fetchone()
+        return dict(row) if row else None
+
+    def delete_artifacts(self, sha256: str, prompt_hash: str, config_hash: str, page_selection: str) -> bool:
+        cur = self.conn.cursor()
+        cur.execute('''
+            DELETE FROM pdf_artifacts
+            WHERE sha256 = ? AND prompt_hash = ? AND config_hash = ? AND page_selection = ?
+        ''', (sha256, prompt_hash, config_hash, page_selection))
+        self.conn.commit()
+        return cur.rowcount > 0
@@ -0,0 +1,166 @@
+import json
+import sqlite3
+import uuid
+from typing import Optional, Dict, Tuple
+from Utils.logger import get_logger
+log = get_logger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class PipelineQueueRepository:
+    """
+    Durable queue of pipeline runs (a PDF submission to render -> LLM -> combine -> normalize -> map).
+    A row is queued by the request, claimed by one worker, and ends done or failed; `stages` holds
+    the per-stage progress the worker reports. Rows survive restarts: runs that were still running
+    when the process died are queued again on startup (requeue_interrupted).
+    """
+
+    def __init__(self, db_path="pipeline_queue.db", conn: sqlite3.Connection = None):
+        if conn:
+            self.conn = conn
+        else:
+            self.conn = sqlite3.connect(db_path, check_same_thread=False)
+
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS pipeline_queue (
+                run_id TEXT PRIMARY KEY,
+                job_id TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                stages TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                result TEXT,
+                worker_id TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_pipeline_queue_status ON pipeline_queue (status);
+            CREATE INDEX IF NOT EXISTS idx_pipeline_queue_job ON pipeline_queue (job_id);
+        ''')
+        # at most one queued or running run per job: two requests racing to queue the same job
+        # can't both get in, and two workers never write into one job folder
+        try:
+            self.conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_pipeline_queue_active_job ON pipeline_queue (job_id) "
+                f"WHERE status IN ('{QUEUED}', '{RUNNING}')"
+            )
+        except sqlite3.IntegrityError:
+            # a database from before the index with a job queued twice; enqueue still checks first
+            log.warning("Pipeline queue has jobs with more than one active run")
+        self.conn.commit()
+
+    def enqueue(self, job_id: str, user_id: str, kind: str, params: Dict) -> Optional[str]:
+        """Queue a run and return its id; None if the job already has a queued or running run."""
+        run_id = str(uuid.uuid4())
+        cur = self.conn.cursor()
+        try:
+            cur.execute(
+                "INSERT INTO pipeline_queue (run_id, job_id, user_id, kind, params, status) "
+                "SELECT ?, ?, ?, ?, ?, ? WHERE NOT EXISTS "
+                "(SELECT 1 FROM pipeline_queue WHERE job_id = ? AND status IN (?, ?))",
+                (run_id, job_id, user_id, kind, json.dumps(params), QUEUED, job_id, QUEUED, RUNNING)
+            )
+        except sqlite3.IntegrityError:
+            self.conn.rollback()
+            return None
+        self.conn.commit()
+        if cur.rowcount == 0:
+            return None
+        log.info("Queued pipeline run", extra={"job_id": job_id, "run_id": run_id, "kind": kind})
+        return run_id
+
+    def claim_next(self, worker_id: str) -> Optional[Dict]:
+        """Mark the oldest queued run as running for this worker and return it; None when the queue is empty."""
+        cur = self.conn.cursor()
+        # one statement, so two workers can't claim the same row
+        cur.execute('''
+            UPDATE pipeline_queue
+            SET status = ?, worker_id = ?, attempts = attempts + 1, error = NULL,
+                started_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE run_id = (SELECT run_id FROM pipeline_queue WHERE status = ? ORDER BY rowid LIMIT 1)
+              AND status = ?
+            RETURNING *
+        ''', (RUNNING, worker_id, QUEUED, QUEUED))
+        row = cur.fetchone()
+        self.conn.commit()
+        return self._row(row)
+
+    def update_progress(self, run_id: str, stage: str, stages: Dict):
+        cur = self.conn.cursor()
+        cur.execute(
+            "UPDATE pipeline_queue SET stage = ?, stages = ?, updated_at = CURRENT_TIMESTAMP WHERE run_id = ?",
+            (stage, json.dumps(stages), run_id)
+        )
+        self.conn.commit()
+
+    def finish(self, run_id: str, result: Dict):
+        self._end(run_id, DONE, result=json.dumps(result))
+
+    def fail(self, run_id: str, error: str):
+        self._end(run_id, FAILED, error=error)
+
+    def requeue_interrupted(self, max_attempts: int) -> Tuple[int, int]:
+        """
+        Runs still marked running belong to a process that is gone: queue them again, or fail them
+        once they have had max_attempts. Call before any worker starts. Returns (requeued, failed).
+        """
+        cur = self.conn.cursor()
+        cur.execute(
+            "UPDATE pipeline_queue SET status = ?, error = ?, finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP "
+            "WHERE status = ? AND attempts >= ?",
+            (FAILED, "Interrupted too many times", RUNNING, max_attempts)
+        )
+        failed = cur.rowcount
+        cur.execute(
+            "UPDATE pipeline_queue SET status = ?, worker_id = NULL, updated_at = CURRENT_TIMESTAMP WHERE status = ?",
+            (QUEUED, RUNNING)
+        )
+        requeued = cur.rowcount
+        self.conn.commit()
+        if requeued or failed:
+            log.info("Recovered interrupted pipeline runs", extra={"requeued": requeued, "failed": failed})
+        return requeued, failed
+
+    def get_run(self, run_id: str) -> Optional[Dict]:
+        cur = self.conn.cursor()
+        cur.execute("SELECT * FROM pipeline_queue WHERE run_id = ?", (run_id,))
+        return self._row(cur.fetchone())
+
+    def get_latest_for_job(self, job_id: str) -> Optional[Dict]:
+        cur = self.conn.cursor()
+        cur.execute("SELECT * FROM pipeline_queue WHERE job_id = ? ORDER BY rowid DESC LIMIT 1", (job_id,))
+        return self._row(cur.fetchone())
+
+    def has_active_run(self, job_id: str) -> bool:
+        cur = self.conn.cursor()
+        cur.execute("SELECT 1 FROM pipeline_queue WHERE job_id = ? AND status IN (?, ?) LIMIT 1", (job_id, QUEUED, RUNNING))
+        return cur.fetchone() is not None
+
+    def _end(self, run_id: str, status: str, result: str | None = None, error: str | None = None):
+        cur = self.conn.cursor()
+        cur.execute(
+            "UPDATE pipeline_queue SET status = ?, result = ?, error = ?, finished_at = CURRENT_TIMESTAMP, "
+            "updated_at = CURRENT_TIMESTAMP WHERE run_id = ?",
+            (status, result, error, run_id)
+        )
+        self.conn.commit()
+
+    def _row(self, row) -> Optional[Dict]:
+        if row is None:
+            return None
+        run = dict(row)
+        for key in ("params", "stages", "result"):
+            run[key] = json.loads(run[key]) if run[key] else None
+        return run
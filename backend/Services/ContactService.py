@@ -17,6 +17,10 @@ class ContactService:
         """
         return self.contact_repo.find_contact_ids_by_trade(trade_canonical, limit=limit)
     
+    def get_contacts_version(self) -> int:
+        """Changes whenever a contact or its trades change; an input of the contact-map pipeline stage."""
+        return self.contact_repo.get_version()
+
     # TODO Slice 7 - function to get contacts by parameters
     def get_contacts_by_parameters(self, params_dto: ParamsDTO) -> List[dict]: 
         items = self.contact_repo.find_contacts_by_parameters(params_dto)
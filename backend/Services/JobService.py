@@ -1,31 +1,55 @@
 from Repositories.JobRepository import JobRepository
 from Repositories.ContactRepository import ContactRepository
 from Repositories.EmailRepository import EmailRepository
+from Repositories.PdfBlobRepository import PdfBlobRepository
+from Repositories.PipelineQueueRepository import PipelineQueueRepository
 from FileManager import FileManager  # adjust import path if needed
+from FileManager.FileManager import page_variant_subdir
 from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
 from starlette import status as http_status
 from pathlib import Path
 from shared.StorageRef import StorageRef, StorageMode
+from Services.ContactService import ContactService
 from Services.PromptService import PromptService
 from Services.SchemaService import SchemaService
+from Services.PipelineQueue import PipelineProgress, STAGES
+from Services.ProgressBroker import ProgressBroker, Subscription
+from Core.pipeline_dag import PipelineDag, PipelineState, Stage
 from shared.DTOs import BatchWithEmailHeaders, EmailBatchRecord, EmailHeaderRecord, EmailDetailsRecord
 import json
 from Utils.logger import get_logger
 import hashlib
-from typing import Optional, Dict, List, Literal
+import io
+from typing import Optional, Dict, List, Literal, BinaryIO
 from datetime import datetime
 
 log = get_logger(__name__)
 
+# stages whose artifacts can be linked from an identical earlier upload (_reuse_artifacts)
+FRONT_STAGES = {"render", "llm", "combine"}
+
+ACTIVE_RUN_CONFLICT = "This job is already queued or running"
+
 class JobService:
-    def __init__(self, job_repo: JobRepository, contacts_repo: ContactRepository, file_manager: FileManager, core, prompt_service: PromptService, schema_service: SchemaService, email_repo: EmailRepository):
+    def __init__(self, job_repo: JobRepository, contacts_repo: ContactRepository, file_manager: FileManager, core, prompt_service: PromptService, schema_service: SchemaService, email_repo: EmailRepository,
+                 pdf_blob_repo: PdfBlobRepository | None = None, queue_repo: PipelineQueueRepository | None = None,
+                 progress_broker: ProgressBroker | None = None):
         self.job_repo = job_repo
         self.contacts_repo = contacts_repo
+        # contact lookups of the pipeline go through this service's connection, not the one Core was built with
+        self.contact_service = ContactService(contacts_repo)
         self.file_manager = file_manager
         self.core = core
         self.prompt_service = prompt_service
         self.schema_service = schema_service
         self.email_repo = email_repo
+        # upload dedup / artifact reuse is off without a blob index
+        self.pdf_blob_repo = pdf_blob_repo
+        # background pipeline runs (enqueue_pdf / run_queued); submit_pdf works without it
+        self.queue_repo = queue_repo
+        # live progress for watch_progress (GET /jobs/{job_id}/events)
+        self.progress_broker = progress_broker
 
     def create_job(self, user_id: str, job_name: str, notes: str) -> str:
         try:
@@ -310,65 +334,424 @@ class JobService:
         return rec
 
 
-    # TODO complete this...
-    def submit_pdf(self, user_id: str, job_id: str, pdf_file: bytes, safe_name):
+    def enqueue_pdf(self, user_id: str, job_id: str, pdf_file: bytes | BinaryIO, safe_name, streaming: bool = False, pages="all"):
+        """
+        Save the upload and queue the rest of the pipeline for the workers (see Services.PipelineQueue).
+        Returns right away with the run id; GET /jobs/{job_id}/progress follows the run.
+        """
+        self._assert_can_enqueue(user_id, job_id)
+        pdf_ref, pdf_sha256 = self._save_pdf(user_id, job_id, pdf_file, safe_name)
+        # a bad page selection is the caller's error (ValueError -> 400), not the worker's
+        self.core.resolve_page_selection(pdf_ref, pages)
+        return self._enqueue_run(user_id, job_id, "submit_pdf", pdf_ref, pdf_sha256, streaming, pages)
+
+    def enqueue_rerun(self, user_id: str, job_id: str, force=()):
+        """
+        Queue the pipeline again for the PDF this job already has, with its page selection. Only the
+        stages whose inputs changed since they last ran (new prompt, schema, contacts...) are
+        recomputed; `force` names stages to re-run anyway.
+        """
+        self._assert_can_enqueue(user_id, job_id)
+        job = self.job_repo.get_job_by_id(job_id)
+        if not job.get("pdf_ref"):
+            raise HTTPException(http_status.HTTP_409_CONFLICT, "No PDF uploaded for this job yet")
+        unknown = set(force) - set(STAGES)
+        if unknown:
+            raise ValueError(f"Unknown pipeline stages: {', '.join(sorted(unknown))}")
+        pdf_ref = StorageRef(location=job["pdf_ref"], mode=StorageMode(job.get("pdf_mode") or "local"))
+        metadata = self.file_manager.get_job_metadata(user_id, job_id)
+        pdf_sha256 = metadata.get("pdf_sha256") or self.file_manager.hash_file(pdf_ref)
+        return self._enqueue_run(user_id, job_id, "rerun", pdf_ref, pdf_sha256, False, metadata.get("page_selection", "all"),
+                                 force=list(force))
+
+    def enqueue_resume(self, user_id: str, job_id: str):
+        """
+        Queue a resume of the job's unfinished LLM batches (see resume). Checked here, so a job with
+        nothing to resume is a 409 for the caller rather than a failed run.
+        """
+        self._assert_can_enqueue(user_id, job_id)
+        prompt, _ = self.prompt_service.get_active_prompt()
+        self._check_resumable(user_id, job_id, prompt)
+        return self._queue(user_id, job_id, "resume", {})
+
+    def _assert_can_enqueue(self, user_id: str, job_id: str):
+        self._assert_owner(user_id, job_id)
+        if self.queue_repo is None:
+            raise HTTPException(http_status.HTTP_503_SERVICE_UNAVAILABLE, "Pipeline queue is not available")
+        if self.queue_repo.has_active_run(job_id):
+            raise HTTPException(http_status.HTTP_409_CONFLICT, ACTIVE_RUN_CONFLICT)
+
+    def _enqueue_run(self, user_id: str, job_id: str, kind: str, pdf_ref: StorageRef, pdf_sha256: str, streaming: bool,
+                     pages, force=()):
+        return self._queue(user_id, job_id, kind, {
+            "pdf_ref": pdf_ref.location, "pdf_mode": pdf_ref.mode.value, "pdf_sha256": pdf_sha256,
+            "streaming": streaming, "pages": pages, "force": list(force),
+        })
+
+    def _queue(self, user_id: str, job_id: str, kind: str, params: dict):
+        # the insert itself refuses a second active run, so a request that raced past
+        # _assert_can_enqueue still gets the 409
+        run_id = self.queue_repo.enqueue(job_id, user_id, kind, params)
+        if run_id is None:
+            raise HTTPException(http_status.HTTP_409_CONFLICT, ACTIVE_RUN_CONFLICT)
+        self.job_repo.update_status(job_id, "queued")
+        if self.progress_broker is not None:
+            self.progress_broker.publish(job_id, "queued", run_id=run_id)
+        return {"status": "QUEUED", "job_id": job_id, "run_id": run_id}
+
+    def run_queued(self, run: dict, progress: PipelineProgress) -> dict:
+        # executes a claimed pipeline_queue row on a worker thread; the result is stored on the row
+        params = run["params"]
+        self.job_repo.update_status(run["job_id"], "running")
+        if run["kind"] == "resume":
+            ret = self.resume(run["user_id"], run["job_id"], progress)
+            return jsonable_encoder({k: v for k, v in ret.items() if k != "contacts_map"})
+        pdf_ref = StorageRef(location=params["pdf_ref"], mode=StorageMode(params["pdf_mode"]))
+        ret = self.run_pipeline(run["user_id"], run["job_id"], pdf_ref, params["pdf_sha256"],
+                                streaming=params["streaming"], pages=params["pages"], progress=progress,
+                                force=params.get("force", ()))
+        return jsonable_encoder({k: v for k, v in ret.items() if k != "contacts_map"})
+
+    def get_progress(self, user_id: str, job_id: str) -> dict:
+        self._assert_owner(user_id, job_id)
+        run = self.queue_repo.get_latest_for_job(job_id) if self.queue_repo else None
+        if run is None:
+            raise HTTPException(http_status.HTTP_404_NOT_FOUND, "This job has not been submitted")
+        job = self.job_repo.get_job_by_id(job_id)
+        return {
+            "job_id": job_id,
+            "run_id": run["run_id"],
+            "status": run["status"],
+            "job_status": job["status"] if job else None,
+            "stage": run["stage"],
+            "stages": run["stages"] or PipelineProgress().stages,
+            "attempts": run["attempts"],
+            "error": run["error"],
+            "result": run["result"],
+            "created_at": run["created_at"],
+            "started_at": run["started_at"],
+            "finished_at": run["finished_at"],
+        }
+
+    def watch_progress(self, user_id: str, job_id: str, last_event_id: int | None = None) -> Subscription:
+        """
+        Subscribe to a job's live progress. Only the ownership check (and, the first time this process
+        hears of the job, one read of its latest queue row) touches the database; everything after
+        comes from the broker's memory. Call on the event loop.
+        """
+        self._assert_owner(user_id, job_id)
+        if self.progress_broker is None:
+            raise HTTPException(http_status.HTTP_503_SERVICE_UNAVAILABLE, "Progress events are not available")
+        fallback = None
+        if self.progress_broker.snapshot(job_id) is None:
+            run = self.queue_repo.get_latest_for_job(job_id) if self.queue_repo else None
+            if run is None:
+                raise HTTPException(http_status.HTTP_404_NOT_FOUND, "This job has not been submitted")
+            fallback = {
+                "run_id": run["run_id"], "status": run["status"], "stage": run["stage"],
+                "stages": run["stages"] or {}, "error": run["error"],
+                "contacts_map_ref": (run["result"] or {}).get("contacts_map_ref"),
+            }
+        return self.progress_broker.subscribe(job_id, last_event_id, fallback)
+
+    def submit_pdf(self, user_id: str, job_id: str, pdf_file: bytes | BinaryIO, safe_name, streaming: bool = False, pages="all",
+                   progress: PipelineProgress | None = None):
+        # the whole pipeline in the calling thread; the API queues it instead (enqueue_pdf)
+        pdf_ref, pdf_sha256 = self._save_pdf(user_id, job_id, pdf_file, safe_name)
+        return self.run_pipeline(user_id, job_id, pdf_ref, pdf_sha256, streaming=streaming, pages=pages, progress=progress)
+
+    def _save_pdf(self, user_id: str, job_id: str, pdf_file: bytes | BinaryIO, safe_name):
         # ---------------------------------- SAVING THE PDF ----------------------------------------
+        # pdf_file is the upload stream (or its bytes); it is hashed while it is written to the blob store
         log.info("Submitting PDF", extra={"user_id": user_id, "job_id": job_id, "pdf_filename": safe_name})
-        pdf_ref: StorageRef = self.file_manager.save_pdf(user_id, job_id, pdf_file, safe_name)
+        if isinstance(pdf_file, (bytes, bytearray)):
+            pdf_file = io.BytesIO(pdf_file)
+        pdf_ref, blob_ref, pdf_sha256, pdf_size = self.file_manager.save_pdf_stream(user_id, job_id, pdf_file, safe_name)
+        if self.pdf_blob_repo:
+            blob = self.pdf_blob_repo.record_upload(pdf_sha256, pdf_size, blob_ref)
+            log.debug("PDF blob recorded", extra={"sha256": pdf_sha256, "upload_count": blob["upload_count"]})
         self.job_repo.update_status_pdf_saved(job_id, pdf_ref)
         log.debug("PDF saved", extra={"pdf_ref": pdf_ref.location})
+        return pdf_ref, pdf_sha256
 
-        # ---------------------------------- EXTRACTING IMAGES --------------------------------------
-        # call core.extract_images(pdf_ref) # the function uses the file manager to save the images. It just gets injected. 
-        # updates teh status with the reference to where the images are stored. 
-        images_ref = self.core.extract_images(user_id, job_id, pdf_ref, 7, 10) # TODO - complete implementation. 7 and 10 are just place holders...
-        self.job_repo.update_status_images_extracted(job_id, images_ref)
-        log.debug("Images extracted", extra={"images_ref": images_ref.location})
-
-        # ---------------------------------- SUBMITTING TO THE LLM ----------------------------------------
+    def run_pipeline(self, user_id: str, job_id: str, pdf_ref: StorageRef, pdf_sha256: str, streaming: bool = False,
+                     pages="all", progress: PipelineProgress | None = None, force=()):
+        """
+        Render -> LLM -> combine -> normalize -> contact map for a saved PDF, run as a DAG of stages
+        (see _pipeline_dag) and reported to `progress`. A stage whose inputs (PDF hash, pages, render /
+        LLM settings, prompt, schema, contact table version) match its last run for this job, and whose
+        outputs are still there, is skipped: a schema change only re-normalizes and re-maps.
+        `force` names stages to re-run anyway.
+        """
+        progress = progress or PipelineProgress()
         # get prompt from fileManager
         prompt, prompt_ref_string = self.prompt_service.get_active_prompt()
-        log.debug("Retrieved active prompt")
-        #print("\n\n" + prompt + "\n\n")
+        schema_text, schema_ref = self.schema_service.get_active_schema()
+        log.debug("Retrieved active prompt and schema")
+
+        # which pages to process: "all", "1-5,8", [1, 3, 4] ...
+        self.file_manager.update_job_metadata(user_id, job_id, {"page_selection": pages, "pdf_sha256": pdf_sha256})
+        inputs = {
+            "pdf_sha256": pdf_sha256,
+            "pages": self.core.resolve_page_selection(pdf_ref, pages),
+            "render_settings": self.core.render_fingerprint(),
+            "prompt_sha256": self._hash_text(prompt),
+            "llm_settings": self.core.llm_fingerprint(10),
+            "schema_sha256": self._hash_text(schema_text),
+            "contacts_version": self.contact_service.get_contacts_version(),
+        }
+        dag = self._pipeline_dag(user_id, job_id, pdf_ref, inputs["pages"], prompt, prompt_ref_string, schema_text, schema_ref,
+                                 streaming, progress)
+        state = PipelineState.load(self.file_manager, user_id, job_id)
+
+        # ---------------------------------- REUSING ARTIFACTS OF AN IDENTICAL UPLOAD ----------------------------------------
+        # same bytes + prompt + pipeline settings + pages -> link the earlier job's images / CSVs / combined.json,
+        # unless this job's own are already up to date
+        artifact_key = None
+        reused_from = None
+        if self.pdf_blob_repo:
+            artifact_key = (pdf_sha256, inputs["prompt_sha256"], self.core.pipeline_fingerprint(10), inputs["pages"])
+            if FRONT_STAGES & set(dag.stale(inputs, state, force)):
+                reused = self._reuse_artifacts(user_id, job_id, artifact_key)
+                if reused:
+                    images_ref, csvs_ref, combined_json_ref, reused_from = reused
+                    self.job_repo.update_status_images_extracted(job_id, images_ref)
+                    self.job_repo.update_status_llm_run(job_id, csvs_ref, prompt_ref_string)
+                    image_files = self.core.get_page_files(user_id, job_id, images_ref)
+                    for stage, outputs in (("render", {"images_ref": self._ref_out(images_ref), "image_files": image_files,
+                                                        "pages": len(image_files)}),
+                                           ("llm", {"csvs_ref": self._ref_out(csvs_ref)}),
+                                           ("combine", {"combined_json_ref": self._ref_out(combined_json_ref)})):
+                        dag.adopt(stage, inputs, state, outputs, f"reused from job {reused_from}")
+
+        run = dag.run(inputs, state, progress, force)
+        outputs = run.outputs
+        if artifact_key and "combine" in run.ran:
+            self.pdf_blob_repo.record_artifacts(*artifact_key, user_id, job_id, self._ref_in(outputs["render"]["images_ref"]),
+                                                self._ref_in(outputs["llm"]["csvs_ref"]),
+                                                self._ref_in(outputs["combine"]["combined_json_ref"]))
+
+        # a skipped contact map stage keeps the job's current map, edits included
+        contacts_map_ref = self.job_repo.get_contacts_map_ref(job_id) or self._ref_in(outputs["map_contacts"]["contacts_map_ref"])
+        self.job_repo.update_status_contacts_map(job_id, contacts_map_ref)
+        contacts_map = self.file_manager.get_normalized_json(self._ref_in(outputs["normalize"]["normalized_json_ref"]))
+        log.info("Pipeline complete", extra={"job_id": job_id, "ran": run.ran, "skipped": run.skipped})
 
-        # call core.run_llm_on_images(images_ref, prompt_ref) # The core will probably have to use the file manager to extract data from those references and save the csvs
-        csvs_ref = self.core.run_llm_on_images(user_id, job_id, images_ref, prompt, 10) # maybe I need more settings here
+        return {
+            "status": "CONTACT_MAP_READY",
+            "pdf_ref": self._ref_to_dict(pdf_ref),
+            "images_ref": self._ref_to_dict(self._ref_in(outputs["render"]["images_ref"])),
+            "contacts_map_ref": self._ref_to_dict(contacts_map_ref),
+            "reused_from_job_id": reused_from,
+            "recomputed_stages": run.ran,
+            "contacts_map": contacts_map  # <-- frontend reads this directly
+        }
 
-        # update the status to show that the csv is complete it returns the reference to where the CSVs are stored.
-        
+        # return {"contacts_map_ref": contacts_map_ref}
+
+    def resume(self, user_id: str, job_id: str, progress: PipelineProgress | None = None):
+        """
+        Finish a job whose LLM stage died or had failed batches: re-run only the batches the
+        manifest doesn't have as done (see Core.resume_llm_on_images), then combine, normalize
+        and rebuild the contact map as submit_pdf does. The API queues it (enqueue_resume).
+        """
+        self._assert_owner(user_id, job_id)
+        log.info("Resuming job", extra={"user_id": user_id, "job_id": job_id})
+        progress = progress or PipelineProgress()
+        prompt, prompt_ref_string = self.prompt_service.get_active_prompt()
+        self._check_resumable(user_id, job_id, prompt)
+        images_ref = self.file_manager.get_images_dir(user_id, job_id)
+        progress.skip("render", "resumed")
+        progress.start("llm")
+        csvs_ref = self.core.resume_llm_on_images(user_id, job_id, images_ref, prompt)
+        progress.finish("llm")
         self.job_repo.update_status_llm_run(job_id, csvs_ref, prompt_ref_string)
-        log.info("LLM run complete", extra={"csv_ref": csvs_ref.location})
-        # update the prompt here instead of before. 
 
+        progress.start("combine")
+        combined_json_ref = self.core.combine_to_json(user_id, job_id, csvs_ref)
+        progress.finish("combine")
+        contacts_map_ref, contacts_map = self._build_contacts_map(user_id, job_id, combined_json_ref, progress)
+        metadata = self.file_manager.get_job_metadata(user_id, job_id)
+        return {
+            "status": "CONTACT_MAP_READY",
+            "images_ref": self._ref_to_dict(images_ref),
+            "contacts_map_ref": self._ref_to_dict(contacts_map_ref),
+            "rerun_batches": metadata["llm_resume"]["rerun_batches"],
+            "failed_batches": metadata["llm_failed_batches"],
+            "contacts_map": contacts_map
+        }
 
-        # ---------------------------------- SAVING CSVS TO COMBINED.JSON ----------------------------------------
-        log.info("Saving CSVs to combined.JSON")
-        combined_json_ref = self.core.combine_to_json(user_id, job_id, csvs_ref) 
-        print(combined_json_ref.location)
-        
+    def _check_resumable(self, user_id: str, job_id: str, prompt: str):
+        try:
+            self.core.load_resumable_manifest(user_id, job_id, prompt)
+        except FileNotFoundError:
+            raise HTTPException(http_status.HTTP_409_CONFLICT, "Nothing to resume: this job has no LLM run")
+        except ValueError as e:
+            raise HTTPException(http_status.HTTP_409_CONFLICT, str(e))
+
+    def _build_contacts_map(self, user_id: str, job_id: str, combined_json_ref: StorageRef,
+                            progress: PipelineProgress | None = None):
+        # normalize + contact map outside the pipeline DAG (resume)
+        progress = progress or PipelineProgress()
+        schema_text, schema_ref = self.schema_service.get_active_schema()
+        progress.start("normalize")
+        normalized_json_ref = self._normalize(user_id, job_id, combined_json_ref, schema_text, schema_ref)
+        progress.finish("normalize")
+        progress.start("map_contacts")
+        contacts_map_ref = self._map_contacts(job_id, normalized_json_ref)
+        progress.finish("map_contacts")
+
+        contacts_map = self.file_manager.get_normalized_json(normalized_json_ref)
+        return contacts_map_ref, contacts_map
+
+    def _pipeline_dag(self, user_id: str, job_id: str, pdf_ref: StorageRef, pages: str, prompt: str, prompt_ref_string,
+                      schema_text: str, schema_ref: StorageRef, streaming: bool, progress: PipelineProgress) -> PipelineDag:
+        """The submission pipeline as stages over the inputs built in run_pipeline."""
+        fm = self.file_manager
+
+        def render(outputs):
+            if streaming:
+                # ---------------------------------- RENDER -> LLM -> COMBINE (STREAMED) ----------------------------------------
+                # pages go to the LLM as soon as a batch fills and rows are combined as batches return
+                for stage in ("llm", "combine"):
+                    progress.start(stage)
+                images_ref, csvs_ref, combined_json_ref = self.core.run_streaming_pipeline(user_id, job_id, pdf_ref, prompt, 10, pages=pages)
+                self.job_repo.update_status_images_extracted(job_id, images_ref)
+                self.job_repo.update_status_llm_run(job_id, csvs_ref, prompt_ref_string)
+                log.info("Streaming pipeline complete", extra={"csv_ref": csvs_ref.location})
+                # triage decisions stay inside the streamed run; a later LLM-only re-run sends every page
+                image_files = self.core.get_page_files(user_id, job_id, images_ref)
+                return {"render": {"images_ref": self._ref_out(images_ref), "image_files": None, "pages": len(image_files)},
+                        "llm": {"csvs_ref": self._ref_out(csvs_ref)},
+                        "combine": {"combined_json_ref": self._ref_out(combined_json_ref)}}
+
+            # ---------------------------------- EXTRACTING IMAGES --------------------------------------
+            images_ref = self.core.extract_images(user_id, job_id, pdf_ref, pages=pages)
+            self.job_repo.update_status_images_extracted(job_id, images_ref)
+            log.debug("Images extracted", extra={"images_ref": images_ref.location})
+            # ---------------------------------- TRIAGING PAGES ----------------------------------------
+            # blank separators and repeated sheets don't need an LLM slot; see json/triage_report.json
+            image_files = self.core.triage_images(user_id, job_id, images_ref)
+            return {"render": {"images_ref": self._ref_out(images_ref), "image_files": image_files, "pages": len(image_files)}}
+
+        def llm(outputs):
+            # ---------------------------------- SUBMITTING TO THE LLM ----------------------------------------
+            images_ref = self._ref_in(outputs["render"]["images_ref"])
+            csvs_ref = self.core.run_llm_on_images(user_id, job_id, images_ref, prompt, 10, outputs["render"]["image_files"])
+            self.job_repo.update_status_llm_run(job_id, csvs_ref, prompt_ref_string)
+            log.info("LLM run complete", extra={"csv_ref": csvs_ref.location})
+            return {"llm": {"csvs_ref": self._ref_out(csvs_ref)}}
+
+        def combine(outputs):
+            # ---------------------------------- SAVING CSVS TO COMBINED.JSON ----------------------------------------
+            log.info("Saving CSVs to combined.JSON")
+            combined_json_ref = self.core.combine_to_json(user_id, job_id, self._ref_in(outputs["llm"]["csvs_ref"]))
+            return {"combine": {"combined_json_ref": self._ref_out(combined_json_ref)}}
+
+        def normalize(outputs):
+            combined_json_ref = self._ref_in(outputs["combine"]["combined_json_ref"])
+            normalized_json_ref = self._normalize(user_id, job_id, combined_json_ref, schema_text, schema_ref)
+            return {"normalize": {"normalized_json_ref": self._ref_out(normalized_json_ref)}}
+
+        def map_contacts(outputs):
+            contacts_map_ref = self._map_contacts(job_id, self._ref_in(outputs["normalize"]["normalized_json_ref"]))
+            return {"map_contacts": {"contacts_map_ref": self._ref_out(contacts_map_ref)}}
+
+        def rendered(o):
+            files = set(fm.get_page_files(self._ref_in(o["images_ref"])))
+            return bool(files) and set(o["image_files"] or ()) <= files
+
+        def current_map(o):
+            ref = self.job_repo.get_contacts_map_ref(job_id)
+            return ref is not None and fm.load_json(ref) is not None
+
+        return PipelineDag([
+            Stage("render", render, inputs=("pdf_sha256", "pages", "render_settings"),
+                  check=rendered, report=lambda o: {"pages": o["pages"]}),
+            Stage("llm", llm, inputs=("prompt_sha256", "llm_settings"), after=("render",),
+                  check=lambda o: bool(fm.get_csv_files(self._ref_in(o["csvs_ref"])))),
+            Stage("combine", combine, after=("llm",),
+                  check=lambda o: fm.get_combined_json(self._ref_in(o["combined_json_ref"])) is not None),
+            Stage("normalize", normalize, inputs=("schema_sha256",), after=("combine",),
+                  check=lambda o: fm.get_normalized_json(self._ref_in(o["normalized_json_ref"])) is not None),
+            Stage("map_contacts", map_contacts, inputs=("contacts_version",), after=("normalize",), check=current_map),
+        ])
+
+    def _normalize(self, user_id: str, job_id: str, combined_json_ref: StorageRef, schema_text: str, schema_ref: StorageRef) -> StorageRef:
         # ---------------------------------- NORMALIZING JSON FILE TO NORMALIZED.JSON ----------------------------------------
         log.info("Normalizing Json file")
-        schema_text, schema_ref = self.schema_service.get_active_schema() 
-        normalized_json_ref = self.core.normalize_json(user_id, job_id, combined_json_ref, schema_text) 
-        self.job_repo.update_status_json_normalized(job_id, normalized_json_ref, schema_ref) 
+        normalized_json_ref = self.core.normalize_json(user_id, job_id, combined_json_ref, schema_text)
+        self.job_repo.update_status_json_normalized(job_id, normalized_json_ref, schema_ref)
+        return normalized_json_ref
 
+    def _map_contacts(self, job_id: str, normalized_json_ref: StorageRef) -> StorageRef:
         # ---------------------------------- BUILD THE CONTACT MAP ----------------------------------------
         log.info("Creating Default Contacts Map")
-        contacts_map_ref = self.core.map_contacts(normalized_json_ref) 
-        self.job_repo.update_status_contacts_map(job_id, contacts_map_ref) 
+        contacts_map_ref = self.core.map_contacts(normalized_json_ref, contact_service=self.contact_service)
+        self.job_repo.update_status_contacts_map(job_id, contacts_map_ref)
+        return contacts_map_ref
 
-        contacts_map = self.file_manager.get_normalized_json(normalized_json_ref)
-        
-        
-        return {
-            "status": "CONTACT_MAP_READY",
-            "pdf_ref": self._ref_to_dict(pdf_ref),
-            "images_ref": self._ref_to_dict(images_ref),
-            "contacts_map_ref": self._ref_to_dict(contacts_map_ref),
-            "contacts_map": contacts_map  # <-- frontend reads this directly
-        }
+    def _ref_out(self, ref: StorageRef) -> dict:
+        # StorageRef as stored in the pipeline state
+        return {"location": ref.location, "mode": ref.mode.value}
 
-        # return {"contacts_map_ref": contacts_map_ref}
+    def _ref_in(self, ref: dict) -> StorageRef:
+        return StorageRef(location=ref["location"], mode=StorageMode(ref["mode"]))
+
+    def _reuse_artifacts(self, user_id: str, job_id: str, artifact_key: tuple):
+        """
+        Link the artifacts of an earlier job with the same artifact key into this job.
+        Returns (images_ref, csvs_ref, jsons_ref, source job_id), or None when there is nothing (usable) to reuse.
+        Normalization and the contact map are cheap and job specific, so they always run again.
+        """
+        artifacts = self.pdf_blob_repo.find_artifacts(*artifact_key)
+        if not artifacts or artifacts["job_id"] == job_id:
+            return None
+        mode = StorageMode(artifacts["storage_mode"])
+        src_images = StorageRef(location=artifacts["images_ref"], mode=mode)
+        src_csvs = StorageRef(location=artifacts["csvs_ref"], mode=mode)
+        src_jsons = StorageRef(location=artifacts["jsons_ref"], mode=mode)
+        try:
+            self.file_manager.get_page_files(src_images)
+            self.file_manager.get_csv_files(src_csvs)
+            self.file_manager.get_combined_json(src_jsons)
+        except FileNotFoundError:
+            # the source job's files are gone; forget the entry and run the pipeline
+            log.info("Stale artifact entry", extra={"job_id": job_id, "source_job_id": artifacts["job_id"]})
+            self.pdf_blob_repo.delete_artifacts(*artifact_key)
+            return None
+
+        # this job's own pages may be of another selection; keep only the linked ones
+        self.file_manager.clear_job_files(user_id, job_id, "images")
+        images_ref = self.file_manager.link_job_files(src_images, user_id, job_id, "images")
+        src_job_dir = Path(artifacts["images_ref"]).parent
+        for variant in self.core.page_variants:
+            subdir = page_variant_subdir(variant)
+            self.file_manager.clear_job_files(user_id, job_id, subdir)
+            self.file_manager.link_job_files(StorageRef(location=str(src_job_dir / subdir), mode=mode), user_id, job_id, subdir)
+        self.file_manager.clear_job_files(user_id, job_id, "csvs")  # combine merges every CSV there
+        csvs_ref = self.file_manager.link_job_files(src_csvs, user_id, job_id, "csvs")
+        jsons_ref = self.file_manager.link_job_files(src_jsons, user_id, job_id, "json", ["combined.json", "triage_report.json"])
+
+        # carry over the page routing / triage decisions so the job reads like it ran itself
+        src_metadata = self.file_manager.get_job_metadata(artifacts["user_id"], artifacts["job_id"])
+        carried = {k: v for k, v in src_metadata.items() if k not in ("page_selection", "pdf_sha256", "reused_from")}
+        carried["reused_from"] = {"job_id": artifacts["job_id"], "created_at": artifacts["created_at"]}
+        self.file_manager.update_job_metadata(user_id, job_id, carried)
+        log.info("Reused artifacts of identical upload", extra={"job_id": job_id, "source_job_id": artifacts["job_id"]})
+        return images_ref, csvs_ref, jsons_ref, artifacts["job_id"]
+
+    def _hash_text(self, text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_page_image(self, user_id: str, job_id: str, page_number: int, size: str = "llm") -> Path:
+        # render on first access; later requests are served from disk. size: llm | thumbnail | preview
+        self._assert_owner(user_id, job_id)
+        job = self.job_repo.get_job_by_id(job_id)
+        if not job or not job.get("pdf_ref"):
+            raise HTTPException(http_status.HTTP_409_CONFLICT, "No PDF uploaded for this job yet")
+        pdf_ref = StorageRef(location=job["pdf_ref"], mode=StorageMode(job.get("pdf_mode") or "local"))
+        return self.core.render_page(user_id, job_id, pdf_ref, page_number, size=size)
 
     # --- HELPER FUNCTIONS ---
 
@@ -0,0 +1,166 @@
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+from Repositories.PipelineQueueRepository import PipelineQueueRepository
+from Services.ProgressBroker import ProgressBroker
+from Utils.logger import get_logger
+log = get_logger(__name__)
+
+# Queued pipeline runs executed at once by this process (each on its own thread and database connection)
+pipeline_workers = int(os.getenv("PIPELINE_WORKERS", "2"))
+# How often an idle worker looks at the queue when nobody woke it up
+pipeline_poll_s = float(os.getenv("PIPELINE_POLL_S", "2"))
+# A run interrupted by a restart this many times is failed instead of queued again
+pipeline_max_attempts = int(os.getenv("PIPELINE_MAX_ATTEMPTS", "3"))
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+SKIPPED = "skipped"
+
+STAGES = ("render", "llm", "combine", "normalize", "map_contacts")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+class PipelineProgress:
+    """
+    Per-stage progress of one pipeline run: each stage is pending, running, done or skipped, with
+    start / end times and whatever counts the stage reports. Saved to the run's pipeline_queue row
+    on every change when a queue_repo is given, and published to the broker's watchers of job_id
+    when a broker is; JobService.submit_pdf called directly uses one without either.
+    """
+
+    def __init__(self, queue_repo: PipelineQueueRepository | None = None, run_id: str | None = None,
+                 stages=STAGES, broker: ProgressBroker | None = None, job_id: str | None = None):
+        self.queue_repo = queue_repo
+        self.run_id = run_id
+        self.broker = broker
+        self.job_id = job_id
+        self.stage: Optional[str] = None
+        self.stages: Dict[str, dict] = {stage: {"status": PENDING} for stage in stages}
+        self.started: Dict[str, float] = {}
+
+    def start(self, stage: str, **info):
+        self.started[stage] = time.perf_counter()
+        self.stage = stage
+        self.stages[stage] = {"status": RUNNING, "started_at": _now(), **info}
+        self._save(stage)
+
+    def finish(self, stage: str, **info):
+        elapsed = time.perf_counter() - self.started.get(stage, time.perf_counter())
+        self.stages[stage].update(status=DONE, finished_at=_now(), duration_s=round(elapsed, 3), **info)
+        self._save(stage)
+
+    def skip(self, stage: str, reason: str):
+        self.stages[stage] = {"status": SKIPPED, "reason": reason}
+        self._save(stage)
+
+    def _save(self, stage: str):
+        if self.queue_repo is not None:
+            self.queue_repo.update_progress(self.run_id, self.stage, self.stages)
+        if self.broker is not None:
+            self.broker.publish(self.job_id, "stage", stage=stage, **self.stages[stage])
+
+
+class PipelineWorkers:
+    """
+    Asyncio tasks, started from the app's lifespan, that take runs off the pipeline queue and execute
+    them on a thread pool, so the event loop never runs pipeline code. Each worker gets its own
+    JobService from make_job_service() (its own SQLite connection). notify() wakes idle workers
+    right after a run is queued; otherwise they poll every poll_interval_s. With a broker, each
+    run's progress and outcome are also published to the job's watchers.
+    """
+
+    def __init__(self, make_job_service: Callable, queue_repo: PipelineQueueRepository,
+                 workers: int = pipeline_workers, poll_interval_s: float = pipeline_poll_s,
+                 max_attempts: int = pipeline_max_attempts, broker: ProgressBroker | None = None):
+        self.make_job_service = make_job_service
+        self.queue_repo = queue_repo
+        self.broker = broker
+        self.workers = max(1, workers)
+        self.poll_interval_s = poll_interval_s
+        self.max_attempts = max_attempts
+        self.executor: ThreadPoolExecutor | None = None
+        self.tasks: List[asyncio.Task] = []
+        self.wakeup: asyncio.Event | None = None
+        self.stopping = False
+
+    async def start(self):
+        self.queue_repo.requeue_interrupted(self.max_attempts)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pipeline")
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+        self.tasks = [asyncio.create_task(self._work(f"worker-{n + 1}")) for n in range(self.workers)]
+        log.info("Pipeline workers started", extra={"workers": self.workers})
+
+    async def stop(self):
+        # runs still in progress are left as running and picked up again on the next start
+        self.stopping = True
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        log.info("Pipeline workers stopped")
+
+    def notify(self):
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def _work(self, worker_id: str):
+        loop = asyncio.get_running_loop()
+        job_service = await loop.run_in_executor(self.executor, self.make_job_service)
+        while not self.stopping:
+            try:
+                run = await loop.run_in_executor(self.executor, job_service.queue_repo.claim_next, worker_id)
+            except sqlite3.Error:
+                # e.g. database is locked by another writer; try again on the next tick
+                log.warning("Could not claim a pipeline run", exc_info=True, extra={"worker_id": worker_id})
+                run = None
+            if run is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval_s)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                continue
+            await loop.run_in_executor(self.executor, self.execute, job_service, run)
+
+    def execute(self, job_service, run: Dict):
+        """Run one claimed run to the end and record the outcome on its queue row and job. Runs on a pool thread."""
+        run_id, job_id = run["run_id"], run["job_id"]
+        log.info("Running queued pipeline", extra={"run_id": run_id, "job_id": job_id, "attempt": run["attempts"]})
+        progress = PipelineProgress(job_service.queue_repo, run_id, broker=self.broker, job_id=job_id)
+        self._publish(job_id, "running", run_id=run_id, attempt=run["attempts"])
+        try:
+            result = job_service.run_queued(run, progress)
+        except Exception as e:
+            error = e.detail if isinstance(e, HTTPException) else str(e)
+            log.error("Queued pipeline failed", exc_info=True, extra={"run_id": run_id, "job_id": job_id})
+            job_service.queue_repo.fail(run_id, error)
+            job_service.job_repo.update_status(job_id, "failed")
+            self._publish(job_id, "failed", run_id=run_id, stage=progress.stage, error=error)
+            return
+        try:
+            job_service.queue_repo.finish(run_id, result)
+        except Exception:
+            # the row stays running and is retried after the next restart
+            log.error("Could not record queued pipeline result", exc_info=True, extra={"run_id": run_id, "job_id": job_id})
+            return
+        self._publish(job_id, "done", run_id=run_id, contacts_map_ref=result.get("contacts_map_ref"),
+                      reused_from_job_id=result.get("reused_from_job_id"))
+        log.info("Queued pipeline done", extra={"run_id": run_id, "job_id": job_id})
+
+    def _publish(self, job_id: str, event: str, **data):
+        if self.broker is not None:
+            self.broker.publish(job_id, event, **data)
@@ -0,0 +1,204 @@
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict, deque
+from typing import List, Optional
+
+from Utils.logger import get_logger
+log = get_logger(__name__)
+
+# Events a client that fell behind can still catch up on with Last-Event-ID (per job)
+progress_replay_events = int(os.getenv("PROGRESS_REPLAY_EVENTS", "256"))
+# Undelivered events per connected client before it is sent a fresh snapshot instead
+progress_client_queue = int(os.getenv("PROGRESS_CLIENT_QUEUE", "64"))
+# Jobs whose last state is kept in memory for late subscribers
+progress_max_jobs = int(os.getenv("PROGRESS_MAX_JOBS", "1000"))
+# Seconds between keep-alive comments on an idle stream
+progress_heartbeat_s = float(os.getenv("PROGRESS_HEARTBEAT_S", "15"))
+
+TERMINAL = ("done", "failed")
+
+
+def _initial_state(job_id: str) -> dict:
+    return {"job_id": job_id, "run_id": None, "status": None, "stage": None, "stages": {},
+            "pages_rendered": 0, "pages_total": None, "batches": None, "contacts_map_ref": None, "error": None}
+
+
+class JobChannel:
+    # one job's latest state, recent events and connected subscribers
+    def __init__(self, job_id: str, replay: int):
+        self.seq = 0
+        self.state = _initial_state(job_id)
+        self.recent = deque(maxlen=replay)
+        self.subscribers: List["Subscription"] = []
+
+
+class Subscription:
+    """
+    One client watching one job: `initial` holds what it is sent first (a snapshot, or the events
+    it missed), then events arrive on `queue`. Iterate it with ProgressBroker.stream().
+    """
+
+    def __init__(self, job_id: str, initial: List[dict], maxsize: int):
+        self.job_id = job_id
+        self.initial = initial
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+
+
+class ProgressBroker:
+    """
+    In-memory fan-out of pipeline progress, so any number of clients can follow a job without
+    touching SQLite. Pipeline code publishes from any thread (PipelineProgress for stage
+    transitions, Core's on_progress hook for pages and LLM batches, PipelineWorkers for the
+    outcome); every event updates the job's state and is handed to each subscriber's queue on the
+    event loop bound with bind(). A subscriber that falls behind gets one fresh snapshot instead
+    of the backlog.
+
+    Event names: snapshot, queued, running, stage, page, batch, done, failed.
+    """
+
+    def __init__(self, replay: int = progress_replay_events, client_queue: int = progress_client_queue,
+                 max_jobs: int = progress_max_jobs):
+        self.replay = replay
+        self.client_queue = client_queue
+        self.max_jobs = max_jobs
+        self.lock = threading.Lock()
+        self.jobs: "OrderedDict[str, JobChannel]" = OrderedDict()
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop | None):
+        # the loop subscribers live on (main.lifespan); without one, publish() only keeps the state
+        self.loop = loop
+
+    def publish(self, job_id: str, event: str, **data):
+        with self.lock:
+            channel = self._channel(job_id)
+            channel.seq += 1
+            message = {"id": channel.seq, "event": event, "data": data}
+            self._apply(channel.state, event, data)
+            channel.recent.append(message)
+            if channel.subscribers and self.loop is not None:
+                # scheduled under the lock so every subscriber sees the job's events in order
+                try:
+                    self.loop.call_soon_threadsafe(self._deliver, job_id, message, list(channel.subscribers))
+                except RuntimeError:
+                    pass  # the loop is closed; the app is shutting down
+
+    def snapshot(self, job_id: str) -> Optional[dict]:
+        with self.lock:
+            channel = self.jobs.get(job_id)
+            return self._snapshot(channel) if channel else None
+
+    def subscribe(self, job_id: str, last_event_id: int | None = None,
+                  fallback: dict | None = None) -> Subscription:
+        """
+        Start watching a job. The subscriber first gets the events after last_event_id when they are
+        still in the replay buffer, otherwise a snapshot of the job's state. `fallback` seeds that
+        state for a job this process has not published anything about (e.g. after a restart).
+        Call on the event loop.
+        """
+        with self.lock:
+            channel = self.jobs.get(job_id)
+            if channel is None:
+                channel = self._channel(job_id)
+                if fallback:
+                    channel.state.update(fallback)
+            missed = [m for m in channel.recent if last_event_id is not None and m["id"] > last_event_id]
+            caught_up = channel.state["status"] not in TERMINAL or missed
+            if last_event_id is not None and channel.recent and channel.recent[0]["id"] <= last_event_id + 1 and caught_up:
+                initial = missed
+            else:
+                initial = [self._snapshot(channel)]
+            subscription = Subscription(job_id, initial, self.client_queue)
+            channel.subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.lock:
+            channel = self.jobs.get(subscription.job_id)
+            if channel and subscription in channel.subscribers:
+                channel.subscribers.remove(subscription)
+
+    async def stream(self, subscription: Subscription, heartbeat_s: float = progress_heartbeat_s):
+        """
+        Server-Sent Events for one subscription: the initial messages, then every event until the
+        run is done or failed, with a keep-alive comment when nothing happened for heartbeat_s.
+        """
+        try:
+            for message in subscription.initial:
+                yield format_sse(message)
+                if self._is_terminal(message):
+                    return
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.queue.get(), heartbeat_s)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(message)
+                if self._is_terminal(message):
+                    return
+        finally:
+            self.unsubscribe(subscription)
+
+    def _deliver(self, job_id: str, message: dict, subscribers: List[Subscription]):
+        # on the event loop
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # too slow to keep up: drop its backlog and send where the job is now
+                while not subscription.queue.empty():
+                    subscription.queue.get_nowait()
+                subscription.queue.put_nowait(self.snapshot(job_id))
+
+    def _channel(self, job_id: str) -> JobChannel:
+        # with the lock held
+        channel = self.jobs.get(job_id)
+        if channel is None:
+            channel = self.jobs[job_id] = JobChannel(job_id, self.replay)
+            self._evict()
+        else:
+            self.jobs.move_to_end(job_id)
+        return channel
+
+    def _evict(self):
+        # forget the least recently updated jobs nobody is watching
+        for job_id in list(self.jobs):
+            if len(self.jobs) <= self.max_jobs:
+                return
+            if not self.jobs[job_id].subscribers:
+                del self.jobs[job_id]
+
+    def _snapshot(self, channel: JobChannel) -> dict:
+        state = json.loads(json.dumps(channel.state, default=str))
+        return {"id": channel.seq, "event": "snapshot", "data": state}
+
+    def _is_terminal(self, message: dict) -> bool:
+        if message["event"] == "snapshot":
+            return message["data"].get("status") in TERMINAL
+        return message["event"] in TERMINAL
+
+    def _apply(self, state: dict, event: str, data: dict):
+        if event == "queued":
+            state.update(_initial_state(state["job_id"]), status="queued", run_id=data.get("run_id"))
+        elif event == "running":
+            state.update(status="running", run_id=data.get("run_id", state["run_id"]))
+        elif event == "stage":
+            info = {k: v for k, v in data.items() if k != "stage"}
+            state["stage"] = data["stage"]
+            state["stages"][data["stage"]] = info
+        elif event == "page":
+            state.update(pages_rendered=data["rendered"], pages_total=data.get("total"))
+        elif event == "batch":
+            state["batches"] = {k: data[k] for k in ("batches", "planned", "pending", "running", "done", "failed")
+                                if k in data}
+        elif event == "done":
+            state.update(status="done", contacts_map_ref=data.get("contacts_map_ref"))
+        elif event == "failed":
+            state.update(status="failed", error=data.get("error"))
+
+
+def format_sse(message: dict) -> str:
+    return f"id: {message['id']}\nevent: {message['event']}\ndata: {json.dumps(message['data'], default=str)}\n\n"
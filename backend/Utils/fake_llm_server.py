@@ -0,0 +1,244 @@
+"""
+Local OpenAI-compatible stand-in for POST /v1/chat/completions, for offline benchmarks and load tests.
+
+Answers with one canned CSV row per page mentioned in the request ("(This is page N.)" labels),
+after a latency drawn from a configurable distribution, and injects 500s and 429s (with a
+Retry-After header) at configurable rates. Random draws come from one seeded generator.
+"stream": true requests get server-sent event chunks, the first after a fifth of the latency
+and the rest spread over the remainder.
+
+Run from backend/ and point the app at it:
+    python -m Utils.fake_llm_server --port 8089 --latency lognormal:1.5,0.4 --error-rate 0.02 --rate-limit-rate 0.05
+    LLM_BASE_URL=http://127.0.0.1:8089/v1 python main.py
+
+Or in-process:
+    with FakeLLMServer(latency="fixed:0.2") as server:
+        core = Core(file_manager, contact_service, base_url=server.base_url)
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List
+
+PAGE_LABEL = re.compile(r"This is page (\d+)")
+CSV_HEADER = '"Trade Name","Pages Referenced","Details / Notes"'
+TRADES = ["Electrical", "Plumbing", "HVAC", "Demolition", "Surveying"]
+STREAM_CHUNK_CHARS = 16
+STREAM_FIRST_CHUNK_SHARE = 0.2
+
+
+def parse_latency(spec: str, rng: random.Random) -> Callable[[], float]:
+    """
+    "fixed:0.5" | "uniform:0.2,1.0" | "lognormal:median,sigma" | "exp:mean" -> a function returning seconds.
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda: rng.lognormvariate(mu, values[1])
+    if kind == "exp":
+        return lambda: rng.expovariate(1 / values[0])
+    raise ValueError(f"Unknown latency distribution '{spec}'")
+
+
+def canned_csv(pages: List[str]) -> str:
+    rows = [CSV_HEADER]
+    for p in pages:
+        trade = TRADES[int(p) % len(TRADES)]
+        rows.append(f'"{trade}","{p}","{trade} work shown on sheet {p}"')
+    return "\n".join(rows)
+
+
+@dataclass
+class ServerStats:
+    requests: int = 0
+    errors: int = 0
+    rate_limited: int = 0
+    in_flight: int = 0
+    max_in_flight: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+
+class FakeLLMServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: str = "fixed:0.0",
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, retry_after: float = 1.0,
+                 fenced: bool = True, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.latency = parse_latency(latency, self.rng)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.fenced = fenced
+        self.stats = ServerStats()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeLLMServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="fake-llm-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _draw(self):
+        # one locked draw per request keeps a seeded run reproducible in aggregate
+        with self.rng_lock:
+            return self.latency(), self.rng.random(), self.rng.random()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    return self._send(404, {"error": {"message": f"No route {self.path}", "type": "invalid_request_error"}})
+
+                stats = server.stats
+                with stats.lock:
+                    stats.requests += 1
+                    stats.in_flight += 1
+                    stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+                try:
+                    latency, error_roll, limit_roll = server._draw()
+                    if limit_roll < server.rate_limit_rate:
+                        with stats.lock:
+                            stats.rate_limited += 1
+                        return self._send(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                                          {"retry-after": str(server.retry_after)})
+                    streaming = bool(body.get("stream"))
+                    time.sleep(latency * STREAM_FIRST_CHUNK_SHARE if streaming else latency)
+                    if error_roll < server.error_rate:
+                        with stats.lock:
+                            stats.errors += 1
+                        return self._send(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+                    if streaming:
+                        return self._send_stream(server.completion_chunks(body), latency * (1 - STREAM_FIRST_CHUNK_SHARE))
+                    self._send(200, server.completion(body))
+                finally:
+                    with stats.lock:
+                        stats.in_flight -= 1
+
+            def _send(self, status: int, payload: dict, headers: dict | None = None):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, chunks: List[dict], duration: float):
+                # no Content-Length: the body ends when the connection closes
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                for n, chunk in enumerate(chunks):
+                    if n:
+                        time.sleep(duration / len(chunks))
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def completion(self, body: dict) -> dict:
+        content, usage = self._answer(body)
+        return {
+            "id": f"chatcmpl-fake-{self.stats.requests}", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": usage,
+        }
+
+    def completion_chunks(self, body: dict) -> List[dict]:
+        content, usage = self._answer(body)
+        base = {"id": f"chatcmpl-fake-{self.stats.requests}", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": body.get("model", "fake")}
+        pieces = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)]
+        chunks = [dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": piece} if n == 0
+                                       else {"content": piece}, "finish_reason": None}])
+                  for n, piece in enumerate(pieces)]
+        chunks.append(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunks.append(dict(base, choices=[], usage=usage))
+        return chunks
+
+    def _answer(self, body: dict):
+        pages = []
+        prompt_tokens = 0
+        for message in body.get("messages", []):
+            content = message.get("content")
+            blocks = content if isinstance(content, list) else [{"type": "text", "text": content or ""}]
+            for block in blocks:
+                if block.get("type") == "text":
+                    pages += PAGE_LABEL.findall(block["text"])
+                    prompt_tokens += len(block["text"]) // 4
+                else:
+                    prompt_tokens += 765  # a typical high-detail image
+        csv_text = canned_csv(pages)
+        content = f"```csv\n{csv_text}\n```" if self.fenced else csv_text
+        completion_tokens = len(content) // 4
+        return content, {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                         "total_tokens": prompt_tokens + completion_tokens}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", default="lognormal:1.5,0.4", help="fixed:s | uniform:a,b | lognormal:median,sigma | exp:mean")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = FakeLLMServer(args.host, args.port, args.latency, args.error_rate, args.rate_limit_rate,
+                           args.retry_after, seed=args.seed)
+    print(f"Fake LLM server on {server.base_url} (latency {args.latency}, "
+          f"errors {args.error_rate:.0%}, 429s {args.rate_limit_rate:.0%})")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(f"{server.stats.requests} requests, {server.stats.errors} errors, {server.stats.rate_limited} rate limited")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Compare image profiles for LLM payloads.
+
+For every profile in Core.rendering.IMAGE_PROFILES this renders the chosen pages,
+reports render time and bytes per page (raw and base64), and with --llm sends
+each page to the model on its own and reports end-to-end latency.
+
+Run from backend/:
+    python benchmarks/bench_image_profiles.py tests/assets/pdfs/Specifications.pdf --pages 1-10
+    python benchmarks/bench_image_profiles.py plans.pdf --pages 1-5 --llm
+"""
+import argparse
+import base64
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import fitz
+
+from Core.rendering import IMAGE_PROFILES, render_page_image
+
+
+def parse_pages(spec: str, num_pages: int):
+    start, _, end = spec.partition("-")
+    start = int(start)
+    end = int(end) if end else start
+    return list(range(start, min(end, num_pages) + 1))
+
+
+def time_llm_call(client, model: str, prompt: str, mime: str, img_bytes: bytes, page_number: int) -> float:
+    image_data = base64.b64encode(img_bytes).decode()
+    content = [
+        {"type": "text", "text": prompt},
+        {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{image_data}"}},
+        {"type": "text", "text": f"(This is page {page_number}.)"},
+    ]
+    t0 = time.perf_counter()
+    client.chat.completions.create(model=model, messages=[{"role": "user", "content": content}])
+    return time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf")
+    parser.add_argument("--pages", default="1-5", help="page range, e.g. 1-10")
+    parser.add_argument("--profiles", default=",".join(IMAGE_PROFILES), help="comma separated profile names")
+    parser.add_argument("--llm", action="store_true", help="also time one LLM call per page")
+    parser.add_argument("--model", default="gpt-4o")
+    args = parser.parse_args()
+
+    doc = fitz.open(args.pdf)
+    pages = parse_pages(args.pages, len(doc))
+
+    client = prompt = None
+    if args.llm:
+        import openai
+        from dotenv import load_dotenv
+        from Services.PromptService import PromptService
+        load_dotenv()
+        client = openai.OpenAI()
+        prompt, _ = PromptService(None).get_active_prompt()
+
+    header = f"{'profile':<10} {'render s/page':>13} {'KiB/page':>10} {'b64 KiB/page':>13}"
+    if args.llm:
+        header += f" {'llm p50 s':>10} {'llm max s':>10}"
+    print(f"{args.pdf}: pages {pages[0]}-{pages[-1]} ({len(pages)} pages)")
+    print(header)
+
+    for name in args.profiles.split(","):
+        profile = IMAGE_PROFILES[name]
+        sizes, render_times, latencies = [], [], []
+        for page_number in pages:
+            t0 = time.perf_counter()
+            img_bytes = render_page_image(doc, page_number, profile)
+            render_times.append(time.perf_counter() - t0)
+            sizes.append(len(img_bytes))
+            if client is not None:
+                latencies.append(time_llm_call(client, args.model, prompt, profile.mime_type, img_bytes, page_number))
+
+        avg_size = statistics.mean(sizes)
+        line = (f"{name:<10} {statistics.mean(render_times):>13.3f} {avg_size / 1024:>10.1f}"
+                f" {avg_size * 4 / 3 / 1024:>13.1f}")
+        if latencies:
+            line += f" {statistics.median(latencies):>10.2f} {max(latencies):>10.2f}"
+        print(line)
+
+    doc.close()
+
+
+if __name__ == "__main__":
+    main()
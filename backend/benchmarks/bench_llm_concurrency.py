@@ -0,0 +1,65 @@
+"""
+Measure LLM stage wall time as the number of batches in flight grows.
+
+Starts the local fake chat-completions server (Utils/fake_llm_server.py), renders a synthetic
+plan set, and runs Core.run_llm_on_images against it at each concurrency level.
+No API key or network access needed.
+
+Run from backend/:
+    python benchmarks/bench_llm_concurrency.py
+    python benchmarks/bench_llm_concurrency.py --batches 30 --latency fixed:0.5 --levels 1,2,4,8,16
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import fitz
+
+from Core.core import Core
+from Core.rendering import ImageProfile
+from Core.llm_client import RateLimiter
+from FileManager.FileManager import FileManager
+from shared.StorageRef import StorageMode
+from Utils.fake_llm_server import FakeLLMServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batches", type=int, default=24)
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--latency", default="fixed:0.25", help="fake server latency distribution")
+    parser.add_argument("--levels", default="1,2,4,8,16", help="comma separated in-flight limits")
+    parser.add_argument("--stream", action="store_true", help="stream answers and write CSV rows as they arrive")
+    args = parser.parse_args()
+
+    with FakeLLMServer(latency=args.latency, fenced=False) as server, tempfile.TemporaryDirectory() as tmp:
+        file_manager = FileManager(mode=StorageMode.LOCAL, base_dir=tmp)
+        core = Core(file_manager, contact_service=None, page_triage=False, page_previews=False,
+                    use_llm_cache=False, base_url=server.base_url, stream_llm=args.stream)
+        core.llm.limiter = RateLimiter(requests_per_minute=10**6, tokens_per_minute=10**9)  # measure concurrency, not quota
+
+        doc = fitz.open()
+        for i in range(args.batches * args.batch_size):
+            doc.new_page(width=612, height=792).insert_text((72, 72), f"Sheet {i + 1}")
+        pdf_ref = file_manager.save_pdf("bench", "bench", doc.tobytes())
+        doc.close()
+        images_ref = core.extract_images("bench", "bench", pdf_ref, profile=ImageProfile(dpi=20))
+
+        print(f"{args.batches} batches x {args.batch_size} pages, latency {args.latency}")
+        print(f"{'in flight':>9} {'wall s':>8} {'speedup':>8}")
+        baseline = None
+        for level in [int(x) for x in args.levels.split(",")]:
+            t0 = time.perf_counter()
+            core.run_llm_on_images("bench", f"c{level}", images_ref, "prompt", args.batch_size, concurrency=level)
+            wall = time.perf_counter() - t0
+            baseline = baseline or wall
+            print(f"{level:>9} {wall:>8.2f} {baseline / wall:>7.1f}x")
+        print(f"server saw at most {server.stats.max_in_flight} requests in flight")
+
+
+if __name__ == "__main__":
+    main()
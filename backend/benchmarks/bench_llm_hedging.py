@@ -0,0 +1,73 @@
+"""
+Tail latency of LLM calls with and without hedging, against the local fake server.
+
+Sends the same stream of requests (N calls, C at a time) through LLMClient twice: plain, then with
+Hedging at the given percentile and budget. The fake server draws every request's latency from a
+heavy-tailed distribution, so a hedge gets a fresh draw. Reports p50 / p95 / p99 / max per call,
+wall time and how many extra requests the hedges cost.
+
+Run from backend/:
+    python benchmarks/bench_llm_hedging.py
+    python benchmarks/bench_llm_hedging.py --calls 400 --latency lognormal:0.2,0.9 --percentile 90 --budget 0.1
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import openai
+
+from Core.llm_client import LLMClient, RateLimiter, RetryPolicy, Hedging
+from Utils.fake_llm_server import FakeLLMServer
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+def run(server: FakeLLMServer, calls: int, concurrency: int, hedging: Hedging | None):
+    client = openai.OpenAI(api_key="local", base_url=server.base_url, max_retries=0)
+    llm = LLMClient(client, RateLimiter(10**6, 10**9), RetryPolicy(max_retries=2, base_delay=0.05), hedging=hedging)
+    messages = [{"role": "user", "content": [{"type": "text", "text": "prompt"},
+                                             {"type": "text", "text": "(This is page 1.)"}]}]
+
+    def one_call(_):
+        started = time.perf_counter()
+        llm.create(model="fake", messages=messages)
+        return time.perf_counter() - started
+
+    requests_before = server.stats.requests
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(one_call, range(calls)))
+    return latencies, time.perf_counter() - started, server.stats.requests - requests_before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", default="lognormal:0.1,0.8", help="fake server latency distribution")
+    parser.add_argument("--percentile", type=float, default=90.0, help="hedge once a call is slower than this")
+    parser.add_argument("--budget", type=float, default=0.1, help="hedges per request, at most")
+    args = parser.parse_args()
+
+    print(f"{args.calls} calls, {args.concurrency} at a time, latency {args.latency}; "
+          f"hedge at p{args.percentile:g}, budget {args.budget:.0%}")
+    print(f"{'':>8} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'max s':>7} {'wall s':>7} {'requests':>9}")
+    with FakeLLMServer(latency=args.latency, seed=1) as server:
+        for label, hedging in (("plain", None),
+                               ("hedged", Hedging(percentile=args.percentile, budget_ratio=args.budget))):
+            latencies, wall, requests = run(server, args.calls, args.concurrency, hedging)
+            print(f"{label:>8} {percentile(latencies, 50):>7.3f} {percentile(latencies, 95):>7.3f} "
+                  f"{percentile(latencies, 99):>7.3f} {max(latencies):>7.3f} {wall:>7.2f} {requests:>9}")
+            if hedging:
+                print(f"{'':>8} {hedging.stats()['hedges_sent']} hedges sent, {hedging.stats()['hedges_won']} won")
+
+
+if __name__ == "__main__":
+    main()
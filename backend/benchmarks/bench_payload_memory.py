@@ -0,0 +1,81 @@
+"""
+Peak Python memory of building one LLM request for a batch of page images, old path vs prebuilt body.
+
+old:      read each PNG, base64 it into a str, put the data URLs in the message dicts and let the
+          client serialize the messages to JSON (what openai/httpx do with json=...).
+prebuilt: ImageData blocks, encoded from memory-mapped files into one pre-sized buffer (Core.payload).
+
+Peaks are measured with tracemalloc, so pages of the memory-mapped files (the OS page cache) are not
+counted, only what Python allocates. Random bytes stand in for the PNGs (they don't compress either).
+
+Run from backend/:
+    python benchmarks/bench_payload_memory.py
+    python benchmarks/bench_payload_memory.py --pages 10 --page-mb 4
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from Core.payload import ImageData, image_block, build_chat_body
+
+
+def old_body(paths):
+    content = [{"type": "text", "text": "prompt"}]
+    for n, path in enumerate(paths, start=1):
+        with open(path, "rb") as f:
+            image_data = base64.b64encode(f.read()).decode()
+        content.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_data}"}})
+        content.append({"type": "text", "text": f"(This is page {n}.)"})
+    return json.dumps({"model": "gpt-4o", "messages": [{"role": "user", "content": content}]}).encode("utf-8")
+
+
+def prebuilt_body(paths):
+    content = [{"type": "text", "text": "prompt"}]
+    for n, path in enumerate(paths, start=1):
+        content.append(image_block(ImageData("image/png", path=path)))
+        content.append({"type": "text", "text": f"(This is page {n}.)"})
+    return build_chat_body(model="gpt-4o", messages=[{"role": "user", "content": content}])
+
+
+def measure(build, paths):
+    tracemalloc.start()
+    started = time.perf_counter()
+    body = build(paths)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(body), peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=8, help="images per batch")
+    parser.add_argument("--page-mb", type=float, default=2.0, help="size of each image")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for n in range(args.pages):
+            path = Path(tmp) / f"page_{n + 1}.png"
+            path.write_bytes(os.urandom(int(args.page_mb * 1024 * 1024)))
+            paths.append(path)
+        images_mb = args.pages * args.page_mb
+        print(f"{args.pages} images of {args.page_mb:g} MB ({images_mb:g} MB raw)")
+        print(f"{'path':10} {'body MB':>8} {'peak MB':>8} {'peak/body':>9} {'time s':>7}")
+        for name, build in (("old", old_body), ("prebuilt", prebuilt_body)):
+            runs = [measure(build, paths) for _ in range(args.repeat)]
+            size, peak, elapsed = min(runs, key=lambda r: r[1])
+            print(f"{name:10} {size / 2**20:8.1f} {peak / 2**20:8.1f} {peak / size:9.2f} {min(r[2] for r in runs):7.3f}")
+
+
+if __name__ == "__main__":
+    main()
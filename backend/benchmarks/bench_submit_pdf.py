@@ -0,0 +1,109 @@
+"""
+Offline load test of JobService.submit_pdf: N uploads, W at a time, against the local fake LLM server.
+
+Every job gets its own synthetic PDF (so nothing is deduplicated) and runs the whole pipeline:
+render, triage, LLM, combine, normalize, contact map. Reports throughput, per-job latency
+percentiles and what the fake server saw, including injected 429s / 500s that were retried.
+
+Run from backend/:
+    python benchmarks/bench_submit_pdf.py
+    python benchmarks/bench_submit_pdf.py --jobs 20 --workers 4 --pages 12 --latency lognormal:0.5,0.4 --rate-limit-rate 0.05
+"""
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import fitz
+
+from Core.core import Core
+from Core.rendering import ImageProfile
+from Core.llm_client import RateLimiter, RetryPolicy
+from FileManager.FileManager import FileManager
+from shared.StorageRef import StorageMode
+from Services.JobService import JobService
+from Services.ContactService import ContactService
+from Services.PromptService import PromptService
+from Services.SchemaService import SchemaService
+from Repositories.ContactRepository import ContactRepository
+from Repositories.EmailRepository import EmailRepository
+from Repositories.JobRepository import JobRepository
+from Utils.fake_llm_server import FakeLLMServer
+
+
+def make_pdf(job_num: int, pages: int) -> bytes:
+    # a few random boxes per sheet keep triage from dropping pages as blank or duplicate
+    rng = random.Random(job_num)
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page(width=612, height=792)
+        page.insert_text((72, 72), f"Job {job_num} sheet {i + 1}", fontsize=24)
+        for _ in range(12):
+            x, y = rng.uniform(40, 480), rng.uniform(100, 650)
+            page.draw_rect(fitz.Rect(x, y, x + rng.uniform(30, 120), y + rng.uniform(30, 120)), width=3)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4, help="jobs submitted at the same time")
+    parser.add_argument("--pages", type=int, default=12)
+    parser.add_argument("--latency", default="lognormal:0.3,0.4", help="fake server latency distribution")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--streaming", action="store_true", help="use the streamed render -> LLM pipeline")
+    args = parser.parse_args()
+
+    server = FakeLLMServer(latency=args.latency, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                           retry_after=0.2, fenced=False)
+    with server, tempfile.TemporaryDirectory() as tmp:
+        file_manager = FileManager(mode=StorageMode.LOCAL, base_dir=Path(tmp) / "storage")
+        db_path = str(Path(tmp) / "bench.db")
+        contact_repo = ContactRepository(db_path)
+        core = Core(file_manager, ContactService(contact_repo), image_profile=ImageProfile(dpi=40),
+                    use_llm_cache=False, base_url=server.base_url)
+        core.llm.limiter = RateLimiter(requests_per_minute=10**6, tokens_per_minute=10**9)
+        core.llm.retry = RetryPolicy(max_retries=8, base_delay=0.1, max_delay=2.0)
+
+        def run_job(job_num: int) -> float:
+            # one connection per job: sqlite connections are not shared between threads here
+            job_repo = JobRepository(db_path)
+            service = JobService(job_repo, contact_repo, file_manager, core, PromptService(None), SchemaService(),
+                                 email_repo=EmailRepository(job_repo.conn))
+            job_id = service.create_job("bench", f"job {job_num}", "")
+            pdf = make_pdf(job_num, args.pages)
+            t0 = time.perf_counter()
+            service.submit_pdf("bench", job_id, pdf, f"job_{job_num}.pdf", streaming=args.streaming)
+            return time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            latencies = list(pool.map(run_job, range(args.jobs)))
+        wall = time.perf_counter() - t0
+
+    stats = server.stats
+    print(f"{args.jobs} jobs x {args.pages} pages, {args.workers} at a time, latency {args.latency}"
+          f"{', streaming' if args.streaming else ''}")
+    print(f"wall {wall:.2f}s  throughput {args.jobs / wall:.2f} jobs/s  {args.jobs * args.pages / wall:.1f} pages/s")
+    print(f"job latency  p50 {statistics.median(latencies):.2f}s  p95 {percentile(latencies, 0.95):.2f}s  "
+          f"max {max(latencies):.2f}s")
+    print(f"server: {stats.requests} requests, {stats.rate_limited} 429s, {stats.errors} 500s, "
+          f"max {stats.max_in_flight} in flight")
+
+
+if __name__ == "__main__":
+    main()
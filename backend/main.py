@@ -1,4 +1,5 @@
 # main.py
+import asyncio
 import sqlite3
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
@@ -13,6 +14,8 @@ from Repositories.JobRepository import JobRepository
 from Repositories.PromptRepository import PromptRepository
 from Repositories.ContactRepository import ContactRepository
 from Repositories.EmailRepository import EmailRepository
+from Repositories.PdfBlobRepository import PdfBlobRepository
+from Repositories.PipelineQueueRepository import PipelineQueueRepository
 # (optional) your new EmailRepository
 
 
@@ -20,17 +23,26 @@ from FileManager.FileManager import FileManager
 from Services.ContactService import ContactService
 from Services.PromptService import PromptService
 from Services.SchemaService import SchemaService
+from Services.JobService import JobService
+from Services.PipelineQueue import PipelineWorkers
+from Services.ProgressBroker import ProgressBroker
 from Core.core import Core
 from shared.StorageRef import StorageMode
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # 1) one shared connection for the whole app
-    conn = sqlite3.connect("app.db", check_same_thread=False)
+DB_PATH = "app.db"
+
+def connect(db_path: str = DB_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON")
     conn.execute("PRAGMA journal_mode = WAL")
     conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 1) one shared connection for the whole app
+    conn = connect()
 
     # 2) repos share the SAME conn
     user_repo    = UserRepository(conn=conn)
@@ -38,13 +50,25 @@ async def lifespan(app: FastAPI):
     prompt_repo  = PromptRepository(conn=conn)
     contact_repo = ContactRepository(conn=conn)
     email_repo   = EmailRepository(conn=conn)  # uncomment when you add it
+    pdf_blob_repo = PdfBlobRepository(conn=conn)
+    pipeline_queue_repo = PipelineQueueRepository(conn=conn)
 
     # 3) shared services/singletons
     file_manager = FileManager(mode=StorageMode.LOCAL)
     contact_svc  = ContactService(contact_repo)
     prompt_svc   = PromptService(prompt_repo)
     schema_svc   = SchemaService()
-    core         = Core(file_manager, contact_svc)
+    progress_broker = ProgressBroker()
+    progress_broker.bind(asyncio.get_running_loop())
+    core         = Core(file_manager, contact_svc, on_progress=progress_broker.publish)
+
+    # pipeline workers run queued submissions off the event loop, each on its own connection
+    def make_job_service() -> JobService:
+        worker_conn = connect()
+        return JobService(JobRepository(conn=worker_conn), ContactRepository(conn=worker_conn), file_manager, core, prompt_svc,
+                          schema_svc, email_repo=EmailRepository(conn=worker_conn), pdf_blob_repo=PdfBlobRepository(conn=worker_conn),
+                          queue_repo=PipelineQueueRepository(conn=worker_conn), progress_broker=progress_broker)
+    pipeline_workers = PipelineWorkers(make_job_service, pipeline_queue_repo, broker=progress_broker)
 
     # 4) stash on app.state for handlers/deps to reuse
     app.state.conn          = conn
@@ -53,15 +77,21 @@ async def lifespan(app: FastAPI):
     app.state.prompt_repo   = prompt_repo
     app.state.contact_repo  = contact_repo
     app.state.email_repo    = email_repo
+    app.state.pdf_blob_repo = pdf_blob_repo
     app.state.file_manager  = file_manager
     app.state.contact_svc   = contact_svc
     app.state.prompt_svc    = prompt_svc
     app.state.schema_svc    = schema_svc
     app.state.core          = core
+    app.state.pipeline_queue_repo = pipeline_queue_repo
+    app.state.pipeline_workers    = pipeline_workers
+    app.state.progress_broker     = progress_broker
 
+    await pipeline_workers.start()
     try:
         yield
     finally:
+        await pipeline_workers.stop()
         try:
             conn.close()
         except Exception:
@@ -1,4 +1,6 @@
-from fastapi import APIRouter, HTTPException, status, Header, Depends, UploadFile, File, Form, Request
+from fastapi import APIRouter, HTTPException, status, Header, Depends, UploadFile, File, Form, Request, Query
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from Services.UserService import UserService
 from Utils.AuthUtils import hash_password, get_user_id_from_header
 from models.user_models import RegisterRequest, LoginRequest, CreateJobRequest, GetMapResp, PatchOpsReq
@@ -18,7 +20,7 @@ from Repositories.JobRepository import JobRepository
 from Repositories.PromptRepository import PromptRepository
 from Repositories.ContactRepository import ContactRepository
 from Repositories.EmailRepository import EmailRepository
-from FileManager.FileManager import FileManager
+from FileManager.FileManager import FileManager, image_mime_type
 from Core.core import Core
 from shared.StorageRef import StorageMode
 #from backend.shared.DTOs import ParamsDTO
@@ -46,6 +48,9 @@ def get_job_service(request: Request) -> JobService:
         request.app.state.prompt_svc,
         request.app.state.schema_svc,
         email_repo=request.app.state.email_repo,  # when you add it
+        pdf_blob_repo=request.app.state.pdf_blob_repo,
+        queue_repo=request.app.state.pipeline_queue_repo,
+        progress_broker=request.app.state.progress_broker,
     )
 
 # def get_user_service():
@@ -79,6 +84,15 @@ async def hello_world():
 async def ping():
     return {"status": "ok"}
 
+@router.get("/llm/status")
+async def llm_status(request: Request):
+    # circuit breaker state (closed / open / half_open) and hedging counters; no user data, so no auth like /ping
+    try:
+        return request.app.state.core.llm_status()
+    except Exception:
+        log.error("Unexpected error reading LLM status", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @router.post("/register")
 async def register_user(request: RegisterRequest, user_service: UserService = Depends(get_user_service)):
     try:
@@ -157,20 +171,118 @@ async def get_job_details(job_id: str, authorization: str = Header(...), job_ser
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
-@router.post("/submit_pdf")
-async def submit_pdf(authorization: str = Header(...), job_id: str = Form(...), pdf_file: UploadFile = File(), job_service: JobService = Depends(get_job_service)):
+@router.post("/submit_pdf", status_code=status.HTTP_202_ACCEPTED)
+async def submit_pdf(request: Request, authorization: str = Header(...), job_id: str = Form(...), pdf_file: UploadFile = File(), streaming: bool = Form(False), pages: str = Form("all"), job_service: JobService = Depends(get_job_service)):
     try:
         user_id = get_user_id_from_header(authorization)
         safe_name = Path(pdf_file.filename).name  # strips directories
-        # read file into bytes
-        pdf_bytes = await pdf_file.read()
-
-        ret = job_service.submit_pdf(user_id, job_id, pdf_bytes, safe_name)
+        # hand over the spooled upload; it is hashed while being copied into the blob store
+        await pdf_file.seek(0)
+
+        # saving the upload is blocking file I/O, so it runs off the event loop; the pipeline itself
+        # is queued for the workers started in main.lifespan. Follow it with GET /jobs/{job_id}/progress
+        ret = await run_in_threadpool(job_service.enqueue_pdf, user_id, job_id, pdf_file.file, safe_name,
+                                      streaming=streaming, pages=pages)
+        request.app.state.pipeline_workers.notify()
         log.info(ret)
         return ret
+    except HTTPException:
+        raise
+    except ValueError as ve:
+        # bad page selection / range
+        raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
         log.error("Unexpected error submitting PDF", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@router.post("/jobs/{job_id}/rerun", status_code=status.HTTP_202_ACCEPTED)
+async def rerun_job(request: Request, job_id: str, authorization: str = Header(...), force: List[str] = Query([]),
+                    job_service: JobService = Depends(get_job_service)):
+    try:
+        user_id = get_user_id_from_header(authorization)
+        # queues the pipeline again for the job's PDF; only stages whose inputs changed (prompt, schema,
+        # contacts...) are recomputed, plus any named in ?force=. Off the event loop: a job without a
+        # recorded pdf_sha256 has its whole PDF hashed
+        ret = await run_in_threadpool(job_service.enqueue_rerun, user_id, job_id, force)
+        request.app.state.pipeline_workers.notify()
+        return ret
+    except HTTPException:
+        raise
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception:
+        log.error(f"Unexpected error re-running job {job_id}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@router.get("/jobs/{job_id}/progress")
+async def get_job_progress(job_id: str, authorization: str = Header(...), job_service: JobService = Depends(get_job_service)):
+    try:
+        user_id = get_user_id_from_header(authorization)
+        # status of the latest queued run (queued / running / done / failed) and where each stage is
+        return job_service.get_progress(user_id, job_id)
+    except HTTPException:
+        raise
+    except Exception:
+        log.error(f"Unexpected error reading progress of job {job_id}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(request: Request, job_id: str, authorization: str = Header(...), last_event_id: int | None = Header(None),
+                            job_service: JobService = Depends(get_job_service)):
+    try:
+        user_id = get_user_id_from_header(authorization)
+        subscription = job_service.watch_progress(user_id, job_id, last_event_id)
+    except HTTPException:
+        raise
+    except Exception:
+        log.error(f"Unexpected error watching job {job_id}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
+    # Server-Sent Events (snapshot, stage, page, batch, done / failed) until the run ends; a client that
+    # drops reconnects with Last-Event-ID and gets what it missed
+    return StreamingResponse(request.app.state.progress_broker.stream(subscription), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.post("/jobs/{job_id}/resume", status_code=status.HTTP_202_ACCEPTED)
+async def resume_job(request: Request, job_id: str, authorization: str = Header(...), job_service: JobService = Depends(get_job_service)):
+    try:
+        user_id = get_user_id_from_header(authorization)
+        # queues a re-run of only the LLM batches that never finished, then combine / normalize / contact map;
+        # 409 while the job is already queued or running. Follow it with GET /jobs/{job_id}/progress
+        ret = await run_in_threadpool(job_service.enqueue_resume, user_id, job_id)
+        request.app.state.pipeline_workers.notify()
+        log.info(ret)
+        return ret
+    except HTTPException:
+        raise
+    except Exception:
+        log.error("Unexpected error resuming job", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@router.get("/jobs/{job_id}/pages/{page_number}")
+async def get_page_image(
+    job_id: str,
+    page_number: int,
+    size: str = "llm",
+    authorization: str = Header(...),
+    job_service: JobService = Depends(get_job_service)
+):
+    try:
+        user_id = get_user_id_from_header(authorization)
+        # a first view renders the page with fitz under the document cache lock, so it runs off the event loop
+        path = await run_in_threadpool(job_service.get_page_image, user_id, job_id, page_number, size)
+        return FileResponse(path, media_type=image_mime_type(path.name))
+    except HTTPException:
+        raise
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception:
+        log.error("Unexpected error rendering page", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
     
     
 @router.delete("/jobs/{job_id}")
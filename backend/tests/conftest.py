@@ -0,0 +1,86 @@
+import sqlite3
+import tempfile
+import shutil
+from pathlib import Path
+from types import SimpleNamespace
+
+import fitz
+import pytest
+
+from Core.core import Core
+from Core.rendering import ImageProfile
+from Core.llm_client import RateLimiter
+from FileManager.FileManager import FileManager
+from shared.StorageRef import StorageMode
+from Services.JobService import JobService
+from Services.ContactService import ContactService
+from Services.PromptService import PromptService
+from Services.SchemaService import SchemaService
+from Repositories.ContactRepository import ContactRepository
+from Repositories.EmailRepository import EmailRepository
+from Repositories.JobRepository import JobRepository
+from Repositories.PdfBlobRepository import PdfBlobRepository
+from Repositories.PipelineQueueRepository import PipelineQueueRepository
+from fakes import FakeCompletions
+
+
+# Fixtures shared by the pipeline tests. A module overrides one by defining a fixture of the same name.
+
+@pytest.fixture()
+def temp_dir():
+    path = Path(tempfile.mkdtemp())
+    yield path
+    shutil.rmtree(path)
+
+@pytest.fixture()
+def file_manager(temp_dir):
+    return FileManager(mode=StorageMode.LOCAL, base_dir=temp_dir)
+
+@pytest.fixture()
+def completions():
+    return FakeCompletions()
+
+@pytest.fixture()
+def make_core(file_manager, completions):
+    """
+    make_core(**options) -> a Core answering from `completions`, with a rate limiter that never waits.
+    Gets an in-memory contact service unless contact_service= is given.
+    """
+    def make(**options):
+        options.setdefault("contact_service", ContactService(ContactRepository(":memory:")))
+        core = Core(file_manager=file_manager, **options)
+        core.llm.limiter = RateLimiter(requests_per_minute=10**6, tokens_per_minute=10**9)  # don't wait on the real quota
+        core.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        return core
+    return make
+
+@pytest.fixture()
+def core_options():
+    # Core settings for job_service: small renders, every page to the LLM, no response cache
+    return {"image_profile": ImageProfile(dpi=30), "page_triage": False, "use_llm_cache": False}
+
+@pytest.fixture()
+def job_service(file_manager, make_core, core_options):
+    # a JobService on one in-memory database, with upload dedup and the pipeline queue
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    contact_repo = ContactRepository(conn=conn)
+    core = make_core(contact_service=ContactService(contact_repo), **core_options)
+    return JobService(JobRepository(conn=conn), contact_repo, file_manager, core, PromptService(None), SchemaService(),
+                      email_repo=EmailRepository(conn=conn), pdf_blob_repo=PdfBlobRepository(conn=conn),
+                      queue_repo=PipelineQueueRepository(conn=conn))
+
+@pytest.fixture()
+def make_pdf():
+    """make_pdf(pages) -> bytes of a plan set with one line of text ("Sheet n") per page."""
+    def make(pages: int) -> bytes:
+        doc = fitz.open()
+        for i in range(pages):
+            doc.new_page(width=612, height=792).insert_text((72, 72), f"Sheet {i + 1}")
+        data = doc.tobytes()
+        doc.close()
+        return data
+    return make
+
+@pytest.fixture()
+def pdf_bytes(make_pdf):
+    return make_pdf(4)
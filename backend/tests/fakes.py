@@ -0,0 +1,18 @@
+import re
+from types import SimpleNamespace
+
+
+class FakeCompletions:
+    """Answers every request with one CSV row per page mentioned in the prompt blocks."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, model, messages, **kwargs):
+        self.calls += 1
+        texts = [b["text"] for b in messages[0]["content"] if b["type"] == "text"]
+        pages = [m.group(1) for t in texts for m in [re.search(r"This is page (\d+)", t)] if m]
+        lines = ['"Trade Name","Pages Referenced","Details / Notes"']
+        lines += [f'"Electrical","{p}","Lighting on sheet {p}"' for p in pages]
+        content = "```csv\n" + "\n".join(lines) + "\n```"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
@@ -0,0 +1,75 @@
+import json
+
+import fitz
+import pytest
+
+from Core.batch_planner import BatchPlanner, image_tokens
+from Core.rendering import ImageProfile
+
+
+# ------------------------ FIXTURES ------------------------
+
+@pytest.fixture()
+def core(make_core):
+    return make_core(page_triage=False, use_llm_cache=False, text_layer_min_chars=200,
+                     batch_planner=BatchPlanner(token_budget=4000, max_latency_s=None))
+
+
+# ----------------------- TOKEN ESTIMATES -----------------------------
+@pytest.mark.parametrize("size, tokens", [
+    ((1024, 1024), 765),    # 768x768 -> 2x2 tiles
+    ((2048, 4096), 1105),   # 768x1536 -> 2x3 tiles
+    ((200, 100), 255),      # one tile
+])
+def test_image_tokens(size, tokens):
+    assert image_tokens(*size) == tokens
+
+
+# ----------------------- PACKING -----------------------------
+def test_plan_respects_budget_page_cap_and_order():
+    planner = BatchPlanner(token_budget=3000, max_latency_s=None, max_pages=4, output_tokens_per_page=0)
+    pages = [(f"page_{n}.png", t) for n, t in enumerate([800, 800, 800, 800, 5000, 100, 100, 100, 100, 100], start=1)]
+
+    plan = planner.plan(100, pages)
+
+    assert [b.files for b in plan] == [
+        ["page_1.png", "page_2.png", "page_3.png"],   # a 4th would be 3300 tokens
+        ["page_4.png"],
+        ["page_5.png"],                               # over budget on its own: alone
+        ["page_6.png", "page_7.png", "page_8.png", "page_9.png"],  # page cap
+        ["page_10.png"],
+    ]
+    assert [b.tokens for b in plan] == [2500, 900, 5100, 500, 200]
+
+
+def test_latency_cap_splits_batches():
+    planner = BatchPlanner(token_budget=None, max_latency_s=5.0, max_pages=10,
+                           base_latency_s=1.0, prefill_tokens_per_s=1000, output_tokens_per_page=60, output_tokens_per_s=60)
+    plan = planner.plan(0, [(f"page_{n}.png", 1000) for n in range(1, 6)])
+    # each page adds 1 s of prefill and 1 s of output
+    assert [len(b.files) for b in plan] == [2, 2, 1]
+    assert all(b.latency_s <= 5.0 for b in plan)
+
+
+def test_text_heavy_pages_get_smaller_batches_and_plan_is_saved(core, file_manager):
+    doc = fitz.open()
+    for i in range(6):
+        page = doc.new_page(width=612, height=792)
+        if i % 2:
+            page.insert_textbox(fitz.Rect(40, 40, 570, 750), "SPECIFICATION SECTION 22 00 00 PLUMBING. " * 80, fontsize=6)
+        else:
+            page.insert_text((72, 72), f"Sheet {i + 1}")
+    pdf_ref = file_manager.save_pdf("1", "1", doc.tobytes())
+    doc.close()
+
+    images_ref = core.extract_images("1", "1", pdf_ref, profile=ImageProfile(dpi=30))
+    core.run_llm_on_images("1", "1", images_ref, "prompt", 10)
+
+    json_ref = file_manager.get_json_dir("1", "1")
+    plan = json.loads((file_manager.base_dir / json_ref.location / "batch_plan.json").read_text())
+    assert plan["settings"]["token_budget"] == 4000 and plan["settings"]["max_pages"] == 10
+    assert [f for b in plan["batches"] for f in b["files"]] == file_manager.get_page_files(images_ref)
+    assert len(plan["batches"]) > 1
+    assert all(b["est_tokens"] <= 4000 or len(b["files"]) == 1 for b in plan["batches"])
+    assert file_manager.get_csv_files(file_manager.get_csvs_dir("1", "1")) == [f"batch_{n}.csv" for n in range(1, len(plan["batches"]) + 1)]
+    assert file_manager.get_job_metadata("1", "1")["batch_plan"]["batches"] == len(plan["batches"])
@@ -0,0 +1,53 @@
+import csv
+import io
+
+import pytest
+
+from Core.csv_stream import CsvRowParser, iter_csv_rows
+
+
+ANSWER = '''```csv
+"Trade Name","Pages Referenced","Details / Notes"
+"Electrical","1, 2","Panel ""A"" schedule, see note"
+"Plumbing","3","Two-line
+note"
+
+"HVAC",4,unquoted notes
+```'''
+
+EXPECTED = [
+    ["Trade Name", "Pages Referenced", "Details / Notes"],
+    ["Electrical", "1, 2", 'Panel "A" schedule, see note'],
+    ["Plumbing", "3", "Two-line\nnote"],
+    ["HVAC", "4", "unquoted notes"],
+]
+
+
+# ----------------------- INCREMENTAL PARSING -----------------------------
+def test_whole_answer_parses_without_fences_or_blank_lines():
+    assert list(iter_csv_rows([ANSWER])) == EXPECTED
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 16])
+def test_any_chunking_gives_the_same_rows(size):
+    chunks = [ANSWER[i:i + size] for i in range(0, len(ANSWER), size)]
+    assert list(iter_csv_rows(chunks)) == EXPECTED
+
+
+def test_rows_are_returned_as_soon_as_their_line_ends():
+    parser = CsvRowParser()
+    assert parser.feed('"a","b') == []
+    assert parser.feed('","c"\n"d"') == [["a", "b", "c"]]
+    assert parser.feed(',"e","f"') == []
+    assert parser.close() == [["d", "e", "f"]]
+
+
+def test_matches_csv_module_on_writer_output():
+    rows = [["x", 'quote " inside', "comma, inside"], ["new\nline", "", "tail"]]
+    text = io.StringIO()
+    csv.writer(text).writerows(rows)
+    assert list(iter_csv_rows([text.getvalue()])) == rows
+
+
+def test_unterminated_quote_keeps_the_row():
+    assert list(iter_csv_rows(['"a","b","cut off'])) == [["a", "b", "cut off"]]
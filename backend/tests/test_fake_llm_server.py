@@ -0,0 +1,93 @@
+import random
+
+import openai
+import pytest
+
+from Core.core import Core
+from Core.rendering import ImageProfile
+from Core.llm_client import RateLimiter, RetryPolicy, CircuitBreaker
+from Utils.fake_llm_server import FakeLLMServer, parse_latency
+
+
+# ------------------------ FIXTURES ------------------------
+
+@pytest.fixture()
+def pdf_ref(file_manager, make_pdf):
+    return file_manager.save_pdf("1", "1", make_pdf(6))
+
+def server_core(file_manager, server):
+    core = Core(file_manager=file_manager, contact_service=None, page_triage=False, page_previews=False,
+                use_llm_cache=False, base_url=server.base_url)
+    core.llm.limiter = RateLimiter(requests_per_minute=10**6, tokens_per_minute=10**9)
+    core.llm.retry = RetryPolicy(max_retries=10, base_delay=0.01, max_delay=0.05)
+    core.llm.breaker = CircuitBreaker(min_requests=1000)  # injected errors shouldn't trip the process-wide one
+    return core
+
+
+# ----------------------- FAKE SERVER -----------------------------
+def test_pipeline_runs_offline_against_the_fake_server(file_manager, pdf_ref):
+    with FakeLLMServer(fenced=False) as server:
+        core = server_core(file_manager, server)
+        images_ref = core.extract_images("1", "1", pdf_ref, profile=ImageProfile(dpi=20))
+        csvs_ref = core.run_llm_on_images("1", "1", images_ref, "prompt", 2)
+
+    assert server.stats.requests == 3
+    rows = [file_manager.get_csv_path_by_file_name(csvs_ref, name).read_text().splitlines()[1:]
+            for name in file_manager.get_csv_files(csvs_ref)]
+    pages = [row.split(",")[1] for batch in rows for row in batch]
+    assert pages == [str(n) for n in range(1, 7)]
+
+
+def test_injected_429s_and_500s_are_retried(file_manager, pdf_ref):
+    with FakeLLMServer(rate_limit_rate=0.3, error_rate=0.2, retry_after=0.01, fenced=False, seed=3) as server:
+        core = server_core(file_manager, server)
+        images_ref = core.extract_images("1", "1", pdf_ref, profile=ImageProfile(dpi=20))
+        csvs_ref = core.run_llm_on_images("1", "1", images_ref, "prompt", 1)
+
+    stats = server.stats
+    assert stats.rate_limited + stats.errors > 0
+    assert stats.requests == 6 + stats.rate_limited + stats.errors
+    assert len(file_manager.get_csv_files(csvs_ref)) == 6
+    assert file_manager.get_job_metadata("1", "1")["llm_failed_batches"] == []
+
+
+def test_unknown_route_is_a_404():
+    with FakeLLMServer() as server:
+        client = openai.OpenAI(api_key="fake", base_url=server.base_url, max_retries=0)
+        with pytest.raises(openai.NotFoundError):
+            client.embeddings.create(model="m", input="x")
+
+
+def test_latency_distributions():
+    rng = random.Random(0)
+    assert parse_latency("fixed:0.5", rng)() == 0.5
+    assert all(0.2 <= parse_latency("uniform:0.2,0.4", rng)() <= 0.4 for _ in range(20))
+    assert parse_latency("lognormal:1.0,0.3", rng)() > 0
+    with pytest.raises(ValueError):
+        parse_latency("pareto:1", rng)
+
+
+def test_streamed_answers_are_written_row_by_row(file_manager, pdf_ref):
+    # fenced answers, split into 16 character chunks by the server
+    with FakeLLMServer() as server:
+        core = server_core(file_manager, server)
+        core.stream_llm = True
+        images_ref = core.extract_images("1", "1", pdf_ref, profile=ImageProfile(dpi=20))
+        csvs_ref = core.run_llm_on_images("1", "1", images_ref, "prompt", 4)
+
+    assert file_manager.get_csv_files(csvs_ref) == ["batch_1.csv", "batch_2.csv"]
+    rows = file_manager.get_csv_path_by_file_name(csvs_ref, "batch_2.csv").read_text().splitlines()
+    assert rows[0] == "Trade Name,Pages Referenced,Details / Notes"
+    assert [row.split(",")[1] for row in rows[1:]] == ["5", "6"]
+
+
+def test_failed_streamed_batch_leaves_no_partial_csv(file_manager, pdf_ref):
+    with FakeLLMServer(error_rate=1.0) as server:
+        core = server_core(file_manager, server)
+        core.stream_llm = True
+        core.llm.retry = RetryPolicy(max_retries=0)
+        images_ref = core.extract_images("1", "1", pdf_ref, profile=ImageProfile(dpi=20))
+        csvs_ref = core.run_llm_on_images("1", "1", images_ref, "prompt", 6)
+
+    assert list((file_manager.base_dir / csvs_ref.location).iterdir()) == []
+    assert file_manager.get_job_metadata("1", "1")["llm_failed_batches"][0]["batch"] == 1
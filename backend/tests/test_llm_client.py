@@ -0,0 +1,318 @@
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from Core.llm_client import (LLMClient, RateLimiter, RetryPolicy, TokenBucket, Hedging, LatencyTracker, CircuitBreaker,
+                             CircuitOpenError, retry_after_seconds)
+
+
+# ------------------------ FAKES ------------------------
+
+class FakeClock:
+    """time.monotonic / time.sleep pair where sleeping just moves the clock forward."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def status_error(cls, status, headers=None):
+    response = httpx.Response(status, headers=headers or {}, request=httpx.Request("POST", "http://llm.test/v1/chat/completions"))
+    return cls("error", response=response, body=None)
+
+
+class ScriptedCompletions:
+    """Raises the scripted errors in order, then answers."""
+
+    def __init__(self, errors, usage_tokens=100):
+        self.errors = list(errors)
+        self.usage_tokens = usage_tokens
+        self.calls = 0
+
+    def create(self, model, messages, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(choices=[], usage=SimpleNamespace(total_tokens=self.usage_tokens))
+
+
+def make_client(errors, clock, rpm=600, tpm=100_000, retry=RetryPolicy(max_retries=3, base_delay=1.0, max_delay=30.0),
+                usage_tokens=100):
+    completions = ScriptedCompletions(errors, usage_tokens)
+    limiter = RateLimiter(rpm, tpm, clock=clock, sleep=clock.sleep)
+    client = LLMClient(SimpleNamespace(chat=SimpleNamespace(completions=completions)), limiter, retry,
+                       sleep=clock.sleep, rng=random.Random(0))
+    return client, completions
+
+
+MESSAGES = [{"role": "user", "content": [{"type": "text", "text": "prompt"}]}]
+
+
+# ----------------------- RETRIES -----------------------------
+def test_429_is_retried_after_the_servers_retry_after():
+    clock = FakeClock()
+    client, completions = make_client([status_error(openai.RateLimitError, 429, {"retry-after": "7"})], clock)
+
+    client.create(model="m", messages=MESSAGES)
+
+    assert completions.calls == 2
+    assert clock.sleeps == [7.0]
+
+
+def test_server_errors_back_off_exponentially_with_jitter():
+    clock = FakeClock()
+    errors = [status_error(openai.InternalServerError, 503) for _ in range(3)]
+    client, completions = make_client(errors, clock)
+
+    client.create(model="m", messages=MESSAGES)
+
+    assert completions.calls == 4
+    assert [s <= 2 ** n for n, s in enumerate(clock.sleeps)] == [True, True, True]
+
+
+def test_gives_up_after_max_retries_and_does_not_retry_bad_requests():
+    clock = FakeClock()
+    client, completions = make_client([status_error(openai.RateLimitError, 429) for _ in range(4)], clock)
+    with pytest.raises(openai.RateLimitError):
+        client.create(model="m", messages=MESSAGES)
+    assert completions.calls == 4
+
+    client, completions = make_client([status_error(openai.BadRequestError, 400)], clock)
+    with pytest.raises(openai.BadRequestError):
+        client.create(model="m", messages=MESSAGES)
+    assert completions.calls == 1
+
+
+def test_retry_after_ms_header_wins():
+    error = status_error(openai.RateLimitError, 429, {"retry-after-ms": "1500", "retry-after": "9"})
+    assert retry_after_seconds(error) == 1.5
+
+
+# ----------------------- TOKEN BUCKET -----------------------------
+def test_token_bucket_spreads_requests_over_the_minute():
+    clock = FakeClock()
+    bucket = TokenBucket(per_minute=60, capacity=2, clock=clock, sleep=clock.sleep)
+
+    for _ in range(5):
+        bucket.acquire()
+    # 2 from the burst, then one per second
+    assert clock.now == pytest.approx(3.0)
+
+
+def test_tokens_per_minute_limit_throttles_large_requests():
+    clock = FakeClock()
+    # each call really uses 3000 tokens: the estimate is taken up front, the rest once usage comes back
+    client, _ = make_client([], clock, tpm=6000, usage_tokens=3000)
+
+    for _ in range(4):
+        client.create(model="m", messages=MESSAGES)
+
+    # the 4th call waits until 3 x 3000 used + its own ~1026 estimate fit: 6000 burst, then 100 tokens/s
+    assert clock.now == pytest.approx((3 * 3000 + 1026 - 6000) / 100, abs=1)
+
+
+# ----------------------- STREAMING -----------------------------
+class ScriptedStream(ScriptedCompletions):
+    """Raises the scripted errors in order, then streams the answer in chunks with usage last."""
+
+    def create(self, model, messages, **kwargs):
+        assert kwargs["stream"] is True
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        chunk = lambda text: SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None)
+        return iter([chunk("a,b,"), chunk("c\n"), SimpleNamespace(choices=[], usage=SimpleNamespace(total_tokens=50))])
+
+
+def test_stream_retries_opening_and_yields_text_pieces():
+    clock = FakeClock()
+    completions = ScriptedStream([status_error(openai.RateLimitError, 429, {"retry-after": "2"})])
+    limiter = RateLimiter(600, 100_000, clock=clock, sleep=clock.sleep)
+    client = LLMClient(SimpleNamespace(chat=SimpleNamespace(completions=completions)), limiter,
+                       RetryPolicy(max_retries=3), sleep=clock.sleep, rng=random.Random(0))
+
+    assert list(client.stream(model="m", messages=MESSAGES)) == ["a,b,", "c\n"]
+    assert completions.calls == 2
+    assert clock.sleeps == [2.0]
+
+
+# ----------------------- HEDGING -----------------------------
+class LatencyScriptedCompletions:
+    """The n-th call takes latencies[n] seconds (the last one repeats) and answers with its call number."""
+
+    def __init__(self, latencies):
+        self.latencies = list(latencies)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def create(self, model, messages, **kwargs):
+        with self.lock:
+            n = self.calls
+            self.calls += 1
+        time.sleep(self.latencies[min(n, len(self.latencies) - 1)])
+        return SimpleNamespace(choices=[], usage=None, call=n)
+
+
+def hedged_client(completions, hedging):
+    limiter = RateLimiter(10**6, 10**9)
+    return LLMClient(SimpleNamespace(chat=SimpleNamespace(completions=completions)), limiter, hedging=hedging)
+
+
+def warmed_up(hedging, model="m", seconds=0.01):
+    for _ in range(hedging.min_samples):
+        hedging.tracker(model).record(seconds)
+    return hedging
+
+
+def test_slow_call_is_hedged_and_the_duplicate_wins():
+    hedging = warmed_up(Hedging(percentile=95, budget_ratio=1.0, min_samples=10))
+    client = hedged_client(LatencyScriptedCompletions([1.0, 0.01]), hedging)
+
+    started = time.monotonic()
+    response = client.create(model="m", messages=MESSAGES)
+
+    assert response.call == 1
+    assert time.monotonic() - started < 0.5
+    assert hedging.stats() == {"hedges_sent": 1, "hedges_won": 1}
+
+
+def test_no_hedging_without_budget_or_latency_history():
+    completions = LatencyScriptedCompletions([0.1])
+    # no budget
+    hedging = warmed_up(Hedging(budget_ratio=0.0, min_samples=10))
+    assert hedged_client(completions, hedging).create(model="m", messages=MESSAGES).call == 0
+    # budget, but no latencies seen for this model yet
+    hedging = Hedging(budget_ratio=1.0, min_samples=10)
+    assert hedged_client(completions, hedging).create(model="m", messages=MESSAGES).call == 1
+    assert completions.calls == 2
+    assert hedging.tracker("m").count() == 1
+
+
+def test_only_the_provider_call_is_timed_and_hedged():
+    # queued behind a 429 pause: the local wait is neither hedged nor counted as latency
+    hedging = warmed_up(Hedging(percentile=95, budget_ratio=1.0, min_samples=10), seconds=0.1)
+    completions = LatencyScriptedCompletions([0.02])
+    client = hedged_client(completions, hedging)
+    client.limiter.pause(0.3)
+    assert client.create(model="m", messages=MESSAGES).call == 0
+    assert hedging.stats()["hedges_sent"] == 0
+    assert max(hedging.tracker("m").samples) < 0.2
+
+    # a slow call isn't duplicated when the limiter has no room for the duplicate
+    hedging = warmed_up(Hedging(percentile=95, budget_ratio=1.0, min_samples=10))
+    client = hedged_client(LatencyScriptedCompletions([0.3, 0.01]), hedging)
+    client.limiter = RateLimiter(requests_per_minute=1, tokens_per_minute=10**9)
+    assert client.create(model="m", messages=MESSAGES).call == 0
+    assert hedging.stats()["hedges_sent"] == 0 and hedging.budget.credits >= 1
+
+
+def test_latency_tracker_percentile_uses_a_sliding_window():
+    tracker = LatencyTracker(window=100)
+    for n in range(1, 201):
+        tracker.record(n)
+    # only 101..200 are left
+    assert tracker.percentile(50) == 151
+    assert tracker.percentile(99) == 200
+
+
+# ----------------------- CIRCUIT BREAKER -----------------------------
+def breaker_client(errors, clock, **breaker_kwargs):
+    breaker = CircuitBreaker(min_requests=4, failure_rate=0.5, open_s=30, clock=clock, sleep=clock.sleep, **breaker_kwargs)
+    client, completions = make_client(errors, clock, retry=RetryPolicy(max_retries=0))
+    client.breaker = breaker
+    return client, completions, breaker
+
+
+def test_breaker_opens_fails_fast_and_closes_after_a_good_probe():
+    clock = FakeClock()
+    errors = [status_error(openai.InternalServerError, 503) for _ in range(3)]
+    client, completions, breaker = breaker_client(errors, clock)
+
+    for _ in range(3):
+        with pytest.raises(openai.InternalServerError):
+            client.create(model="m", messages=MESSAGES)
+    assert breaker.snapshot()["state"] == "closed"  # fewer than min_requests so far
+    client.create(model="m", messages=MESSAGES)
+    assert breaker.snapshot()["state"] == "open"   # 3 of 4 failed
+
+    # open: no call reaches the provider
+    with pytest.raises(CircuitOpenError):
+        client.create(model="m", messages=MESSAGES)
+    assert completions.calls == 4
+
+    # after open_s one probe goes through; it succeeds, so the circuit closes
+    clock.now += 30
+    client.create(model="m", messages=MESSAGES)
+    assert breaker.snapshot()["state"] == "closed"
+    assert breaker.snapshot()["times_opened"] == 1
+
+
+def test_failed_probe_reopens_and_parked_calls_wait_for_the_probe():
+    clock = FakeClock()
+    errors = [status_error(openai.InternalServerError, 500) for _ in range(5)]
+    client, completions, breaker = breaker_client(errors, clock, park=True)
+    for _ in range(4):
+        with pytest.raises(openai.InternalServerError):
+            client.create(model="m", messages=MESSAGES)
+
+    # parked until the half-open probe, which fails and opens the circuit again
+    with pytest.raises(openai.InternalServerError):
+        client.create(model="m", messages=MESSAGES)
+    assert clock.now == pytest.approx(30)
+    assert breaker.snapshot()["state"] == "open" and breaker.snapshot()["times_opened"] == 2
+
+    # parks again, and this probe succeeds
+    client.create(model="m", messages=MESSAGES)
+    assert clock.now == pytest.approx(60)
+    assert breaker.snapshot()["state"] == "closed"
+
+
+def test_rate_limits_and_bad_requests_do_not_trip_the_breaker():
+    clock = FakeClock()
+    errors = [status_error(openai.BadRequestError, 400) for _ in range(4)]
+    client, _, breaker = breaker_client(errors, clock)
+    for _ in range(4):
+        with pytest.raises(openai.BadRequestError):
+            client.create(model="m", messages=MESSAGES)
+    assert breaker.snapshot()["state"] == "closed"
+
+
+def test_only_the_half_open_probe_decides_the_circuit():
+    clock = FakeClock()
+    breaker = CircuitBreaker(min_requests=2, failure_rate=0.5, open_s=30, clock=clock, probes=1)
+    early = breaker.before_call()  # admitted while closed, still in flight
+    assert early is None
+    for _ in range(2):
+        breaker.record(failed=True, probe=breaker.before_call())
+    assert breaker.snapshot()["state"] == "open"
+
+    clock.now += 30
+    probe = breaker.before_call()
+    assert probe is not None
+    # the late call from before the circuit opened doesn't close it
+    breaker.record(failed=False, probe=early)
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    # a client error on the probe says nothing about the provider: the slot is freed, the state kept
+    breaker.record(failed=None, probe=probe)
+    assert breaker.state == "half_open"
+    probe = breaker.before_call()
+    breaker.record(failed=False, probe=probe)
+    assert breaker.snapshot()["state"] == "closed"
+    # a probe from that finished round doesn't reopen it
+    breaker.record(failed=True, probe=probe)
+    assert breaker.snapshot()["state"] == "closed" and breaker.snapshot()["requests_in_window"] == 0
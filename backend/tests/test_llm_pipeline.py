@@ -0,0 +1,131 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import fitz
+import httpx
+import openai
+import pytest
+
+from Core.rendering import ImageProfile
+from Core.llm_client import RetryPolicy
+from fakes import FakeCompletions
+
+
+# ------------------------ FAKES ------------------------
+
+class SlowCompletions(FakeCompletions):
+    """FakeCompletions with latency; records how many requests were in flight at once."""
+
+    def __init__(self, latency: float = 0.05):
+        super().__init__()
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def create(self, model, messages, **kwargs):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            return super().create(model, messages, **kwargs)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+# ------------------------ FIXTURES ------------------------
+
+@pytest.fixture()
+def core(make_core):
+    return make_core(page_triage=False, use_llm_cache=False)
+
+@pytest.fixture()
+def pdf_ref(file_manager, make_pdf):
+    return file_manager.save_pdf("1", "1", make_pdf(7))
+
+
+# ----------------------- STREAMING PIPELINE -----------------------------
+def test_streaming_pipeline_matches_staged(core, file_manager, pdf_ref):
+    images_ref = core.extract_images("1", "staged", pdf_ref, profile=ImageProfile(dpi=30))
+    csvs_ref = core.run_llm_on_images("1", "staged", images_ref, "prompt", 3)
+    staged_json_ref = core.combine_to_json("1", "staged", csvs_ref)
+
+    _, streamed_csvs_ref, streamed_json_ref = core.run_streaming_pipeline(
+        "1", "streamed", pdf_ref, "prompt", 3, llm_workers=2
+    )
+
+    staged = json.loads(file_manager.get_combined_json(staged_json_ref))
+    streamed = json.loads(file_manager.get_combined_json(streamed_json_ref))
+    assert streamed == staged
+    assert [e["pages"] for e in streamed["Electrical"]] == [[str(n)] for n in range(1, 8)]
+    assert file_manager.get_csv_files(streamed_csvs_ref) == file_manager.get_csv_files(csvs_ref)
+
+
+# ----------------------- CONCURRENT BATCHES -----------------------------
+def test_concurrent_batches_are_bounded_and_saved_in_order(core, file_manager):
+    doc = fitz.open()
+    for i in range(11):
+        doc.new_page(width=612, height=792).insert_text((72, 72), f"Sheet {i + 1}")
+    pdf_ref = file_manager.save_pdf("1", "1", doc.tobytes())
+    doc.close()
+    images_ref = core.extract_images("1", "1", pdf_ref, profile=ImageProfile(dpi=20))
+
+    completions = SlowCompletions()
+    core.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    csvs_ref = core.run_llm_on_images("1", "1", images_ref, "prompt", 1, concurrency=3)
+
+    assert 1 < completions.max_in_flight <= 3
+    # batch_10 / batch_11 come after batch_9
+    assert file_manager.get_csv_files(csvs_ref) == [f"batch_{n}.csv" for n in range(1, 12)]
+    combined = json.loads(file_manager.get_combined_json(core.combine_to_json("1", "1", csvs_ref)))
+    assert [e["pages"] for e in combined["Electrical"]] == [[str(n)] for n in range(1, 12)]
+
+
+# ----------------------- BISECTION -----------------------------
+class PickyCompletions(FakeCompletions):
+    """Refuses any request with page 3 in it and answers page 5 with a malformed row."""
+
+    def create(self, model, messages, **kwargs):
+        texts = " ".join(b["text"] for b in messages[0]["content"] if b["type"] == "text")
+        if "This is page 3." in texts:
+            self.calls += 1
+            raise ValueError("content rejected")
+        response = super().create(model, messages, **kwargs)
+        message = response.choices[0].message
+        message.content = message.content.replace('"Electrical","5","Lighting on sheet 5"', '"Electrical","5"')
+        return response
+
+
+def test_failed_batches_are_bisected_down_to_the_bad_pages(core, file_manager, pdf_ref):
+    completions = PickyCompletions()
+    core.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    images_ref = core.extract_images("1", "1", pdf_ref, profile=ImageProfile(dpi=20))
+    csvs_ref = core.run_llm_on_images("1", "1", images_ref, "prompt", 7)
+
+    combined = json.loads(file_manager.get_combined_json(core.combine_to_json("1", "1", csvs_ref)))
+    assert [e["pages"] for e in combined["Electrical"]] == [["1"], ["2"], ["4"], ["6"], ["7"]]
+    metadata = file_manager.get_job_metadata("1", "1")
+    assert [(p["page"], p["batch"]) for p in metadata["flagged_pages"]] == [(3, 1), (5, 1)]
+    assert metadata["llm_failed_batches"] == []
+    # 1-7, then 1-3 / 1 / 2-3 / 2 / 3 and 4-7 / 4-5 / 4 / 5 / 6-7
+    assert completions.calls == 11
+
+
+def test_retryable_failures_are_not_bisected(core, file_manager, pdf_ref):
+    class Down(FakeCompletions):
+        def create(self, model, messages, **kwargs):
+            self.calls += 1
+            raise openai.APIConnectionError(request=httpx.Request("POST", "http://llm.test"))
+
+    completions = Down()
+    core.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    core.llm.retry = RetryPolicy(max_retries=0)
+    images_ref = core.extract_images("1", "1", pdf_ref, profile=ImageProfile(dpi=20))
+    core.run_llm_on_images("1", "1", images_ref, "prompt", 7)
+
+    assert completions.calls == 1
+    assert file_manager.get_job_metadata("1", "1")["llm_failed_batches"][0]["batch"] == 1
@@ -0,0 +1,135 @@
+import json
+from types import SimpleNamespace
+
+import fitz
+import pytest
+
+from Core.rendering import ImageProfile
+from Core.model_router import ModelRouter, ModelUsage, sheet_discipline, estimate_cost
+from shared.StorageRef import StorageRef
+from fakes import FakeCompletions
+
+DENSE_PAGES = {2, 5}
+
+
+class ModelRecordingCompletions(FakeCompletions):
+    """FakeCompletions that remembers which model got which pages and reports token usage."""
+
+    def __init__(self):
+        super().__init__()
+        self.pages_by_model = {}
+
+    def create(self, model, messages, **kwargs):
+        response = super().create(model, messages, **kwargs)
+        texts = [b["text"] for b in messages[0]["content"] if b["type"] == "text"]
+        pages = [int(t.split()[-1].rstrip(".)")) for t in texts if t.startswith("(This is page")]
+        self.pages_by_model.setdefault(model, []).extend(pages)
+        response.usage = SimpleNamespace(prompt_tokens=1000 * len(pages), completion_tokens=100 * len(pages),
+                                         total_tokens=1100 * len(pages))
+        return response
+
+
+# ------------------------ FIXTURES ------------------------
+
+@pytest.fixture()
+def completions():
+    return ModelRecordingCompletions()
+
+@pytest.fixture()
+def core(make_core):
+    return make_core(page_triage=False, use_llm_cache=False,
+                     model_router=ModelRouter(small_model="gpt-4o-mini", large_model="gpt-4o"))
+
+@pytest.fixture()
+def pdf_ref(file_manager):
+    # general notes sheets with a little text, and two electrical plans covered in linework
+    doc = fitz.open()
+    for n in range(1, 7):
+        page = doc.new_page(width=612, height=792)
+        if n in DENSE_PAGES:
+            page.insert_text((72, 60), f"E-10{n}")
+            for y in range(80, 760, 6):
+                page.draw_line((40, y), (572, y), width=2)
+        else:
+            page.insert_text((72, 60), f"G-00{n} GENERAL NOTES")
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return file_manager.save_pdf("1", "1", pdf_bytes)
+
+
+# ----------------------- SCORING -----------------------------
+def test_sheet_discipline():
+    assert sheet_discipline("SHEET E-101 LIGHTING PLAN ... E-101") == "E"
+    assert sheet_discipline("see M2.01 and FP-1, FP-2") == "FP"
+    assert sheet_discipline("GENERAL NOTES\n1. All work per code") == "G"
+    assert sheet_discipline("") is None
+
+
+def test_router_sends_dense_sheets_to_large_model():
+    router = ModelRouter(small_model="small", large_model="large", threshold=0.5)
+    assert router.route("page_1.png", 1, 0.01, 50, "G").model == "small"
+    assert router.route("page_2.png", 2, 0.15, 300, "E").model == "large"
+    # lots of ink alone is not enough on a general sheet, a dense MEP sheet is
+    assert router.route("page_3.png", 3, 0.08, 0, "G").model == "small"
+    assert router.route("page_4.png", 4, 0.08, 0, "M").model == "large"
+    assert router.score(1.0, 10**6, "E") == pytest.approx(1.0)
+
+
+def test_model_usage_costs():
+    usage = ModelUsage()
+    usage.record("gpt-4o-mini", 4, 1.0, SimpleNamespace(prompt_tokens=1_000_000, completion_tokens=0))
+    usage.record("gpt-4o-mini", 2, 3.0, None)
+    usage.record("local-model", 1, 0.5, SimpleNamespace(prompt_tokens=10, completion_tokens=10))
+    stats = usage.to_dict()
+    assert stats["gpt-4o-mini"]["calls"] == 2
+    assert stats["gpt-4o-mini"]["pages"] == 6
+    assert stats["gpt-4o-mini"]["latency_s_mean"] == 2.0
+    assert stats["gpt-4o-mini"]["latency_s_max"] == 3.0
+    assert stats["gpt-4o-mini"]["cost_usd"] == pytest.approx(0.15)
+    assert stats["local-model"]["cost_usd"] is None
+    assert estimate_cost("gpt-4o", 0, 1_000_000) == pytest.approx(10.0)
+
+
+# ----------------------- PIPELINE -----------------------------
+def test_simple_pages_go_to_small_model(core, file_manager, pdf_ref, completions):
+    images_ref = core.extract_images("1", "1", pdf_ref, profile=ImageProfile(dpi=30))
+    csvs_ref = core.run_llm_on_images("1", "1", images_ref, "prompt", 10)
+
+    assert sorted(completions.pages_by_model["gpt-4o"]) == sorted(DENSE_PAGES)
+    assert sorted(completions.pages_by_model["gpt-4o-mini"]) == [1, 3, 4, 6]
+    # one batch per model, numbered by their first page
+    plan = file_manager.get_job_json("1", "1", "batch_plan.json")
+    assert [b["model"] for b in plan["batches"]] == ["gpt-4o-mini", "gpt-4o"]
+    assert file_manager.get_csv_files(csvs_ref) == ["batch_1.csv", "batch_2.csv"]
+
+    metadata = file_manager.get_job_metadata("1", "1")
+    routing = metadata["model_routing"]
+    assert routing["pages_per_model"] == {"gpt-4o-mini": 4, "gpt-4o": 2}
+    by_page = {p["page"]: p for p in routing["pages"]}
+    assert by_page[2]["discipline"] == "E" and by_page[1]["discipline"] == "G"
+    assert by_page[2]["score"] > by_page[1]["score"]
+    models = metadata["llm_models"]
+    assert models["gpt-4o"]["calls"] == 1 and models["gpt-4o"]["pages"] == 2
+    assert models["gpt-4o-mini"]["prompt_tokens"] == 4000
+    assert models["gpt-4o"]["cost_usd"] == pytest.approx(estimate_cost("gpt-4o", 2000, 200))
+
+    combined = json.loads(file_manager.get_combined_json(core.combine_to_json("1", "1", csvs_ref)))
+    assert sorted(int(e["pages"][0]) for e in combined["Electrical"]) == list(range(1, 7))
+
+
+def test_streaming_pipeline_routes_pages(core, file_manager, pdf_ref, completions):
+    core.run_streaming_pipeline("1", "1", pdf_ref, "prompt", 10)
+
+    assert sorted(completions.pages_by_model["gpt-4o"]) == sorted(DENSE_PAGES)
+    manifest = file_manager.get_job_json("1", "1", "batch_manifest.json")
+    assert {b["model"]: len(b["pages"]) for b in manifest["batches"]} == {"gpt-4o-mini": 4, "gpt-4o": 2}
+    assert set(file_manager.get_job_metadata("1", "1")["llm_models"]) == {"gpt-4o-mini", "gpt-4o"}
+
+
+def test_routing_off_uses_one_model(core, file_manager, pdf_ref, completions):
+    core.model_router = None
+    images_ref = core.extract_images("1", "1", pdf_ref, profile=ImageProfile(dpi=30))
+    core.run_llm_on_images("1", "1", images_ref, "prompt", 10)
+
+    assert list(completions.pages_by_model) == [core.llm_model]
+    assert "model_routing" not in file_manager.get_job_metadata("1", "1")
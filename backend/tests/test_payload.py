@@ -0,0 +1,119 @@
+import base64
+import json
+import os
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+from Core.llm_client import LLMClient, RateLimiter, RetryPolicy
+from Core.payload import ImageData, image_block, build_chat_body, can_post_body, materialize_messages, post_chat_body, ENCODE_CHUNK
+from Utils.fake_llm_server import FakeLLMServer
+
+
+# ------------------------ FIXTURES ------------------------
+
+@pytest.fixture()
+def image_path(temp_dir):
+    # a few encode chunks plus a remainder that needs padding
+    path = temp_dir / "page_1.png"
+    path.write_bytes(os.urandom(2 * ENCODE_CHUNK + 1000))
+    return path
+
+def messages_with(*images):
+    content = [{"type": "text", "text": "Find the trades — \"quoted\", and\nnewlines"}]
+    for n, image in enumerate(images, start=1):
+        content.append(image_block(image))
+        content.append({"type": "text", "text": f"(This is page {n}.)"})
+    return [{"role": "user", "content": content}]
+
+
+# ----------------------- BODY -----------------------------
+def test_body_matches_plain_serialization(image_path, temp_dir):
+    empty = temp_dir / "page_3.png"
+    empty.write_bytes(b"")
+    buffer = bytearray(os.urandom(4097))
+    messages = messages_with(ImageData("image/png", path=image_path), ImageData("image/jpeg", buffer=buffer),
+                             ImageData("image/png", path=empty))
+
+    body = build_chat_body(model="gpt-4o", messages=messages, stream=True)
+
+    assert json.loads(body) == {"model": "gpt-4o", "messages": materialize_messages(messages), "stream": True}
+    url = json.loads(body)["messages"][0]["content"][1]["image_url"]["url"]
+    assert url == "data:image/png;base64," + base64.b64encode(image_path.read_bytes()).decode()
+    assert json.loads(body)["messages"][0]["content"][3]["image_url"]["url"].startswith("data:image/jpeg;base64,")
+
+
+def test_body_without_images():
+    messages = [{"role": "user", "content": "just text"}]
+    assert bytes(build_chat_body(model="m", messages=messages)) == json.dumps({"model": "m", "messages": messages}).encode()
+
+
+def test_image_data_needs_one_source(image_path):
+    with pytest.raises(ValueError):
+        ImageData("image/png")
+    with pytest.raises(ValueError):
+        ImageData("image/png", path=image_path, buffer=b"x")
+
+
+# ----------------------- POSTING -----------------------------
+def test_post_chat_body_against_fake_server(image_path):
+    with FakeLLMServer(fenced=False) as server:
+        client = openai.OpenAI(api_key="local", base_url=server.base_url, max_retries=0)
+        body = build_chat_body(model="fake", messages=messages_with(ImageData("image/png", path=image_path)))
+
+        response = post_chat_body(client, body)
+        assert response.choices[0].message.content.splitlines()[1].split(",")[1] == '"1"'
+        assert response.usage.prompt_tokens > 765  # the server saw the image block
+
+        stream_body = build_chat_body(model="fake", messages=messages_with(ImageData("image/png", path=image_path)),
+                                      stream=True)
+        text = "".join(chunk.choices[0].delta.content or "" for chunk in post_chat_body(client, stream_body, stream=True)
+                       if chunk.choices)
+        assert text == response.choices[0].message.content
+
+    # the same errors chat.completions.create raises, so LLMClient's retries apply
+    with FakeLLMServer(error_rate=1.0) as server:
+        client = openai.OpenAI(api_key="local", base_url=server.base_url, max_retries=0)
+        with pytest.raises(openai.InternalServerError):
+            post_chat_body(client, body)
+
+
+def test_llm_client_reuses_the_body_across_retries(image_path):
+    with FakeLLMServer(fenced=False, error_rate=0.5, seed=3) as server:
+        client = openai.OpenAI(api_key="local", base_url=server.base_url, max_retries=0)
+        llm = LLMClient(client, RateLimiter(10**6, 10**9), RetryPolicy(max_retries=20, base_delay=0.0, max_delay=0.0))
+        for _ in range(5):
+            response = llm.create(model="fake", messages=messages_with(ImageData("image/png", path=image_path)))
+            assert "sheet 1" in response.choices[0].message.content
+        assert server.stats.errors > 0
+
+
+def test_plain_clients_get_data_urls(image_path):
+    seen = []
+
+    class Completions:
+        def create(self, **kwargs):
+            seen.append(kwargs)
+            raise ValueError("stop")
+
+    llm = LLMClient(SimpleNamespace(chat=SimpleNamespace(completions=Completions())),
+                    RateLimiter(10**6, 10**9), RetryPolicy(max_retries=0))
+    with pytest.raises(ValueError):
+        llm.create(model="m", messages=messages_with(ImageData("image/png", path=image_path)))
+    assert seen[0]["messages"][0]["content"][1]["image_url"]["url"].startswith("data:image/png;base64,")
+
+
+def test_clients_without_the_sdk_internals_fall_back_to_create(image_path, monkeypatch):
+    with FakeLLMServer(fenced=False) as server:
+        client = openai.OpenAI(api_key="local", base_url=server.base_url, max_retries=0)
+        # the installed (pinned) SDK has everything post_chat_body uses
+        assert can_post_body(client)
+
+        owner = next(c for c in type(client).__mro__ if "_make_status_error_from_response" in vars(c))
+        monkeypatch.delattr(owner, "_make_status_error_from_response")
+        assert not can_post_body(client)
+        llm = LLMClient(client, RateLimiter(10**6, 10**9), RetryPolicy(max_retries=0))
+        assert llm._prepare(model="fake", messages=messages_with(ImageData("image/png", path=image_path))).get("body") is None
+        response = llm.create(model="fake", messages=messages_with(ImageData("image/png", path=image_path)))
+        assert "sheet 1" in response.choices[0].message.content
@@ -0,0 +1,72 @@
+import io
+import os
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from fakes import FakeCompletions
+
+
+# ----------------------- UPLOAD DEDUP -----------------------------
+def test_upload_is_stored_once_and_hashed_while_written(file_manager, pdf_bytes):
+    first, blob, sha, size = file_manager.save_pdf_stream("1", "a", io.BytesIO(pdf_bytes), chunk_size=1000)
+    second, blob_again, sha_again, _ = file_manager.save_pdf_stream("2", "b", io.BytesIO(pdf_bytes))
+
+    assert sha == sha_again == file_manager.hash_file(first)
+    assert size == len(pdf_bytes) and blob == blob_again
+    assert len(list((file_manager.base_dir / "pdf_blobs").iterdir())) == 1
+    assert os.path.samefile(file_manager.base_dir / first.location, file_manager.base_dir / second.location)
+
+
+def test_resubmitted_pdf_reuses_artifacts(job_service, file_manager, completions, pdf_bytes):
+    first_job = job_service.job_repo.insert_new_job("1", "first")
+    second_job = job_service.job_repo.insert_new_job("1", "second")
+    other_pages_job = job_service.job_repo.insert_new_job("1", "third")
+
+    first = job_service.submit_pdf("1", first_job, pdf_bytes, "plans.pdf")
+    llm_calls = completions.calls
+    assert first["reused_from_job_id"] is None
+
+    # same bytes, prompt and (differently spelled) page selection: nothing reaches the LLM
+    second = job_service.submit_pdf("1", second_job, io.BytesIO(pdf_bytes), "copy.pdf", pages="1-4")
+    assert completions.calls == llm_calls
+    assert second["reused_from_job_id"] == first_job
+    assert second["contacts_map"] == first["contacts_map"].replace(first_job, second_job)
+    assert file_manager.get_job_metadata("1", second_job)["reused_from"]["job_id"] == first_job
+    assert job_service.pdf_blob_repo.get_blob(file_manager.get_job_metadata("1", second_job)["pdf_sha256"])["upload_count"] == 2
+
+    # a different page selection is a different artifact key
+    third = job_service.submit_pdf("1", other_pages_job, pdf_bytes, "plans.pdf", pages="1-2")
+    assert third["reused_from_job_id"] is None
+    assert completions.calls > llm_calls
+    normalized = json.loads(third["contacts_map"])
+    assert [e["pages"] for e in normalized["Electrical"]] == [["1"], ["2"]]
+
+
+def test_rerunning_a_reusing_job_leaves_the_source_job_alone(job_service, file_manager, pdf_bytes):
+    first_job = job_service.job_repo.insert_new_job("1", "first")
+    second_job = job_service.job_repo.insert_new_job("1", "second")
+    job_service.submit_pdf("1", first_job, pdf_bytes, "plans.pdf")
+    assert job_service.submit_pdf("1", second_job, pdf_bytes, "plans.pdf")["reused_from_job_id"] == first_job
+
+    source_dir = file_manager.base_dir / "user_1" / f"job_{first_job}"
+    def source_files():
+        return {str(p.relative_to(source_dir)): p.read_bytes() for sub in ("csvs", "json", "images")
+                for p in (source_dir / sub).rglob("*") if p.is_file() and p.name != "pipeline_state.json"}
+    before = source_files()
+
+    # a new prompt with different answers re-runs the llm and combine stages of the reusing job only
+    class PlumbingCompletions(FakeCompletions):
+        def create(self, model, messages, **kwargs):
+            answer = super().create(model, messages, **kwargs)
+            answer.choices[0].message.content = answer.choices[0].message.content.replace("Electrical", "Plumbing")
+            return answer
+    job_service.core.client = SimpleNamespace(chat=SimpleNamespace(completions=PlumbingCompletions()))
+    prompt, prompt_ref = job_service.prompt_service.get_active_prompt()
+    job_service.prompt_service.get_active_prompt = lambda: (prompt + "\nBe brief.", prompt_ref)
+    rerun = job_service.submit_pdf("1", second_job, pdf_bytes, "plans.pdf")
+
+    assert "llm" in rerun["recomputed_stages"] and "Plumbing" in json.loads(rerun["contacts_map"])
+    assert source_files() == before
+    assert "Plumbing" not in (source_dir / "json" / "combined.json").read_text()
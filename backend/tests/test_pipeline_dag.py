@@ -0,0 +1,181 @@
+import json
+
+import pytest
+
+from Core.batch_manifest import BatchManifest
+from Core.batch_planner import BatchPlanner
+from Core.pipeline_dag import PipelineDag, PipelineState, Stage
+from Services.PipelineQueue import PipelineProgress
+
+
+# ------------------------ HELPERS ------------------------
+
+def counting_dag(calls, fail=()):
+    # a -> b -> c, plus d after a; each stage counts its runs and returns its inputs
+    def stage(name, inputs=(), after=()):
+        def run(outputs):
+            calls[name] = calls.get(name, 0) + 1
+            if name in fail:
+                raise RuntimeError(f"{name} broke")
+            return {name: {"seen": sorted(outputs)}}
+        return Stage(name, run, inputs=inputs, after=after)
+    return PipelineDag([stage("c", ("z",), ("b",)), stage("b", ("y",), ("a",)), stage("a", ("x",)), stage("d", (), ("a",))])
+
+
+# ----------------------- ENGINE -----------------------------
+def test_only_stages_downstream_of_a_changed_input_run_again(file_manager):
+    calls = {}
+    dag = counting_dag(calls)
+    state = PipelineState(file_manager, "1", "job-1")
+    inputs = {"x": 1, "y": 1, "z": 1}
+    assert [s.name for s in dag.order] == ["a", "b", "c", "d"]
+
+    first = dag.run(inputs, state)
+    assert first.ran == ["a", "b", "c", "d"] and calls == {"a": 1, "b": 1, "c": 1, "d": 1}
+    assert first.outputs["c"] == {"seen": ["a", "b"]}
+
+    # nothing changed; the state survives a reload
+    again = dag.run(inputs, PipelineState.load(file_manager, "1", "job-1"))
+    assert again.ran == [] and again.skipped == ["a", "b", "c", "d"]
+    assert again.outputs["c"] == {"seen": ["a", "b"]}
+
+    assert dag.stale({**inputs, "y": 2}, state) == {"b": "inputs changed", "c": "upstream changed"}
+    changed = dag.run({**inputs, "y": 2}, state)
+    assert changed.ran == ["b", "c"] and calls == {"a": 1, "b": 2, "c": 2, "d": 1}
+
+    # a stage that ran makes everything after it run, even with the same fingerprints
+    forced = dag.run({**inputs, "y": 2}, state, force=["a"])
+    assert forced.ran == ["a", "b", "c", "d"]
+
+
+def test_a_failed_stage_and_everything_after_it_run_again(file_manager):
+    calls = {}
+    state = PipelineState(file_manager, "1", "job-1")
+    inputs = {"x": 1, "y": 1, "z": 1}
+    counting_dag(calls).run(inputs, state)
+
+    with pytest.raises(RuntimeError):
+        counting_dag(calls, fail=("b",)).run({**inputs, "y": 2}, state)
+    assert set(state.stages) == {"a", "d"}
+
+    progress = PipelineProgress()
+    run = counting_dag(calls).run({**inputs, "y": 2}, state, progress)
+    assert run.ran == ["b", "c"]
+    assert progress.stages["a"] == {"status": "skipped", "reason": "unchanged"}
+    assert progress.stages["b"]["status"] == "done"
+
+
+def test_missing_outputs_and_fused_stages(file_manager):
+    calls = {"fused": 0, "b": 0}
+    present = {"a": True}
+
+    def fused(outputs):
+        calls["fused"] += 1
+        return {"a": {"n": 1}, "b": {"n": 2}}
+
+    def b(outputs):
+        calls["b"] += 1
+        return {"b": {"n": 3}}
+    dag = PipelineDag([Stage("a", fused, inputs=("x",), check=lambda o: present["a"]), Stage("b", b, after=("a",))])
+    state = PipelineState(file_manager, "1", "job-1")
+
+    # the first stage completed the second one in the same pass
+    assert dag.run({"x": 1}, state).outputs == {"a": {"n": 1}, "b": {"n": 2}}
+    assert calls == {"fused": 1, "b": 0}
+
+    present["a"] = False
+    assert dag.stale({"x": 1}, state) == {"a": "outputs missing", "b": "upstream changed"}
+
+
+def test_bad_graphs_are_rejected():
+    run = lambda outputs: {}
+    with pytest.raises(ValueError, match="cycle"):
+        PipelineDag([Stage("a", run, after=("b",)), Stage("b", run, after=("a",))])
+    with pytest.raises(ValueError, match="unknown"):
+        PipelineDag([Stage("a", run, after=("nope",))])
+    with pytest.raises(ValueError, match="missing inputs"):
+        PipelineDag([Stage("a", run, inputs=("x",))]).fingerprints({})
+
+
+# ----------------------- SUBMISSION PIPELINE -----------------------------
+def test_schema_change_only_renormalizes(job_service, completions, pdf_bytes):
+    job_id = job_service.job_repo.insert_new_job("1", "plans")
+    first = job_service.submit_pdf("1", job_id, pdf_bytes, "plans.pdf")
+    assert first["recomputed_stages"] == ["render", "llm", "combine", "normalize", "map_contacts"]
+    llm_calls = completions.calls
+
+    again = job_service.submit_pdf("1", job_id, pdf_bytes, "plans.pdf")
+    assert again["recomputed_stages"] == [] and completions.calls == llm_calls
+    assert again["contacts_map_ref"] == first["contacts_map_ref"]
+    assert job_service.job_repo.get_job_by_id(job_id)["status"] == "contact_map_set"
+
+    schema = json.loads(job_service.schema_service.temp_schema)
+    schema["trades"] = [t for t in schema["trades"] if t["name"] != "Electrical"]
+    job_service.schema_service.temp_schema = json.dumps(schema)
+    progress = PipelineProgress()
+    renormalized = job_service.submit_pdf("1", job_id, pdf_bytes, "plans.pdf", progress=progress)
+    assert renormalized["recomputed_stages"] == ["normalize", "map_contacts"]
+    assert completions.calls == llm_calls
+    assert [progress.stages[s]["status"] for s in ("render", "llm", "combine")] == ["skipped"] * 3
+    assert "Electrical" not in json.loads(renormalized["contacts_map"])
+    assert len(json.loads(renormalized["contacts_map"])["undefined"]) == 4
+
+
+def test_new_contacts_remap_and_new_prompt_reprompts(job_service, completions, pdf_bytes):
+    job_id = job_service.job_repo.insert_new_job("1", "plans")
+    job_service.submit_pdf("1", job_id, pdf_bytes, "plans.pdf")
+    llm_calls = completions.calls
+
+    contacts = job_service.core.contact_service.contact_repo
+    contacts.conn.execute("INSERT INTO contact_trades (contact_id, trade) VALUES ('c-1', 'Electrical')")
+    contacts.conn.commit()
+    remapped = job_service.submit_pdf("1", job_id, pdf_bytes, "plans.pdf")
+    assert remapped["recomputed_stages"] == ["map_contacts"]
+    assert job_service.get_contacts_map("1", job_id)["map"]["Electrical"][0]["contacts"] == ["c-1"]
+
+    prompt, prompt_ref = job_service.prompt_service.get_active_prompt()
+    job_service.prompt_service.get_active_prompt = lambda: (prompt + "\nBe brief.", prompt_ref)
+    reprompted = job_service.submit_pdf("1", job_id, pdf_bytes, "plans.pdf")
+    assert reprompted["recomputed_stages"] == ["llm", "combine", "normalize", "map_contacts"]
+    assert completions.calls > llm_calls
+
+
+def test_llm_rerun_with_fewer_batches_drops_the_old_ones(job_service, file_manager, make_pdf):
+    pdf_bytes = make_pdf(25)
+    job_id = job_service.job_repo.insert_new_job("1", "plans")
+    job_service.core.batch_planner = BatchPlanner(token_budget=None, max_latency_s=10)  # a few pages per batch
+    job_service.submit_pdf("1", job_id, pdf_bytes, "plans.pdf")
+    csvs_ref = file_manager.get_csvs_dir("1", job_id)
+    assert len(file_manager.get_csv_files(csvs_ref)) == 9
+
+    job_service.core.batch_planner = None  # batches of 10 pages
+    rerun = job_service.submit_pdf("1", job_id, pdf_bytes, "plans.pdf")
+    assert rerun["recomputed_stages"] == ["llm", "combine", "normalize", "map_contacts"]
+    assert file_manager.get_csv_files(csvs_ref) == ["batch_1.csv", "batch_2.csv", "batch_3.csv"]
+    combined = json.loads(file_manager.get_combined_json(file_manager.get_json_dir("1", job_id)))
+    assert len(combined["Electrical"]) == 25
+    assert len(BatchManifest.load(file_manager, "1", job_id).batches) == 3
+
+
+def test_new_page_selection_only_sends_the_selected_pages(job_service, file_manager, pdf_bytes):
+    job_id = job_service.job_repo.insert_new_job("1", "plans")
+    job_service.submit_pdf("1", job_id, pdf_bytes, "plans.pdf", pages="all")
+    narrowed = job_service.submit_pdf("1", job_id, pdf_bytes, "plans.pdf", pages="2-3")
+    assert narrowed["recomputed_stages"][0] == "render"
+    combined = json.loads(file_manager.get_combined_json(file_manager.get_json_dir("1", job_id)))
+    assert sorted(page for entry in combined["Electrical"] for page in entry["pages"]) == ["2", "3"]
+
+
+def test_rerun_is_queued_with_the_jobs_pdf_and_pages(job_service, pdf_bytes):
+    job_id = job_service.job_repo.insert_new_job("1", "plans")
+    job_service.submit_pdf("1", job_id, pdf_bytes, "plans.pdf", pages="2-3")
+    with pytest.raises(ValueError):
+        job_service.enqueue_rerun("1", job_id, force=["nope"])
+
+    queued = job_service.enqueue_rerun("1", job_id, force=["normalize"])
+    run = job_service.queue_repo.claim_next("w1")
+    assert run["run_id"] == queued["run_id"] and run["kind"] == "rerun"
+    assert run["params"]["pages"] == "2-3" and run["params"]["force"] == ["normalize"]
+
+    result = job_service.run_queued(run, PipelineProgress())
+    assert result["recomputed_stages"] == ["normalize", "map_contacts"]
@@ -0,0 +1,173 @@
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from Services.JobService import JobService
+from Services.ContactService import ContactService
+from Services.PromptService import PromptService
+from Services.SchemaService import SchemaService
+from Services.PipelineQueue import PipelineWorkers, STAGES
+from Repositories.ContactRepository import ContactRepository
+from Repositories.EmailRepository import EmailRepository
+from Repositories.JobRepository import JobRepository
+from Repositories.PipelineQueueRepository import PipelineQueueRepository
+
+
+# ------------------------ FIXTURES ------------------------
+
+@pytest.fixture()
+def db_path(temp_dir):
+    return str(temp_dir / "app.db")
+
+@pytest.fixture()
+def core(make_core, core_options, db_path):
+    return make_core(contact_service=ContactService(ContactRepository(db_path)), **core_options)
+
+@pytest.fixture()
+def make_job_service(file_manager, core, db_path):
+    # one connection per service, like the app's workers
+    def make():
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        return JobService(JobRepository(conn=conn), ContactRepository(conn=conn), file_manager, core, PromptService(None),
+                          SchemaService(), email_repo=EmailRepository(conn=conn), queue_repo=PipelineQueueRepository(conn=conn))
+    return make
+
+def run_workers(make_job_service, queue_repo, until, workers=2, timeout=30.0):
+    # start the workers, wait until until() is true, stop them
+    async def main():
+        pool = PipelineWorkers(make_job_service, queue_repo, workers=workers, poll_interval_s=0.05)
+        await pool.start()
+        try:
+            deadline = asyncio.get_running_loop().time() + timeout
+            while not until():
+                assert asyncio.get_running_loop().time() < deadline, "queue did not drain"
+                await asyncio.sleep(0.02)
+        finally:
+            await pool.stop()
+    asyncio.run(main())
+
+
+# ----------------------- QUEUE TABLE -----------------------------
+def test_claims_in_order_and_once(db_path):
+    repo = PipelineQueueRepository(db_path)
+    first = repo.enqueue("job-1", "1", "submit_pdf", {"n": 1})
+    second = repo.enqueue("job-2", "1", "submit_pdf", {"n": 2})
+
+    claimed = repo.claim_next("w1")
+    assert claimed["run_id"] == first and claimed["status"] == "running" and claimed["attempts"] == 1
+    assert claimed["params"] == {"n": 1}
+    assert PipelineQueueRepository(db_path).claim_next("w2")["run_id"] == second
+    assert repo.claim_next("w1") is None
+    assert repo.has_active_run("job-1")
+
+    repo.finish(first, {"status": "CONTACT_MAP_READY"})
+    assert repo.get_run(first)["result"] == {"status": "CONTACT_MAP_READY"}
+    assert not repo.has_active_run("job-1")
+
+
+def test_a_job_has_at_most_one_active_run(db_path):
+    repo = PipelineQueueRepository(db_path)
+    first = repo.enqueue("job-1", "1", "submit_pdf", {})
+    assert repo.enqueue("job-1", "1", "rerun", {}) is None
+    repo.claim_next("w1")
+    assert PipelineQueueRepository(db_path).enqueue("job-1", "1", "rerun", {}) is None
+    with pytest.raises(sqlite3.IntegrityError):
+        repo.conn.execute("INSERT INTO pipeline_queue (run_id, job_id, user_id, kind, params, status) "
+                          "VALUES ('r2', 'job-1', '1', 'rerun', '{}', 'queued')")
+    repo.conn.rollback()
+
+    repo.finish(first, {})
+    assert repo.enqueue("job-1", "1", "rerun", {}) is not None
+
+
+def test_interrupted_runs_are_requeued_until_max_attempts(db_path):
+    repo = PipelineQueueRepository(db_path)
+    run_id = repo.enqueue("job-1", "1", "submit_pdf", {})
+    for attempt in range(1, 3):
+        assert repo.claim_next("w1")["attempts"] == attempt
+        # the process dies here; the next one starts up
+        assert repo.requeue_interrupted(max_attempts=2) == ((1, 0) if attempt < 2 else (0, 1))
+    assert repo.get_run(run_id)["status"] == "failed"
+
+
+# ----------------------- WORKERS -----------------------------
+def test_queued_submission_runs_in_the_background(make_job_service, file_manager, pdf_bytes):
+    service = make_job_service()
+    job_ids = [service.job_repo.insert_new_job("1", f"plans {n}") for n in range(3)]
+    runs = [service.enqueue_pdf("1", job_id, pdf_bytes, "plans.pdf") for job_id in job_ids]
+    assert all(r["status"] == "QUEUED" for r in runs)
+    assert service.job_repo.get_job_by_id(job_ids[0])["status"] == "queued"
+    with pytest.raises(HTTPException) as exc:
+        service.enqueue_pdf("1", job_ids[0], pdf_bytes, "plans.pdf")
+    assert exc.value.status_code == 409
+
+    run_workers(make_job_service, service.queue_repo,
+                until=lambda: all(service.get_progress("1", j)["status"] == "done" for j in job_ids))
+
+    progress = service.get_progress("1", job_ids[0])
+    assert progress["job_status"] == "contact_map_set"
+    assert [progress["stages"][stage]["status"] for stage in STAGES] == ["done"] * len(STAGES)
+    assert progress["stages"]["render"]["pages"] == 4
+    assert progress["result"]["contacts_map_ref"]["location"]
+    assert progress["result"]["contacts_map_ref"]["mode"] == "local"
+
+
+def test_racing_submissions_queue_the_job_once(make_job_service, pdf_bytes, monkeypatch):
+    first, second = make_job_service(), make_job_service()
+    job_id = first.job_repo.insert_new_job("1", "plans")
+    # both requests get past the active run check before either one has queued
+    monkeypatch.setattr(PipelineQueueRepository, "has_active_run", lambda self, job_id: False)
+    first.enqueue_pdf("1", job_id, pdf_bytes, "plans.pdf")
+    with pytest.raises(HTTPException) as exc:
+        second.enqueue_pdf("1", job_id, pdf_bytes, "plans.pdf")
+    assert exc.value.status_code == 409
+    active = first.queue_repo.conn.execute(
+        "SELECT COUNT(*) FROM pipeline_queue WHERE job_id = ? AND status IN ('queued', 'running')", (job_id,)).fetchone()[0]
+    assert active == 1
+
+
+def test_workers_look_up_contacts_on_their_own_connection(make_job_service, core, pdf_bytes):
+    class MainConnection:
+        def __getattr__(self, name):
+            raise AssertionError(f"worker used the shared contact repository ({name})")
+    core.contact_service = ContactService(MainConnection())
+    service = make_job_service()
+    job_id = service.job_repo.insert_new_job("1", "plans")
+    service.enqueue_pdf("1", job_id, pdf_bytes, "plans.pdf")
+
+    run_workers(make_job_service, service.queue_repo, workers=1,
+                until=lambda: service.get_progress("1", job_id)["status"] in ("done", "failed"))
+    assert service.get_progress("1", job_id)["status"] == "done"
+
+
+def test_failed_run_is_reported(make_job_service, core, pdf_bytes):
+    class Broken:
+        def create(self, **kwargs):
+            raise RuntimeError("boom")
+    core.client = SimpleNamespace(chat=SimpleNamespace(completions=Broken()))
+    service = make_job_service()
+    job_id = service.job_repo.insert_new_job("1", "plans")
+    service.enqueue_pdf("1", job_id, pdf_bytes, "plans.pdf")
+
+    run_workers(make_job_service, service.queue_repo, workers=1,
+                until=lambda: service.get_progress("1", job_id)["status"] == "failed")
+
+    progress = service.get_progress("1", job_id)
+    assert progress["job_status"] == "failed"
+    # failed batches are recorded by the llm stage; the run stops when combine finds no rows
+    assert progress["stages"]["render"]["status"] == "done"
+    assert progress["stage"] == "combine" and "No .csv files" in progress["error"]
+
+
+def test_bad_page_selection_is_not_queued(make_job_service, pdf_bytes):
+    service = make_job_service()
+    job_id = service.job_repo.insert_new_job("1", "plans")
+    with pytest.raises(ValueError):
+        service.enqueue_pdf("1", job_id, pdf_bytes, "plans.pdf", pages="9-12")
+    assert not service.queue_repo.has_active_run(job_id)
+    with pytest.raises(HTTPException) as exc:
+        service.get_progress("1", job_id)
+    assert exc.value.status_code == 404
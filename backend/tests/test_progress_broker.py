@@ -0,0 +1,167 @@
+import asyncio
+import json
+import sqlite3
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from Services.JobService import JobService
+from Services.ContactService import ContactService
+from Services.PromptService import PromptService
+from Services.SchemaService import SchemaService
+from Services.PipelineQueue import PipelineWorkers
+from Services.ProgressBroker import ProgressBroker
+from Repositories.ContactRepository import ContactRepository
+from Repositories.EmailRepository import EmailRepository
+from Repositories.JobRepository import JobRepository
+from Repositories.PipelineQueueRepository import PipelineQueueRepository
+
+
+# ------------------------ FIXTURES ------------------------
+
+@pytest.fixture()
+def broker():
+    return ProgressBroker()
+
+@pytest.fixture()
+def core(make_core, core_options, temp_dir, broker):
+    return make_core(contact_service=ContactService(ContactRepository(str(temp_dir / "app.db"))),
+                     on_progress=broker.publish, **core_options)
+
+@pytest.fixture()
+def make_job_service(temp_dir, core, broker):
+    def make():
+        conn = sqlite3.connect(str(temp_dir / "app.db"), check_same_thread=False)
+        return JobService(JobRepository(conn=conn), ContactRepository(conn=conn), core.file_manager, core, PromptService(None),
+                          SchemaService(), email_repo=EmailRepository(conn=conn), queue_repo=PipelineQueueRepository(conn=conn),
+                          progress_broker=broker)
+    return make
+
+def parse_sse(chunks):
+    # [(id, event, data)] of an SSE body, keep-alive comments dropped
+    events = []
+    for chunk in chunks:
+        if chunk.startswith(":"):
+            continue
+        fields = dict(line.split(": ", 1) for line in chunk.strip().split("\n"))
+        events.append((int(fields["id"]), fields["event"], json.loads(fields["data"])))
+    return events
+
+async def collect(broker, subscription, heartbeat_s=5.0):
+    return parse_sse([chunk async for chunk in broker.stream(subscription, heartbeat_s)])
+
+
+# ----------------------- BROKER -----------------------------
+def test_events_from_worker_threads_reach_every_subscriber_in_order(broker):
+    async def main():
+        broker.bind(asyncio.get_running_loop())
+        broker.publish("job-1", "queued", run_id="r1")
+        watchers = [broker.subscribe("job-1") for _ in range(3)]
+
+        def pipeline():
+            for n in range(1, 6):
+                broker.publish("job-1", "page", page=n, rendered=n, total=5)
+            broker.publish("job-1", "done", run_id="r1", contacts_map_ref={"location": "map.json"})
+        threading.Thread(target=pipeline).start()
+        return await asyncio.gather(*(collect(broker, w) for w in watchers))
+
+    for events in asyncio.run(main()):
+        assert [e[1] for e in events] == ["snapshot"] + ["page"] * 5 + ["done"]
+        assert events[0][2]["status"] == "queued"
+        assert [e[0] for e in events] == list(range(1, 8))
+        assert events[-1][2]["contacts_map_ref"] == {"location": "map.json"}
+    assert not broker.jobs["job-1"].subscribers
+
+
+def test_late_subscriber_gets_a_snapshot_or_what_it_missed(broker):
+    broker.publish("job-1", "queued", run_id="r1")
+    broker.publish("job-1", "stage", stage="render", status="running")
+    broker.publish("job-1", "page", page=1, rendered=1, total=2)
+    broker.publish("job-1", "batch", batch=1, status="failed", error="boom", batches=2, planned=False,
+                   pending=1, running=0, done=0, failed=1)
+    broker.publish("job-1", "failed", run_id="r1", error="No .csv files")
+
+    async def main():
+        return (await collect(broker, broker.subscribe("job-1")),
+                await collect(broker, broker.subscribe("job-1", last_event_id=3)))
+    snapshot, replay = asyncio.run(main())
+
+    # a finished job's snapshot ends the stream straight away
+    assert [e[1] for e in snapshot] == ["snapshot"]
+    state = snapshot[0][2]
+    assert state["status"] == "failed" and state["error"] == "No .csv files"
+    assert state["stages"]["render"]["status"] == "running"
+    assert state["pages_rendered"] == 1 and state["batches"]["failed"] == 1
+    assert [(e[0], e[1]) for e in replay] == [(4, "batch"), (5, "failed")]
+
+
+def test_slow_subscriber_is_sent_a_snapshot_instead_of_the_backlog():
+    broker = ProgressBroker(client_queue=2)
+
+    async def main():
+        broker.bind(asyncio.get_running_loop())
+        subscription = broker.subscribe("job-1")
+        for n in range(1, 11):
+            broker.publish("job-1", "page", page=n, rendered=n, total=10)
+        await asyncio.sleep(0)
+        broker.publish("job-1", "done", run_id="r1")
+        return await collect(broker, subscription)
+
+    events = asyncio.run(main())
+    assert len(events) < 12
+    lagged = [e for e in events[1:] if e[1] == "snapshot"]
+    assert lagged and lagged[-1][2]["pages_rendered"] == 10
+    # the stream still ends on the outcome, as an event or as the final snapshot
+    assert events[-1][1] == "done" or events[-1][2]["status"] == "done"
+
+
+# ----------------------- PIPELINE -----------------------------
+def test_queued_run_streams_pages_batches_stages_and_the_contacts_map(make_job_service, broker, pdf_bytes):
+    service = make_job_service()
+    job_id = service.job_repo.insert_new_job("1", "plans")
+
+    async def main():
+        broker.bind(asyncio.get_running_loop())
+        service.enqueue_pdf("1", job_id, pdf_bytes, "plans.pdf")
+        watcher = service.watch_progress("1", job_id)
+        pool = PipelineWorkers(make_job_service, service.queue_repo, workers=1, poll_interval_s=0.05, broker=broker)
+        await pool.start()
+        try:
+            return await asyncio.wait_for(collect(broker, watcher), 30)
+        finally:
+            await pool.stop()
+    events = asyncio.run(main())
+
+    names = [e[1] for e in events]
+    assert names[0] == "snapshot" and names[1] == "running" and names[-1] == "done"
+    pages = [e[2] for e in events if e[1] == "page"]
+    assert [p["rendered"] for p in pages] == [1, 2, 3, 4] and pages[-1]["total"] == 4
+    batches = [e[2] for e in events if e[1] == "batch"]
+    assert batches and batches[-1]["done"] == batches[-1]["batches"] and not any(b["failed"] for b in batches)
+    stages = [(e[2]["stage"], e[2]["status"]) for e in events if e[1] == "stage"]
+    assert stages[:2] == [("render", "running"), ("render", "done")] and stages[-1] == ("map_contacts", "done")
+    assert events[-1][2]["contacts_map_ref"]["location"]
+
+    # a watcher arriving after the run gets the final state from memory
+    state = broker.snapshot(job_id)["data"]
+    assert state["status"] == "done" and state["pages_rendered"] == 4
+    assert state["stages"]["normalize"]["status"] == "done"
+
+
+def test_watching_needs_an_owned_submitted_job(make_job_service, broker):
+    service = make_job_service()
+    job_id = service.job_repo.insert_new_job("1", "plans")
+    with pytest.raises(HTTPException) as exc:
+        service.watch_progress("2", job_id)
+    assert exc.value.status_code == 403
+    with pytest.raises(HTTPException) as exc:
+        service.watch_progress("1", job_id)
+    assert exc.value.status_code == 404
+
+    # a run from before a restart seeds the broker from its queue row
+    run_id = service.queue_repo.enqueue(job_id, "1", "submit_pdf", {})
+    service.queue_repo.fail(run_id, "boom")
+    subscription = service.watch_progress("1", job_id)
+    assert subscription.initial[0]["data"]["status"] == "failed"
+    assert subscription.initial[0]["data"]["error"] == "boom"
@@ -0,0 +1,288 @@
+import io
+import threading
+from pathlib import Path
+
+import fitz
+import pytest
+from PIL import Image
+
+from Core.core import Core
+from Core.rendering import (ImageProfile, TilingConfig, split_into_slices, parse_page_selection, PAGE_VARIANTS,
+                            PdfDocumentCache)
+from shared.StorageRef import StorageRef
+from Services.ContactService import ContactService
+from Repositories.ContactRepository import ContactRepository
+
+
+# ------------------------ FIXTURES ------------------------
+
+@pytest.fixture()
+def core(file_manager):
+    return Core(file_manager=file_manager, contact_service=ContactService(ContactRepository(":memory:")))
+
+@pytest.fixture()
+def pdf_ref(file_manager, make_pdf):
+    # small synthetic plan set: one line of text per page
+    return file_manager.save_pdf("1", "1", make_pdf(12))
+
+
+# ----------------------- SLICING -----------------------------
+def test_split_into_slices_covers_every_page_in_order():
+    pages = list(range(3, 24))
+    slices = split_into_slices(pages, workers=4, max_slice_pages=5)
+    assert [p for s in slices for p in s] == pages
+    assert all(len(s) <= 5 for s in slices)
+    assert len(slices) >= 4
+
+
+# ----------------------- PROCESS POOL RENDERING -----------------------------
+def test_pool_rendering_matches_serial(core, file_manager, pdf_ref):
+    serial_ref = core.extract_images("1", "serial", pdf_ref, 2, 11, workers=1, profile=ImageProfile(dpi=50))
+    pooled_ref = core.extract_images("1", "pooled", pdf_ref, 2, 11, workers=3, profile=ImageProfile(dpi=50))
+
+    serial_files = file_manager.get_image_files(serial_ref)
+    pooled_files = file_manager.get_image_files(pooled_ref)
+
+    assert pooled_files == serial_files
+    assert pooled_files == [f"page_{n}.png" for n in range(2, 12)]
+    for name in pooled_files:
+        a = file_manager.get_image_path(serial_ref, name).read_bytes()
+        b = file_manager.get_image_path(pooled_ref, name).read_bytes()
+        assert a == b
+
+
+# ----------------------- RENDER CACHE -----------------------------
+def test_resubmitted_pdf_is_served_from_render_cache(core, file_manager, pdf_ref, monkeypatch):
+    import Core.core as core_module
+
+    rendered_pages = []
+    real_render = core_module.render_page_parts
+
+    def counting_render(doc, page_number, profile, tiling=None, variants=()):
+        rendered_pages.append(page_number)
+        return real_render(doc, page_number, profile, tiling, variants)
+
+    monkeypatch.setattr(core_module, "render_page_parts", counting_render)
+
+    first_ref = core.extract_images("1", "first", pdf_ref, 1, 4, workers=1, profile=ImageProfile(dpi=50))
+    assert rendered_pages == [1, 2, 3, 4]
+
+    # same bytes uploaded to another job, overlapping range
+    second_pdf = file_manager.save_pdf("1", "second", Path(file_manager.load_file(pdf_ref)).read_bytes())
+    second_ref = core.extract_images("1", "second", second_pdf, 3, 6, workers=1, profile=ImageProfile(dpi=50))
+    assert rendered_pages == [1, 2, 3, 4, 5, 6]
+
+    assert file_manager.get_image_files(second_ref) == ["page_3.png", "page_4.png", "page_5.png", "page_6.png"]
+    assert (file_manager.get_image_path(first_ref, "page_3.png").read_bytes()
+            == file_manager.get_image_path(second_ref, "page_3.png").read_bytes())
+
+    # a different dpi or encoding is a different cache entry
+    core.extract_images("1", "third", pdf_ref, 1, 1, workers=1, profile=ImageProfile(dpi=60))
+    assert rendered_pages[-1] == 1
+    core.extract_images("1", "fourth", pdf_ref, 1, 1, workers=1, profile=ImageProfile(dpi=50, fmt="jpeg"))
+    assert rendered_pages[-2:] == [1, 1]
+
+
+# ----------------------- IMAGE PROFILES -----------------------------
+@pytest.mark.parametrize("profile, ext, mode", [
+    (ImageProfile(dpi=72, max_long_edge=400, grayscale=True, fmt="jpeg", quality=60), "jpg", "L"),
+    # WebP has no single channel mode, it decodes as RGB
+    (ImageProfile(dpi=72, max_long_edge=400, grayscale=True, fmt="webp", quality=60), "webp", "RGB"),
+])
+def test_image_profile_caps_long_edge_and_encoding(core, file_manager, pdf_ref, profile, ext, mode):
+    images_ref = core.extract_images("1", ext, pdf_ref, 1, 2, workers=1, profile=profile)
+    files = file_manager.get_image_files(images_ref)
+    assert files == [f"page_1.{ext}", f"page_2.{ext}"]
+
+    img = Image.open(file_manager.get_image_path(images_ref, files[0]))
+    assert max(img.size) <= 400
+    assert img.mode == mode
+
+
+# ----------------------- TEXT LAYER FAST PATH -----------------------------
+def test_pages_with_text_layer_skip_rasterization(core, file_manager, temp_dir):
+    doc = fitz.open()
+    notes = doc.new_page(width=612, height=792)
+    notes.insert_textbox(fitz.Rect(50, 50, 560, 740), "GENERAL NOTES: all plumbing per code. " * 20, fontsize=10)
+    drawing = doc.new_page(width=612, height=792)
+    drawing.draw_rect(fitz.Rect(100, 100, 400, 400), color=(0, 0, 0), width=3)
+    pdf_ref = file_manager.save_pdf("1", "1", doc.tobytes())
+    doc.close()
+
+    images_ref = core.extract_images("1", "1", pdf_ref, workers=1, profile=ImageProfile(dpi=50))
+
+    assert file_manager.get_page_files(images_ref) == ["page_1.txt", "page_2.png"]
+    assert file_manager.get_image_files(images_ref) == ["page_2.png"]
+    assert "GENERAL NOTES" in file_manager.get_image_path(images_ref, "page_1.txt").read_text()
+
+    routing = file_manager.get_job_metadata("1", "1")["page_routing"]
+    assert [(p["page"], p["route"]) for p in routing["pages"]] == [(1, "text"), (2, "image")]
+
+    blocks = core._build_content_blocks(images_ref, "prompt", ["page_1.txt", "page_2.png"])
+    assert [b["type"] for b in blocks] == ["text", "text", "text", "image_url", "text"]
+    assert "GENERAL NOTES" in blocks[1]["text"]
+
+
+# ----------------------- TILED RENDERING -----------------------------
+def test_oversized_sheet_is_rendered_as_tiles_within_budget(core, file_manager):
+    doc = fitz.open()
+    sheet = doc.new_page(width=36 * 72, height=24 * 72)  # ARCH-D
+    sheet.draw_rect(fitz.Rect(100, 100, 2000, 1500), color=(0, 0, 0), width=5)
+    doc.new_page(width=612, height=792).draw_circle((300, 300), 100)
+    pdf_ref = file_manager.save_pdf("1", "1", doc.tobytes())
+    doc.close()
+
+    budget = 2 * 1024 * 1024
+    core.tiling = TilingConfig(tile_size=800, overlap=50, page_memory_budget=budget)
+    images_ref = core.extract_images("1", "1", pdf_ref, workers=1, profile=ImageProfile(dpi=72))
+
+    files = file_manager.get_image_files(images_ref)
+    tiles = [f for f in files if f.startswith("page_1_tile_")]
+    # 2592 x 1728 px at 800 px tiles with 50 px overlap -> 4 columns x 3 rows
+    assert len(tiles) == 12
+    assert files[:2] == ["page_1_tile_0_0.png", "page_1_tile_0_1.png"]
+    assert files[-1] == "page_2.png"  # the letter page fits the budget and stays whole
+
+    for name in tiles:
+        img = Image.open(file_manager.get_image_path(images_ref, name))
+        assert img.width * img.height * 3 <= budget
+
+
+# ----------------------- PAGE SELECTION / LAZY RENDER -----------------------------
+@pytest.mark.parametrize("selection, expected", [
+    ("all", list(range(1, 13))),
+    ("1-3, 8,10-11", [1, 2, 3, 8, 10, 11]),
+    ("[5, 2, 5]", [2, 5]),
+    ([12, 1], [1, 12]),
+])
+def test_parse_page_selection(selection, expected):
+    assert parse_page_selection(selection, 12) == expected
+
+
+@pytest.mark.parametrize("selection", ["0-3", "5-2", "13", "a-b", "[]"])
+def test_parse_page_selection_rejects_bad_input(selection):
+    with pytest.raises(ValueError):
+        parse_page_selection(selection, 12)
+
+
+def test_extract_images_renders_only_selected_pages(core, file_manager, pdf_ref):
+    images_ref = core.extract_images("1", "1", pdf_ref, workers=1, profile=ImageProfile(dpi=30), pages="2,5-6")
+    assert file_manager.get_image_files(images_ref) == ["page_2.png", "page_5.png", "page_6.png"]
+
+
+def test_a_smaller_selection_drops_the_other_pages(core, file_manager, pdf_ref):
+    profile = ImageProfile(dpi=30)
+    core.extract_images("1", "1", pdf_ref, workers=1, profile=profile, pages="all")
+    images_ref = core.extract_images("1", "1", pdf_ref, workers=1, profile=profile, pages="2-3")
+    assert file_manager.get_page_files(images_ref) == ["page_2.png", "page_3.png"]
+    assert core.get_page_files("1", "1", images_ref) == ["page_2.png", "page_3.png"]
+    for variant in core.page_variants:
+        assert file_manager.get_image_files(file_manager.get_page_variant_dir("1", "1", variant)) == ["page_2.jpg", "page_3.jpg"]
+
+
+def test_render_page_on_demand_is_cached(core, file_manager, pdf_ref, monkeypatch):
+    import Core.core as core_module
+    import fitz as fitz_module
+
+    renders, opens = [], []
+    real_render, real_open = core_module.render_page_image, fitz_module.open
+    monkeypatch.setattr(core_module, "render_page_image", lambda doc, n, profile: renders.append(n) or real_render(doc, n, profile))
+    monkeypatch.setattr(fitz_module, "open", lambda *a, **kw: opens.append(a) or real_open(*a, **kw))
+
+    profile = ImageProfile(dpi=30)
+    first = core.render_page("1", "1", pdf_ref, 4, profile)
+    again = core.render_page("1", "1", pdf_ref, 4, profile)
+    other = core.render_page("1", "1", pdf_ref, 9, profile)
+
+    assert first == again and first.exists() and other.exists()
+    assert renders == [4, 9]
+    assert len(opens) == 1  # the open document is reused across pages
+
+    with pytest.raises(ValueError):
+        core.render_page("1", "1", pdf_ref, 13, profile)
+
+
+def test_on_demand_renders_of_different_pdfs_do_not_wait_on_each_other(core, file_manager, pdf_ref, make_pdf, monkeypatch):
+    import Core.core as core_module
+
+    other_ref = file_manager.save_pdf("1", "2", make_pdf(3))
+    first_started, first_may_finish = threading.Event(), threading.Event()
+    real_render = core_module.render_page_image
+
+    def render(doc, n, profile):
+        if doc.page_count == 12:  # pdf_ref: hold its render until the other PDF's page is done
+            first_started.set()
+            assert first_may_finish.wait(10)
+        return real_render(doc, n, profile)
+    monkeypatch.setattr(core_module, "render_page_image", render)
+
+    rendered = []
+    first = threading.Thread(target=core.render_page, args=("1", "1", pdf_ref, 4, ImageProfile(dpi=30)))
+    second = threading.Thread(target=lambda: rendered.append(core.render_page("1", "2", other_ref, 2, ImageProfile(dpi=30))))
+    first.start()
+    try:
+        assert first_started.wait(10)
+        second.start()
+        second.join(5)
+        assert rendered and rendered[0].exists()  # while the first PDF's render is still going
+    finally:
+        first_may_finish.set()
+        first.join(10)
+        second.join(10)
+
+
+def test_evicted_pdf_stays_open_while_in_use(file_manager, pdf_ref, make_pdf):
+    cache = PdfDocumentCache(capacity=1)
+    first_path = file_manager.load_file(pdf_ref)
+    second_path = file_manager.load_file(file_manager.save_pdf("1", "2", make_pdf(3)))
+    with cache.open(first_path, lambda: "a") as (doc, _):
+        with cache.open(second_path, lambda: "b") as (other, _):
+            assert other.page_count == 3
+        assert doc.page_count == 12 and not doc.is_closed
+    assert doc.is_closed
+
+
+def test_replaced_pdf_is_reopened(core, file_manager, pdf_ref):
+    assert core.resolve_page_selection(pdf_ref, "1-12") == "1-12"
+
+    # a new upload to the same job and filename
+    doc = fitz.open()
+    for i in range(6):
+        doc.new_page(width=612, height=792).insert_text((72, 72), f"Revised sheet {i + 1}")
+    new_ref, _, _, _ = file_manager.save_pdf_stream("1", "1", io.BytesIO(doc.tobytes()))
+    doc.close()
+    assert new_ref.location == pdf_ref.location
+
+    assert core.resolve_page_selection(new_ref, "1-6") == "1-6"
+    with pytest.raises(ValueError):
+        core.resolve_page_selection(new_ref, "1-12")
+    with pytest.raises(ValueError):
+        core.render_page("1", "1", new_ref, 8, ImageProfile(dpi=30))
+
+
+# ----------------------- THUMBNAIL PYRAMID -----------------------------
+def test_previews_are_written_from_the_same_render(core, file_manager, pdf_ref, monkeypatch):
+    import Core.core as core_module
+
+    fresh_renders = []
+    real_page_render = core_module.render_page_image
+    monkeypatch.setattr(core_module, "render_page_image", lambda doc, n, profile: fresh_renders.append(n) or real_page_render(doc, n, profile))
+
+    images_ref = core.extract_images("1", "1", pdf_ref, 1, 3, workers=1, profile=ImageProfile(dpi=150))
+    assert file_manager.get_image_files(images_ref) == ["page_1.png", "page_2.png", "page_3.png"]
+
+    for variant, vp in PAGE_VARIANTS.items():
+        variant_ref = file_manager.get_page_variant_dir("1", "1", variant)
+        assert file_manager.get_image_files(variant_ref) == ["page_1.jpg", "page_2.jpg", "page_3.jpg"]
+        img = Image.open(file_manager.get_image_path(variant_ref, "page_2.jpg"))
+        assert max(img.size) <= vp.max_long_edge
+        # served straight from the job without another render
+        assert core.render_page("1", "1", pdf_ref, 2, ImageProfile(dpi=150), size=variant) == file_manager.get_image_path(variant_ref, "page_2.jpg")
+
+    # pages outside the extracted range are rendered lazily at the requested size
+    thumb = core.render_page("1", "1", pdf_ref, 7, ImageProfile(dpi=150), size="thumbnail")
+    assert max(Image.open(thumb).size) <= PAGE_VARIANTS["thumbnail"].max_long_edge
+    assert fresh_renders == [7]
+
+    with pytest.raises(ValueError):
+        core.render_page("1", "1", pdf_ref, 2, size="poster")
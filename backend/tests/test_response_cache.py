@@ -0,0 +1,69 @@
+import pytest
+
+from Core.rendering import ImageProfile
+from Core.response_cache import LLMResponseCache, response_cache_key
+from FileManager.FileManager import FileManager
+from shared.StorageRef import StorageMode
+
+
+# ------------------------ FIXTURES ------------------------
+
+@pytest.fixture()
+def file_manager(temp_dir):
+    # storage next to, not around, the cache database
+    return FileManager(mode=StorageMode.LOCAL, base_dir=temp_dir / "storage")
+
+@pytest.fixture()
+def core(make_core, temp_dir):
+    core = make_core(page_triage=False)
+    core.response_cache = LLMResponseCache(str(temp_dir / "llm_cache.db"))
+    return core
+
+@pytest.fixture()
+def pdf_ref(file_manager, make_pdf):
+    return file_manager.save_pdf("1", "1", make_pdf(5))
+
+
+# ----------------------- RESPONSE CACHE -----------------------------
+def test_rerun_is_answered_from_cache(core, file_manager, completions, pdf_ref):
+    images_ref = core.extract_images("1", "first", pdf_ref, profile=ImageProfile(dpi=30))
+    first_csvs = core.run_llm_on_images("1", "first", images_ref, "prompt", 2)
+    assert completions.calls == 3
+    assert file_manager.get_job_metadata("1", "first")["llm_cache"] == {"hits": 0, "misses": 3}
+
+    # another job over the same pages: no LLM calls, same CSVs
+    images_ref = core.extract_images("1", "second", pdf_ref, profile=ImageProfile(dpi=30))
+    second_csvs = core.run_llm_on_images("1", "second", images_ref, "prompt", 2)
+    assert completions.calls == 3
+    assert file_manager.get_job_metadata("1", "second")["llm_cache"] == {"hits": 3, "misses": 0}
+    for name in file_manager.get_csv_files(first_csvs):
+        assert (file_manager.get_csv_path_by_file_name(first_csvs, name).read_bytes()
+                == file_manager.get_csv_path_by_file_name(second_csvs, name).read_bytes())
+
+    # a different prompt or batching misses
+    core.run_llm_on_images("1", "third", images_ref, "another prompt", 2)
+    core.run_llm_on_images("1", "fourth", images_ref, "prompt", 5)
+    assert completions.calls == 3 + 3 + 1
+
+
+def test_cache_key_depends_on_page_labels_and_contents():
+    key = response_cache_key("gpt-4o", "prompt", [("page_1.png", "aa"), ("page_2.png", "bb")])
+    assert key == response_cache_key("gpt-4o", "prompt", [("page_1.png", "aa"), ("page_2.png", "bb")])
+    assert key != response_cache_key("gpt-4o", "prompt", [("page_2.png", "bb"), ("page_1.png", "aa")])
+    assert key != response_cache_key("gpt-4o", "prompt", [("page_3.png", "aa"), ("page_2.png", "bb")])
+    assert key != response_cache_key("gpt-4o-mini", "prompt", [("page_1.png", "aa"), ("page_2.png", "bb")])
+
+
+def test_cache_evicts_least_recently_used_over_size(temp_dir):
+    cache = LLMResponseCache(str(temp_dir / "lru.db"), max_bytes=250)
+    for key in ("a", "b", "c"):
+        cache.put(key, "m", key * 100)
+    # 300 bytes > 250: "a" was the oldest and is gone
+    assert cache.get("a") is None
+    assert cache.get("b") == "b" * 100
+
+    cache.put("d", "m", "d" * 100)
+    # "b" was just read, so "c" is the least recently used now
+    assert cache.get("c") is None
+    assert cache.get("b") is not None and cache.get("d") is not None
+    assert cache.total_bytes() <= 250
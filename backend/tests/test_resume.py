@@ -0,0 +1,104 @@
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from Services.PipelineQueue import PipelineProgress
+from fakes import FakeCompletions
+
+
+class FlakyCompletions(FakeCompletions):
+    """FakeCompletions that fails (not retryably) any request containing a page in `failing_pages`."""
+
+    def __init__(self, failing_pages=()):
+        super().__init__()
+        self.failing_pages = set(failing_pages)
+
+    def create(self, model, messages, **kwargs):
+        texts = " ".join(b["text"] for b in messages[0]["content"] if b["type"] == "text")
+        if any(f"This is page {p}." in texts for p in self.failing_pages):
+            self.calls += 1
+            raise ValueError("model refused")
+        return super().create(model, messages, **kwargs)
+
+
+# ------------------------ FIXTURES ------------------------
+
+@pytest.fixture()
+def completions():
+    return FlakyCompletions(failing_pages=[11])
+
+@pytest.fixture()
+def core_options(core_options):
+    return {**core_options, "bisect_failed_batches": False}  # keep the failing batch failed
+
+@pytest.fixture()
+def pdf_bytes(make_pdf):
+    return make_pdf(12)
+
+
+# ----------------------- RESUME -----------------------------
+@pytest.mark.parametrize("streaming", [False, True])
+def test_resume_reruns_only_the_failed_batch(job_service, file_manager, completions, pdf_bytes, streaming):
+    job_id = job_service.job_repo.insert_new_job("1", "plans")
+    first = job_service.submit_pdf("1", job_id, pdf_bytes, "plans.pdf", streaming=streaming)
+    assert [e["pages"] for e in json.loads(first["contacts_map"])["Electrical"]][-1] == ["10"]
+
+    manifest = file_manager.get_job_json("1", job_id, "batch_manifest.json")
+    assert [(b["status"], b["attempts"]) for b in manifest["batches"]] == [("done", 1), ("failed", 1)]
+    assert manifest["batches"][0]["csv"] == "batch_1.csv" and len(manifest["batches"][0]["csv_sha256"]) == 64
+
+    completions.failing_pages.clear()
+    calls = completions.calls
+    resumed = job_service.resume("1", job_id)
+
+    assert completions.calls == calls + 1
+    assert resumed["rerun_batches"] == [2] and resumed["failed_batches"] == []
+    pages = [e["pages"] for e in json.loads(resumed["contacts_map"])["Electrical"]]
+    assert pages == [[str(n)] for n in range(1, 13)]
+    manifest = file_manager.get_job_json("1", job_id, "batch_manifest.json")
+    assert [(b["status"], b["attempts"]) for b in manifest["batches"]] == [("done", 1), ("done", 2)]
+
+
+def test_resume_reruns_batches_whose_csv_is_missing_or_changed(job_service, file_manager, completions, pdf_bytes):
+    completions.failing_pages.clear()
+    job_id = job_service.job_repo.insert_new_job("1", "plans")
+    job_service.submit_pdf("1", job_id, pdf_bytes, "plans.pdf")
+    csvs_dir = file_manager.base_dir / file_manager.get_csvs_dir("1", job_id).location
+
+    assert job_service.resume("1", job_id)["rerun_batches"] == []
+    (csvs_dir / "batch_1.csv").unlink()
+    (csvs_dir / "batch_2.csv").write_text("truncated")
+    assert job_service.resume("1", job_id)["rerun_batches"] == [1, 2]
+    assert (csvs_dir / "batch_1.csv").exists()
+
+
+def test_resume_without_an_llm_run_is_a_conflict(job_service):
+    job_id = job_service.job_repo.insert_new_job("1", "empty")
+    with pytest.raises(HTTPException) as exc:
+        job_service.resume("1", job_id)
+    assert exc.value.status_code == 409
+
+
+def test_resume_is_queued_once_per_job(job_service, completions, pdf_bytes):
+    job_id = job_service.job_repo.insert_new_job("1", "plans")
+    with pytest.raises(HTTPException) as exc:
+        job_service.enqueue_resume("1", job_id)
+    assert exc.value.status_code == 409
+    job_service.submit_pdf("1", job_id, pdf_bytes, "plans.pdf")
+
+    completions.failing_pages.clear()
+    queued = job_service.enqueue_resume("1", job_id)
+    assert queued["status"] == "QUEUED"
+    # a queued or running run owns the job's manifest and CSVs
+    with pytest.raises(HTTPException) as exc:
+        job_service.enqueue_resume("1", job_id)
+    assert exc.value.status_code == 409
+
+    run = job_service.queue_repo.claim_next("w1")
+    assert run["run_id"] == queued["run_id"] and run["kind"] == "resume"
+    progress = PipelineProgress()
+    result = job_service.run_queued(run, progress)
+    assert result["rerun_batches"] == [2] and "contacts_map" not in result
+    assert progress.stages["render"]["status"] == "skipped"
+    assert [progress.stages[s]["status"] for s in ("llm", "combine", "normalize", "map_contacts")] == ["done"] * 4
@@ -0,0 +1,74 @@
+import json
+
+import fitz
+import pytest
+
+from Core.rendering import ImageProfile
+from shared.StorageRef import StorageRef
+
+
+# ------------------------ FIXTURES ------------------------
+
+@pytest.fixture()
+def core(make_core):
+    return make_core()
+
+def draw_floor_plan(page, rooms: int):
+    for i in range(rooms):
+        r = fitz.Rect(60 + i * 90, 100, 140 + i * 90, 400 + i * 40)
+        page.draw_rect(r, color=(0, 0, 0), width=3)
+        page.insert_text((r.x0 + 5, r.y0 + 20), f"ROOM {i + 1}", fontsize=14)
+
+@pytest.fixture()
+def pdf_ref(file_manager):
+    doc = fitz.open()
+    draw_floor_plan(doc.new_page(width=612, height=792), rooms=3)   # 1
+    doc.new_page(width=612, height=792)                              # 2 blank separator
+    draw_floor_plan(doc.new_page(width=612, height=792), rooms=3)   # 3 repeat of 1
+    draw_floor_plan(doc.new_page(width=612, height=792), rooms=6)   # 4 different sheet
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return file_manager.save_pdf("1", "1", pdf_bytes)
+
+
+# ----------------------- TRIAGE -----------------------------
+def test_triage_drops_blank_and_duplicate_pages(core, file_manager, temp_dir, pdf_ref):
+    images_ref = core.extract_images("1", "1", pdf_ref, profile=ImageProfile(dpi=72))
+
+    kept = core.triage_images("1", "1", images_ref)
+    assert kept == ["page_1.png", "page_4.png"]
+
+    report = json.loads((temp_dir / "user_1/job_1/json/triage_report.json").read_text())
+    assert report["pages_total"] == 4
+    assert report["pages_kept"] == [1, 4]
+    skipped = {s["page"]: s for s in report["skipped"]}
+    assert skipped[2]["reason"] == "blank"
+    assert skipped[3]["reason"] == "near_duplicate"
+    assert skipped[3]["duplicate_of"] == 1
+
+
+def test_triage_can_be_disabled(core, file_manager, pdf_ref):
+    core.page_triage = False
+    images_ref = core.extract_images("1", "1", pdf_ref, profile=ImageProfile(dpi=72))
+    assert core.triage_images("1", "1", images_ref) == ["page_1.png", "page_2.png", "page_3.png", "page_4.png"]
+
+
+def draw_sheet(page, number: str, note: str):
+    # border and title block shared by every sheet of the set; only the sheet number and a note differ
+    page.draw_rect(fitz.Rect(20, 20, 592, 772), color=(0, 0, 0), width=2)
+    page.draw_rect(fitz.Rect(400, 680, 592, 772), color=(0, 0, 0), width=1)
+    page.insert_text((410, 705), "ACME TOWER - PERMIT SET", fontsize=9)
+    page.insert_text((410, 750), number, fontsize=14)
+    page.insert_text((40, 60), note, fontsize=9)
+
+
+def test_sheets_sharing_a_title_block_are_both_kept(core, file_manager):
+    doc = fitz.open()
+    draw_sheet(doc.new_page(width=612, height=792), "E-101", "1. ALL CONDUIT TO BE EMT.")
+    draw_sheet(doc.new_page(width=612, height=792), "M-101", "1. DUCTWORK TO BE GALV.")
+    draw_sheet(doc.new_page(width=612, height=792), "E-101", "1. ALL CONDUIT TO BE EMT.")  # reissued sheet
+    pdf_ref = file_manager.save_pdf("1", "1", doc.tobytes())
+    doc.close()
+
+    images_ref = core.extract_images("1", "1", pdf_ref, profile=ImageProfile(dpi=72))
+    assert core.triage_images("1", "1", images_ref) == ["page_1.png", "page_2.png"]